@@ -0,0 +1,102 @@
+"""Trajectories of the search architecture weights. train_search.py snapshots
+alphas_normal and alphas_reduce every --record_alphas arch steps into a preallocated
+buffer on their device (a copy, no host sync), moves the buffer to the host once per
+epoch (or when it fills up) and rewrites <save>/alphas/stage<k>.npz with everything
+recorded in that stage:
+
+    normal, reduce     (snapshots, 14, ops switched on) raw alphas, --alpha_dtype
+    step, epoch        arch step (within the stage) and epoch of every snapshot
+    switches_normal/   (14, 8) masks mapping the columns back to PRIMITIVES
+    switches_reduce
+    primitives
+
+load_alphas rebuilds full (snapshots, 14, 8) matrices from a stage file.
+"""
+import os
+import numpy as np
+import torch
+
+from genotypes import PRIMITIVES
+
+
+def add_alpha_args(parser):
+    parser.add_argument('--record_alphas', type=int, default=10, help='snapshot the architecture weights every this many arch steps, 0 to disable')
+    parser.add_argument('--alpha_buffer', type=int, default=1024, help='snapshots held on the device between flushes')
+    parser.add_argument('--alpha_dtype', type=str, default='float16', choices=['float16', 'float32'], help='storage type of the snapshots')
+
+
+class AlphaRecorder(object):
+    """records `alphas` (alphas_normal, alphas_reduce) of one search stage whose ops are
+    selected by the switch masks; `step()` after every arch step, `flush(epoch)` at
+    the end of every epoch"""
+
+    def __init__(self, path, alphas, switches_normal, switches_reduce, every=10, capacity=1024, dtype=torch.float16):
+        self.path = path
+        self.alphas = alphas
+        self.every = every
+        # the search drops paths by editing the switch lists in place after the stage
+        self.switches = [np.array(switches_normal, dtype=bool), np.array(switches_reduce, dtype=bool)]
+        self.buffers = [torch.empty((capacity,) + tuple(a.shape), dtype=dtype, device=a.device) for a in alphas]
+        self.count = 0
+        self.steps = 0
+        self.epoch = 0
+        self.index = []
+        self.chunks = [[], []]
+
+    @classmethod
+    def from_args(cls, args, stage, model, switches_normal, switches_reduce, enabled=True):
+        if args.record_alphas <= 0 or not enabled:
+            return None
+        path = os.path.join(args.save, 'alphas', 'stage%d.npz' % stage)
+        return cls(path, model.arch_parameters(), switches_normal, switches_reduce, args.record_alphas,
+                   args.alpha_buffer, getattr(torch, args.alpha_dtype))
+
+    def step(self):
+        if self.steps % self.every == 0:
+            if self.count == len(self.buffers[0]):
+                self._drain()
+            with torch.no_grad():
+                for buffer, alpha in zip(self.buffers, self.alphas):
+                    buffer[self.count].copy_(alpha, non_blocking=True)
+            self.index.append((self.steps, self.epoch))
+            self.count += 1
+        self.steps += 1
+
+    def _drain(self):
+        for chunks, buffer in zip(self.chunks, self.buffers):
+            chunks.append(buffer[:self.count].cpu().numpy())
+        self.count = 0
+
+    def flush(self, epoch):
+        """moves the buffer to the host and rewrites the stage file"""
+        self.epoch = epoch + 1
+        if self.count == 0 and not self.index:
+            return
+        self._drain()
+        if not os.path.exists(os.path.dirname(self.path)):
+            os.makedirs(os.path.dirname(self.path))
+        index = np.array(self.index, dtype=np.int64).reshape(-1, 2)
+        tmp = self.path + '.tmp.npz'
+        np.savez_compressed(tmp, normal=np.concatenate(self.chunks[0]), reduce=np.concatenate(self.chunks[1]),
+                            step=index[:, 0], epoch=index[:, 1], switches_normal=self.switches[0],
+                            switches_reduce=self.switches[1], primitives=np.array(PRIMITIVES))
+        os.replace(tmp, self.path)
+
+
+def load_alphas(path, softmax=True):
+    """the snapshots of a stage file as full (snapshots, 14, len(PRIMITIVES)) float32
+    matrices 'normal' and 'reduce', plus 'step', 'epoch' and 'primitives'. With
+    softmax the rows are the op probabilities of each edge and dropped ops get 0;
+    otherwise the raw alphas, with nan for dropped ops."""
+    with np.load(path) as data:
+        out = {'step': data['step'], 'epoch': data['epoch'], 'primitives': [str(p) for p in data['primitives']]}
+        for cell in ('normal', 'reduce'):
+            alphas = data[cell].astype(np.float32)
+            mask = data['switches_' + cell]
+            if softmax:
+                alphas = np.exp(alphas - alphas.max(axis=-1, keepdims=True))
+                alphas /= alphas.sum(axis=-1, keepdims=True)
+            full = np.full((alphas.shape[0],) + mask.shape, 0. if softmax else np.nan, dtype=np.float32)
+            full[:, mask] = alphas.reshape(alphas.shape[0], -1)
+            out[cell] = full
+    return out
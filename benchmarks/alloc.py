@@ -0,0 +1,117 @@
+"""Allocations and step time of the Zero op and drop_path, before and after making
+them allocation-free, on NetworkCIFAR (drop path) and search Network (Zero) steps.
+
+    python -m benchmarks.alloc --device cpu
+"""
+import argparse
+import contextlib
+import json
+import torch
+import torch.nn as nn
+
+import genotypes
+import model
+import operations
+import model_search
+from benchmarks.common import time_fn, latency_stats, memory_profile
+from genotypes import PRIMITIVES
+
+
+parser = argparse.ArgumentParser("alloc")
+parser.add_argument('--device', type=str, default='cpu', help='cpu or cuda')
+parser.add_argument('--batch_size', type=int, default=32, help='batch size')
+parser.add_argument('--init_channels', type=int, default=16, help='num of init channels')
+parser.add_argument('--layers', type=int, default=8, help='layers of NetworkCIFAR')
+parser.add_argument('--drop_path_prob', type=float, default=0.2, help='drop path probability')
+parser.add_argument('--iters', type=int, default=5, help='timed steps')
+parser.add_argument('--json', type=str, default=None, help='also write the results to this file')
+
+
+# the implementations replaced in operations.Zero / pdarts_utils.drop_path
+def legacy_zero_forward(self, x):
+    n, c, h, w = x.size()
+    h //= self.stride
+    w //= self.stride
+    return x.new_empty(n, c, h, w).fill_(0)
+
+
+def legacy_drop_path(x, drop_prob):
+    if drop_prob > 0.:
+        keep_prob = 1.-drop_prob
+        mask = x.new_empty(x.size(0), 1, 1, 1).bernoulli_(keep_prob)
+        x.div_(keep_prob)
+        x.mul_(mask)
+    return x
+
+
+def legacy_mixed_op_forward(self, x, weights):
+    return sum(w.to(h.dtype) * h for w, h in ((w, op(x)) for w, op in zip(weights, self.m_ops)))
+
+
+@contextlib.contextmanager
+def legacy_ops():
+    saved = operations.Zero.forward, model.drop_path, model_search.MixedOp.forward
+    operations.Zero.forward = legacy_zero_forward
+    model.drop_path = legacy_drop_path
+    model_search.MixedOp.forward = legacy_mixed_op_forward
+    try:
+        yield
+    finally:
+        operations.Zero.forward, model.drop_path, model_search.MixedOp.forward = saved
+
+
+def build(name, args):
+    if name == 'cifar':
+        net = model.NetworkCIFAR(args.init_channels, 10, args.layers, False, genotypes.PDARTS)
+        net.drop_path_prob = args.drop_path_prob
+    else:
+        switches = [[True for j in range(len(PRIMITIVES))] for i in range(14)]
+        net = model_search.Network(args.init_channels, 10, 5, nn.CrossEntropyLoss(),
+                                   switches_normal=switches, switches_reduce=switches)
+    return net
+
+
+def run(name, args, device):
+    torch.manual_seed(0)
+    net = build(name, args).to(device).train()
+    optimizer = torch.optim.SGD(net.parameters(), 0.01, momentum=0.9)
+    input = torch.randn(args.batch_size, 3, 32, 32, device=device)
+    target = torch.randint(0, 10, (args.batch_size,), device=device)
+
+    def step():
+        optimizer.zero_grad()
+        logits = net(input)
+        if isinstance(logits, tuple):
+            logits = logits[0]
+        nn.functional.cross_entropy(logits, target).backward()
+        optimizer.step()
+
+    times = time_fn(step, device, iters=args.iters)
+    result = {'model': name}
+    result.update(latency_stats(times))
+    result.update(memory_profile(step, device))
+    return result
+
+
+def main():
+    args = parser.parse_args()
+    device = torch.device(args.device)
+    results = []
+    for name in ('cifar', 'search'):
+        with legacy_ops():
+            before = run(name, args, device)
+        after = run(name, args, device)
+        for tag, r in (('legacy', before), ('current', after)):
+            r['impl'] = tag
+            results.append(r)
+            print('%-6s %-7s %8.1f ms/step  %6d allocs  %8.1f MB allocated  %8.1f MB peak' % (
+                name, tag, r['p50_ms'], r['allocs'], r['alloc_bytes'] / 2**20, r['peak_bytes'] / 2**20))
+        print('%-6s saved   %8d allocs  %8.1f MB' % (
+            name, before['allocs'] - after['allocs'], (before['alloc_bytes'] - after['alloc_bytes']) / 2**20))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
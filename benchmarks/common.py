@@ -0,0 +1,36 @@
+import torch
+from torch.profiler import profile, ProfilerActivity
+
+# the timing helpers live at the top level, where the scripts outside benchmarks/ import them
+from timing import synchronize, time_fn, latency_stats
+
+
+def memory_profile(fn, device):
+    """allocation count, allocated bytes and peak live bytes of one call of fn.
+    On cuda these come from the caching allocator, on cpu from the profiler's
+    per-op memory accounting (frees are attributed to the op releasing them)."""
+    if device.type == 'cuda':
+        torch.cuda.synchronize(device)
+        torch.cuda.reset_peak_memory_stats(device)
+        before = torch.cuda.memory_stats(device)
+        base = torch.cuda.memory_allocated(device)
+        fn()
+        torch.cuda.synchronize(device)
+        after = torch.cuda.memory_stats(device)
+        return {
+            'allocs': after['allocation.all.allocated'] - before['allocation.all.allocated'],
+            'alloc_bytes': after['allocated_bytes.all.allocated'] - before['allocated_bytes.all.allocated'],
+            'peak_bytes': torch.cuda.max_memory_allocated(device) - base,
+        }
+    with profile(activities=[ProfilerActivity.CPU], profile_memory=True) as prof:
+        fn()
+    events = sorted(prof.events(), key=lambda e: e.time_range.start)
+    allocs, alloc_bytes, live, peak = 0, 0, 0, 0
+    for e in events:
+        usage = e.self_cpu_memory_usage if e.name != '[memory]' else e.cpu_memory_usage
+        if usage > 0:
+            allocs += 1
+            alloc_bytes += usage
+        live += usage
+        peak = max(peak, live)
+    return {'allocs': allocs, 'alloc_bytes': alloc_bytes, 'peak_bytes': peak}
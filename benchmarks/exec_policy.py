@@ -0,0 +1,101 @@
+"""Training-step throughput of NetworkCIFAR and the search Network under each
+execution policy (memory format x autocast precision), on synthetic data.
+
+    python -m benchmarks.exec_policy --device cpu --threads 8
+"""
+import argparse
+import json
+import time
+import torch
+import torch.nn as nn
+
+import genotypes
+import execution
+from model import NetworkCIFAR
+from model_search import Network
+from genotypes import PRIMITIVES
+
+
+parser = argparse.ArgumentParser("exec_policy")
+parser.add_argument('--device', type=str, default='cpu', help='cpu or cuda')
+parser.add_argument('--threads', type=int, default=0, help='intra-op threads, 0 keeps the torch default')
+parser.add_argument('--batch_size', type=int, default=32, help='batch size')
+parser.add_argument('--init_channels', type=int, default=16, help='num of init channels')
+parser.add_argument('--layers', type=int, default=8, help='layers of the discrete network')
+parser.add_argument('--search_layers', type=int, default=5, help='layers of the search network')
+parser.add_argument('--arch', type=str, default='PDARTS', help='genotype of the discrete network')
+parser.add_argument('--warmup', type=int, default=2, help='untimed steps')
+parser.add_argument('--steps', type=int, default=5, help='timed steps')
+parser.add_argument('--json', type=str, default=None, help='also write the results to this file')
+
+
+def build(name, args):
+    if name == 'cifar':
+        model = NetworkCIFAR(args.init_channels, 10, args.layers, False, getattr(genotypes, args.arch))
+        model.drop_path_prob = 0.0
+    else:
+        switches = [[True for j in range(len(PRIMITIVES))] for i in range(14)]
+        model = Network(args.init_channels, 10, args.search_layers, nn.CrossEntropyLoss(),
+                        switches_normal=switches, switches_reduce=switches)
+    return model
+
+
+def train_step(model, optimizer, criterion, policy, input, target):
+    optimizer.zero_grad()
+    with policy.autocast():
+        logits = model(input)
+        if isinstance(logits, tuple):
+            logits = logits[0]
+        loss = criterion(logits, target)
+    policy.backward(loss)
+    policy.step(optimizer, model.parameters(), 5.)
+
+
+def measure(name, policy, args):
+    device = torch.device(args.device)
+    torch.manual_seed(0)
+    model = policy.prepare_model(build(name, args).to(device))
+    model.train()
+    optimizer = torch.optim.SGD(model.parameters(), 0.025, momentum=0.9)
+    criterion = nn.CrossEntropyLoss().to(device)
+    input = policy.prepare_input(torch.randn(args.batch_size, 3, 32, 32, device=device))
+    target = torch.randint(0, 10, (args.batch_size,), device=device)
+    for _ in range(args.warmup):
+        train_step(model, optimizer, criterion, policy, input, target)
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+    start = time.perf_counter()
+    for _ in range(args.steps):
+        train_step(model, optimizer, criterion, policy, input, target)
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+    step_time = (time.perf_counter() - start) / args.steps
+    return {'model': name, 'channels_last': policy.channels_last, 'precision': policy.precision,
+            'step_ms': step_time * 1e3, 'images_per_s': args.batch_size / step_time}
+
+
+def main():
+    args = parser.parse_args()
+    if args.threads > 0:
+        torch.set_num_threads(args.threads)
+    device_type = torch.device(args.device).type
+    precisions = ['fp32', 'bf16'] + (['fp16'] if device_type == 'cuda' else [])
+    results = []
+    for name in ('cifar', 'search'):
+        baseline = None
+        for precision in precisions:
+            for channels_last in (False, True):
+                policy = execution.ExecutionPolicy(device_type, channels_last=channels_last, precision=precision)
+                r = measure(name, policy, args)
+                baseline = baseline or r['images_per_s']
+                r['speedup'] = r['images_per_s'] / baseline
+                results.append(r)
+                print('%-6s %-5s channels_last=%-5s %8.1f ms/step %8.1f img/s  x%.2f' % (
+                    name, precision, channels_last, r['step_ms'], r['images_per_s'], r['speedup']))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,238 @@
+"""Benchmark suite on synthetic data: the search Network of each stage, the discrete
+networks of chosen genotypes, every primitive of operations.OPS, the CIFAR input
+pipeline and genotype derivation. Results are written as JSON and can be compared
+against a stored baseline, failing when a case gets slower than --tolerance.
+
+    python -m benchmarks.suite --device cpu --save baseline.json
+    python -m benchmarks.suite --device cpu --baseline baseline.json
+"""
+import argparse
+import copy
+import json
+import platform
+import re
+import sys
+import time
+import numpy as np
+import torch
+import torch.nn as nn
+import torchvision.datasets as dset
+
+import genotypes
+import pdarts_utils
+import derivation
+from model import NetworkCIFAR, NetworkImageNet
+from model_search import Network
+from operations import OPS
+from genotypes import PRIMITIVES
+from benchmarks.common import synchronize, time_fn, latency_stats, memory_profile
+
+
+parser = argparse.ArgumentParser("suite")
+parser.add_argument('--device', type=str, default='cpu', help='cpu or cuda')
+parser.add_argument('--threads', type=int, default=0, help='intra-op threads, 0 keeps the torch default')
+parser.add_argument('--cases', type=str, default='.*', help='regex selecting the cases to run')
+parser.add_argument('--batch_size', type=int, default=32, help='batch size of the CIFAR cases')
+parser.add_argument('--imagenet_batch_size', type=int, default=8, help='batch size of the ImageNet cases')
+parser.add_argument('--init_channels', type=int, default=16, help='num of init channels of the search network')
+parser.add_argument('--cifar_channels', type=int, default=36, help='num of init channels of NetworkCIFAR')
+parser.add_argument('--cifar_layers', type=int, default=20, help='layers of NetworkCIFAR')
+parser.add_argument('--imagenet_channels', type=int, default=48, help='num of init channels of NetworkImageNet')
+parser.add_argument('--imagenet_layers', type=int, default=14, help='layers of NetworkImageNet')
+parser.add_argument('--arch', action='append', default=[], help='genotypes of the discrete networks, PDARTS by default')
+parser.add_argument('--op_channels', type=int, default=16, help='channels of the primitive cases')
+parser.add_argument('--workers', type=int, default=2, help='loader workers of the data case')
+parser.add_argument('--data_batches', type=int, default=20, help='batches drawn by the data case')
+parser.add_argument('--warmup', type=int, default=2, help='untimed iterations')
+parser.add_argument('--iters', type=int, default=10, help='timed iterations')
+parser.add_argument('--no_memory', action='store_true', default=False, help='skip the peak memory measurement')
+parser.add_argument('--save', type=str, default=None, help='write the results to this JSON file')
+parser.add_argument('--baseline', type=str, default=None, help='JSON results to compare against')
+parser.add_argument('--tolerance', type=float, default=0.10, help='allowed relative slowdown against the baseline')
+
+# operations kept per edge and total layers of the three search stages (train_search.py)
+STAGES = [(8, 5), (5, 11), (3, 17)]
+
+
+def stage_switches(num_ops, seed):
+    """14 edges with `num_ops` primitives switched on, as after progressive dropping"""
+    rng = np.random.RandomState(seed)
+    switches = []
+    for i in range(14):
+        keep = rng.choice(len(PRIMITIVES), num_ops, replace=False)
+        switches.append([j in keep for j in range(len(PRIMITIVES))])
+    return switches
+
+
+def train_step_fn(model, input, target):
+    criterion = nn.CrossEntropyLoss()
+    optimizer = torch.optim.SGD(model.parameters(), 0.025, momentum=0.9)
+
+    def step():
+        optimizer.zero_grad()
+        logits = model(input)
+        if isinstance(logits, tuple):
+            logits = logits[0]
+        criterion(logits, target).backward()
+        optimizer.step()
+    return step
+
+
+def search_cases(args, device):
+    for sp, (num_ops, layers) in enumerate(STAGES):
+        def build(num_ops=num_ops, layers=layers, sp=sp):
+            switches = stage_switches(num_ops, sp)
+            model = Network(args.init_channels, 10, layers, nn.CrossEntropyLoss(),
+                            switches_normal=switches, switches_reduce=copy.deepcopy(switches)).to(device)
+            input = torch.randn(args.batch_size, 3, 32, 32, device=device)
+            target = torch.randint(0, 10, (args.batch_size,), device=device)
+            return train_step_fn(model.train(), input, target), args.batch_size
+        yield 'search/stage%d_ops%d_layers%d' % (sp, num_ops, layers), build
+
+
+def network_cases(args, device):
+    for arch in args.arch or ['PDARTS']:
+        def build_cifar(arch=arch):
+            model = NetworkCIFAR(args.cifar_channels, 10, args.cifar_layers, False, getattr(genotypes, arch)).to(device)
+            model.drop_path_prob = 0.2
+            input = torch.randn(args.batch_size, 3, 32, 32, device=device)
+            target = torch.randint(0, 10, (args.batch_size,), device=device)
+            return train_step_fn(model.train(), input, target), args.batch_size
+
+        def build_imagenet(arch=arch):
+            model = NetworkImageNet(args.imagenet_channels, 1000, args.imagenet_layers, False, getattr(genotypes, arch)).to(device)
+            model.drop_path_prob = 0.0
+            input = torch.randn(args.imagenet_batch_size, 3, 224, 224, device=device)
+            target = torch.randint(0, 1000, (args.imagenet_batch_size,), device=device)
+            return train_step_fn(model.train(), input, target), args.imagenet_batch_size
+        yield 'cifar/%s' % arch, build_cifar
+        yield 'imagenet/%s' % arch, build_imagenet
+
+
+def op_cases(args, device):
+    for name in OPS:
+        for stride in (1, 2):
+            def build(name=name, stride=stride):
+                op = OPS[name](args.op_channels, stride, False).to(device).train()
+                input = torch.randn(args.batch_size, args.op_channels, 32, 32, device=device, requires_grad=True)
+
+                def step():
+                    out = op(input)
+                    if out.requires_grad:
+                        out.sum().backward()
+                return step, args.batch_size
+            yield 'op/%s_s%d' % (name, stride), build
+
+
+def data_cases(args, device):
+    def build():
+        train_transform, _ = pdarts_utils._data_transforms_cifar10(argparse.Namespace(cutout=True, cutout_length=16))
+        data = dset.FakeData(size=args.batch_size * args.data_batches, image_size=(3, 32, 32),
+                             num_classes=10, transform=train_transform)
+        queue = torch.utils.data.DataLoader(data, batch_size=args.batch_size, shuffle=True,
+                                            num_workers=args.workers, pin_memory=device.type == 'cuda')
+
+        def epoch():
+            for input, target in queue:
+                input.to(device, non_blocking=True)
+        return epoch, args.batch_size * args.data_batches
+    yield 'data/cifar10_train', build
+
+
+def derive_genotype(normal_prob, reduce_prob):
+    """the stage dropping and final genotype derivation of train_search.py on fixed probabilities"""
+    switches_normal = [[True for j in range(len(PRIMITIVES))] for i in range(14)]
+    switches_reduce = copy.deepcopy(switches_normal)
+    for sp, num_drop in enumerate([3, 2, 2]):
+        if sp == 2:
+            switches_normal_2 = copy.deepcopy(switches_normal)
+        for switches, probs in ((switches_normal, normal_prob[sp]), (switches_reduce, reduce_prob[sp])):
+            for i in range(14):
+                idxs = [j for j in range(len(PRIMITIVES)) if switches[i][j]]
+                if sp == 2:
+                    drop = derivation.get_min_k_no_zero(probs[i, :len(idxs)], idxs, num_drop)
+                else:
+                    drop = derivation.get_min_k(probs[i, :len(idxs)], num_drop)
+                for idx in drop:
+                    switches[i][idxs[idx]] = False
+    probs = normal_prob[2][:, :3].copy()
+    switches_normal = derivation.keep_2_branches(switches_normal, probs)
+    switches_reduce = derivation.keep_2_branches(switches_reduce, reduce_prob[2][:, :3])
+    genotype = derivation.parse_network(switches_normal, switches_reduce)
+    for max_sk in range(8, -1, -1):
+        while derivation.check_sk_number(switches_normal) > max_sk:
+            probs = derivation.delete_min_sk_prob(switches_normal, switches_normal_2, probs)
+            switches_normal = derivation.keep_1_on(switches_normal_2, probs)
+            switches_normal = derivation.keep_2_branches(switches_normal, probs)
+        genotype = derivation.parse_network(switches_normal, switches_reduce)
+    return genotype
+
+
+def derivation_cases(args, device):
+    def build():
+        rng = np.random.RandomState(0)
+        normal_prob = [rng.dirichlet(np.ones(n), 14) for n in (8, 5, 3)]
+        reduce_prob = [rng.dirichlet(np.ones(n), 14) for n in (8, 5, 3)]
+        return lambda: derive_genotype(normal_prob, reduce_prob), 1
+    yield 'derive/genotype', build
+
+
+def run_case(build, args, device):
+    torch.manual_seed(0)
+    fn, items = build()
+    times = time_fn(fn, device, warmup=args.warmup, iters=args.iters)
+    result = latency_stats(times)
+    result['items_per_s'] = items * 1e3 / result['mean_ms']
+    if not args.no_memory:
+        result['peak_bytes'] = memory_profile(fn, device)['peak_bytes']
+    return result
+
+
+def compare(results, baseline, tolerance):
+    """cases whose median latency grew by more than `tolerance` over the baseline"""
+    regressions = []
+    for name, r in results.items():
+        if name not in baseline:
+            continue
+        ratio = r['p50_ms'] / baseline[name]['p50_ms']
+        r['baseline_p50_ms'] = baseline[name]['p50_ms']
+        r['ratio'] = ratio
+        if ratio > 1. + tolerance:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    args = parser.parse_args()
+    if args.threads > 0:
+        torch.set_num_threads(args.threads)
+    device = torch.device(args.device)
+    pattern = re.compile(args.cases)
+    results = {}
+    for cases in (search_cases, network_cases, op_cases, data_cases, derivation_cases):
+        for name, build in cases(args, device):
+            if not pattern.search(name):
+                continue
+            results[name] = r = run_case(build, args, device)
+            synchronize(device)
+            print('%-36s p50 %9.2f ms  p90 %9.2f ms  %10.1f items/s  peak %8.1f MB' % (
+                name, r['p50_ms'], r['p90_ms'], r['items_per_s'], r.get('peak_bytes', 0) / 2**20))
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f)['results'], args.tolerance)
+        for name in regressions:
+            print('REGRESSION %s: %.2fx the baseline median' % (name, results[name]['ratio']))
+    if args.save:
+        meta = {'time': time.strftime('%Y-%m-%d %H:%M:%S'), 'torch': torch.__version__,
+                'device': str(device), 'threads': torch.get_num_threads(),
+                'platform': platform.platform(), 'args': vars(args)}
+        with open(args.save, 'w') as f:
+            json.dump({'meta': meta, 'results': results}, f, indent=2)
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+import torch
+import torch.fx as fx
+import torch.nn as nn
+from operations import Identity
+
+
+def _concat_buffer(x: torch.Tensor, multiplier: int) -> torch.Tensor:
+    if x.dim() == 4 and x.is_contiguous(memory_format=torch.channels_last) and not x.is_contiguous():
+        memory_format = torch.channels_last
+    else:
+        memory_format = torch.contiguous_format
+    return torch.empty((x.size(0), multiplier * x.size(1), x.size(2), x.size(3)),
+                       dtype=x.dtype, device=x.device, memory_format=memory_format)
+
+
+def _add_into(a: torch.Tensor, b: torch.Tensor, out: torch.Tensor, slot: int) -> torch.Tensor:
+    return torch.add(a, b, out=out.narrow(1, slot * a.size(1), a.size(1)))
+
+
+def _copy_into(a: torch.Tensor, out: torch.Tensor, slot: int) -> torch.Tensor:
+    return out.narrow(1, slot * a.size(1), a.size(1)).copy_(a)
+
+
+def _live_states(steps, indices, concat):
+    live = set(concat)
+    for i in reversed(range(steps)):
+        if 2 + i in live:
+            live.add(indices[2*i])
+            live.add(indices[2*i+1])
+    return live
+
+
+def compile_cell(cell, use_buffer=True):
+    """turns a genotype `model.Cell` into a static fx.GraphModule for inference.
+    States that reach neither the output nor a live node are dropped, Identity ops are
+    inlined and, with `use_buffer`, node sums are written straight into the output tensor.
+    The compiled cell has no drop path and must only be run under torch.no_grad()."""
+    steps, indices, concat = cell._steps, list(cell._indices), list(cell._concat)
+    live = _live_states(steps, indices, concat)
+    slots = {state: slot for slot, state in enumerate(concat)}
+
+    graph = fx.Graph()
+    inputs = [graph.placeholder('s0'), graph.placeholder('s1')]
+    graph.placeholder('drop_prob', type_expr=float, default_value=0.0)
+    states = {}
+    for i in range(2):
+        if i in live:
+            states[i] = graph.call_module('preprocess%d' % i, (inputs[i],))
+
+    buf = None
+    for i in range(steps):
+        if 2 + i not in live:
+            continue
+        hs = []
+        for k in (2*i, 2*i+1):
+            h = states[indices[k]]
+            if not isinstance(cell._ops[k], Identity):
+                h = graph.call_module('_ops.%d' % k, (h,))
+            hs.append(h)
+        if use_buffer and 2 + i in slots:
+            if buf is None:
+                buf = graph.call_function(_concat_buffer, (hs[0], len(concat)))
+            states[2+i] = graph.call_function(_add_into, (hs[0], hs[1], buf, slots[2+i]))
+        else:
+            states[2+i] = graph.call_function(torch.add, (hs[0], hs[1]))
+
+    if use_buffer:
+        for i in (0, 1):
+            if i in slots:
+                if buf is None:
+                    buf = graph.call_function(_concat_buffer, (states[i], len(concat)))
+                graph.call_function(_copy_into, (states[i], buf, slots[i]))
+        graph.output(buf)
+    else:
+        graph.output(graph.call_function(torch.cat, ([states[i] for i in concat],), {'dim': 1}))
+    graph.lint()
+    return fx.GraphModule(cell, graph, class_name='CompiledCell')
+
+
+def compile_network(model, use_buffer=True, script=False):
+    """replaces every cell of a NetworkCIFAR/NetworkImageNet with its compiled
+    graph in place; the network is put in eval mode and returned"""
+    if isinstance(model, (nn.DataParallel, nn.parallel.DistributedDataParallel)):
+        model = model.module
+    model.eval()
+    model.drop_path_prob = 0.0
+    for i, cell in enumerate(model.cells):
+        compiled = compile_cell(cell, use_buffer=use_buffer)
+        if script:
+            compiled = torch.jit.script(compiled)
+        model.cells[i] = compiled
+    return model
@@ -0,0 +1,152 @@
+import math
+import os
+import torch
+import torch.distributed as dist
+import torch.nn as nn
+from torch.utils.data.distributed import DistributedSampler
+
+
+def add_distributed_args(parser):
+    parser.add_argument('--dist_backend', type=str, default='gloo', help='torch.distributed backend used when launched with torchrun')
+
+
+def init_distributed(backend='gloo'):
+    """joins the process group when started by torchrun (WORLD_SIZE > 1)"""
+    if int(os.environ.get('WORLD_SIZE', 1)) > 1 and not dist.is_initialized():
+        dist.init_process_group(backend=backend)
+    return is_distributed()
+
+
+def is_distributed():
+    return dist.is_available() and dist.is_initialized()
+
+
+def get_rank():
+    return dist.get_rank() if is_distributed() else 0
+
+
+def get_world_size():
+    return dist.get_world_size() if is_distributed() else 1
+
+
+def get_local_rank():
+    return int(os.environ.get('LOCAL_RANK', 0))
+
+
+def is_main_process():
+    return get_rank() == 0
+
+
+def broadcast_object(obj):
+    """returns rank 0's value of `obj` on every process"""
+    if not is_distributed():
+        return obj
+    objs = [obj]
+    dist.broadcast_object_list(objs, src=0)
+    return objs[0]
+
+
+def barrier():
+    if is_distributed():
+        dist.barrier()
+
+
+def per_process_batch_size(batch_size):
+    """splits a global batch size across the processes of the group"""
+    world_size = get_world_size()
+    if batch_size % world_size != 0:
+        raise ValueError('batch size {} is not divisible by the world size {}'.format(batch_size, world_size))
+    return batch_size // world_size
+
+
+def wrap_model(model, device):
+    device_ids = [device.index] if device.type == 'cuda' else None
+    return nn.parallel.DistributedDataParallel(model, device_ids=device_ids)
+
+
+def unwrap(model):
+    if isinstance(model, (nn.DataParallel, nn.parallel.DistributedDataParallel)):
+        return model.module
+    return model
+
+
+def reduce_meter(meter, device=None):
+    """sums an AvgrageMeter over all processes, in place"""
+    if not is_distributed():
+        return meter
+    totals = torch.tensor([float(meter.sum), float(meter.cnt)], dtype=torch.float64, device=device)
+    dist.all_reduce(totals)
+    meter.sum, meter.cnt = totals[0].item(), totals[1].item()
+    return meter
+
+
+def dataset_sampler(dataset, shuffle, seed=0):
+    """DistributedSampler over the whole dataset, or None outside a process group"""
+    if not is_distributed():
+        return None
+    return DistributedSampler(dataset, shuffle=shuffle, seed=seed)
+
+
+class DistributedEvalSampler(torch.utils.data.Sampler):
+    """every `num_replicas`-th index of the dataset, in order, without the padding of
+    DistributedSampler: every sample is evaluated exactly once across the group, so
+    some processes may get one sample fewer"""
+
+    def __init__(self, dataset, num_replicas=None, rank=None):
+        self.size = len(dataset)
+        self.num_replicas = num_replicas if num_replicas is not None else get_world_size()
+        self.rank = rank if rank is not None else get_rank()
+
+    def __iter__(self):
+        return iter(range(self.rank, self.size, self.num_replicas))
+
+    def __len__(self):
+        return len(range(self.rank, self.size, self.num_replicas))
+
+
+def eval_sampler(dataset):
+    """DistributedEvalSampler over the whole dataset, or None outside a process group;
+    the meters of the processes are then summed with reduce_meter"""
+    if not is_distributed():
+        return None
+    return DistributedEvalSampler(dataset)
+
+
+def set_sampler_epoch(queue, epoch):
+    sampler = getattr(queue, 'sampler', None)
+    if hasattr(sampler, 'set_epoch'):
+        sampler.set_epoch(epoch)
+
+
+class DistributedSubsetRandomSampler(torch.utils.data.Sampler):
+    """SubsetRandomSampler whose shuffled indices are split across the processes of the
+    group. Every process draws the same permutation for a given epoch and keeps its
+    stride of it, padded so that all processes see the same number of samples."""
+
+    def __init__(self, indices, num_replicas=None, rank=None, seed=0):
+        self.indices = list(indices)
+        self.num_replicas = num_replicas if num_replicas is not None else get_world_size()
+        self.rank = rank if rank is not None else get_rank()
+        self.seed = seed
+        self.epoch = 0
+        self.num_samples = int(math.ceil(len(self.indices) / float(self.num_replicas)))
+        self.total_size = self.num_samples * self.num_replicas
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def __iter__(self):
+        g = torch.Generator()
+        g.manual_seed(self.seed + self.epoch)
+        order = torch.randperm(len(self.indices), generator=g).tolist()
+        order += order[:self.total_size - len(order)]
+        return iter([self.indices[i] for i in order[self.rank:self.total_size:self.num_replicas]])
+
+    def __len__(self):
+        return self.num_samples
+
+
+def subset_sampler(indices, seed=0):
+    if is_distributed():
+        return DistributedSubsetRandomSampler(indices, seed=seed)
+    return torch.utils.data.sampler.SubsetRandomSampler(indices)
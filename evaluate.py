@@ -0,0 +1,200 @@
+"""Evaluates many trained CIFAR networks in one run. The test sets are read once into
+(shared) memory, the checkpoints are spread over a pool of processes, and one table
+with top-1/top-5/loss, throughput and batch-1 latency per model is written.
+
+    python evaluate.py --data ../data --models PDARTS=CIFAR10.pt PC_DARTS=runs/pc/weights.pt
+    python evaluate.py --data ../data --manifest sweep.csv --workers 4 --save sweep_results.csv
+
+A manifest is a CSV with the columns arch and model_path, and optionally dataset
+(cifar10 or cifar100), init_channels, layers and auxiliary, which otherwise take the
+values given on the command line.
+"""
+import argparse
+import csv
+import logging
+import os
+import sys
+import time
+import torch
+import torch.multiprocessing as mp
+import torch.nn as nn
+import torchvision.datasets as dset
+
+import execution
+import fusion
+import compile_cells
+import genotypes
+import pdarts_utils
+from timing import synchronize, time_fn, latency_stats
+from model import NetworkCIFAR as Network
+
+
+parser = argparse.ArgumentParser("evaluate")
+parser.add_argument('--data', type=str, default='../data', help='location of the data corpus')
+parser.add_argument('--models', type=str, nargs='*', default=[], help='ARCH=MODEL_PATH pairs to evaluate')
+parser.add_argument('--manifest', type=str, default='', help='CSV listing the models to evaluate')
+parser.add_argument('--cifar100', action='store_true', default=False, help='evaluate on cifar100 unless the manifest says otherwise')
+parser.add_argument('--init_channels', type=int, default=36, help='num of init channels')
+parser.add_argument('--layers', type=int, default=20, help='total number of layers')
+parser.add_argument('--auxiliary', action='store_true', default=False, help='checkpoints have an auxiliary tower')
+parser.add_argument('--batch_size', type=int, default=256, help='batch size')
+parser.add_argument('--workers', type=int, default=1, help='evaluation processes, spread over the visible gpus')
+parser.add_argument('--fuse', action='store_true', default=False, help='fold BN into convs and drop training-only branches before evaluation')
+parser.add_argument('--compile', action='store_true', default=False, help='compile the genotype cells into static graphs before evaluation')
+parser.add_argument('--latency_iters', type=int, default=20, help='timed batch-1 forwards per model, 0 to skip')
+parser.add_argument('--save', type=str, default='eval_results.csv', help='results table (.csv)')
+execution.add_device_args(parser)
+
+log_format = '%(asctime)s %(message)s'
+
+DATASETS = {
+    'cifar10': (dset.CIFAR10, 10, pdarts_utils._data_transforms_cifar10),
+    'cifar100': (dset.CIFAR100, 100, pdarts_utils._data_transforms_cifar100),
+}
+COLUMNS = ['arch', 'model_path', 'dataset', 'params_mb', 'top1', 'top5', 'loss',
+           'images_per_s', 'latency_mean_ms', 'latency_p90_ms', 'error']
+
+
+def load_test_set(name, root, train=False):
+    """the test (or training) split of `name` as a shared uint8 (N, 3, 32, 32) tensor,
+    int64 labels and the normalization of its valid transform"""
+    dataset_cls, _, data_transforms = DATASETS[name]
+    data = dataset_cls(root=root, train=train, download=True)
+    images = torch.from_numpy(data.data).permute(0, 3, 1, 2).contiguous()
+    labels = torch.tensor(data.targets, dtype=torch.int64)
+    normalize = data_transforms(argparse.Namespace(cutout=False))[1].transforms[-1]
+    return images.share_memory_(), labels.share_memory_(), (normalize.mean, normalize.std)
+
+
+def read_jobs(args):
+    default_dataset = 'cifar100' if args.cifar100 else 'cifar10'
+    jobs = []
+    for spec in args.models:
+        arch, _, path = spec.partition('=')
+        jobs.append({'arch': arch, 'model_path': path})
+    if args.manifest:
+        with open(args.manifest, newline='') as f:
+            jobs.extend(dict((k, v) for k, v in row.items() if v not in (None, '')) for row in csv.DictReader(f))
+    for job in jobs:
+        job.setdefault('dataset', default_dataset)
+        job['init_channels'] = int(job.get('init_channels', args.init_channels))
+        job['layers'] = int(job.get('layers', args.layers))
+        auxiliary = job.get('auxiliary', args.auxiliary)
+        job['auxiliary'] = auxiliary if isinstance(auxiliary, bool) else auxiliary.lower() in ('1', 'true', 'yes')
+        if job['dataset'] not in DATASETS:
+            raise ValueError('Unknown dataset {} for {}'.format(job['dataset'], job['model_path']))
+    return jobs
+
+
+_worker = {}
+
+
+def init_worker(args, test_sets, num_gpus):
+    # worker k of the pool runs on gpu k % num_gpus, or shares the cpu cores with the other workers
+    identity = mp.current_process()._identity
+    index = identity[0] - 1 if identity else 0
+    device = execution.get_device(args.device, index % max(num_gpus, 1))
+    threads = args.threads or max(1, (os.cpu_count() or 1) // max(args.workers, 1))
+    execution.setup_device(device, 0, threads)
+    logging.basicConfig(stream=sys.stdout, level=logging.INFO, format=log_format, datefmt='%m/%d %I:%M:%S %p')
+    _worker.update(args=args, test_sets=test_sets, device=device)
+
+
+def build_model(job, device, args):
+    genotype = getattr(genotypes, job['arch'])
+    num_classes = DATASETS[job['dataset']][1]
+    model = Network(job['init_channels'], num_classes, job['layers'], job['auxiliary'], genotype).to(device)
+    pdarts_utils.load(model, job['model_path'])
+    model.drop_path_prob = 0.0
+    model.eval()
+    params_mb = pdarts_utils.count_parameters_in_MB(model)
+    if args.fuse:
+        model = fusion.fuse_network(model)
+    if args.compile:
+        model = compile_cells.compile_network(model)
+    return model, params_mb
+
+
+def evaluate(model, test_set, device, batch_size):
+    """top-1, top-5, mean loss and images/s of `model` over an in-memory test set"""
+    images, labels, (mean, std) = test_set
+    mean = torch.tensor(mean, device=device).view(1, 3, 1, 1)
+    std = torch.tensor(std, device=device).view(1, 3, 1, 1)
+    criterion = nn.CrossEntropyLoss(reduction='sum')
+    loss = torch.zeros((), dtype=torch.float64, device=device)
+    correct = torch.zeros(2, dtype=torch.float64, device=device)
+    synchronize(device)
+    start = time.perf_counter()
+    with torch.no_grad():
+        for i in range(0, images.size(0), batch_size):
+            input = images[i:i + batch_size].to(device, non_blocking=True).float().div_(255).sub_(mean).div_(std)
+            target = labels[i:i + batch_size].to(device, non_blocking=True)
+            logits, _ = model(input)
+            loss += criterion(logits, target).double()
+            prec1, prec5 = pdarts_utils.accuracy(logits, target, topk=(1, 5))
+            correct += torch.stack([prec1, prec5]).double() * target.size(0)
+    synchronize(device)
+    elapsed = time.perf_counter() - start
+    n = images.size(0)
+    top1, top5 = (correct / n).tolist()
+    return top1, top5, loss.item() / n, n / elapsed
+
+
+def run_job(job):
+    args, device = _worker['args'], _worker['device']
+    row = dict((k, job[k]) for k in ('arch', 'model_path', 'dataset'))
+    try:
+        model, row['params_mb'] = build_model(job, device, args)
+        row['top1'], row['top5'], row['loss'], row['images_per_s'] = evaluate(
+            model, _worker['test_sets'][job['dataset']], device, args.batch_size)
+        if args.latency_iters > 0:
+            x = torch.randn(1, 3, 32, 32, device=device)
+            with torch.no_grad():
+                stats = latency_stats(time_fn(lambda: model(x), device, warmup=3, iters=args.latency_iters))
+            row['latency_mean_ms'], row['latency_p90_ms'] = stats['mean_ms'], stats['p90_ms']
+        logging.info('%s %s: top1 %.2f top5 %.2f loss %.4f', job['arch'], job['model_path'], row['top1'], row['top5'], row['loss'])
+    except Exception as e:
+        logging.warning('%s %s failed: %r', job['arch'], job['model_path'], e)
+        row['error'] = repr(e)
+    return row
+
+
+def write_table(rows, path):
+    with open(path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=COLUMNS)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def main():
+    args = parser.parse_args()
+    logging.basicConfig(stream=sys.stdout, level=logging.INFO, format=log_format, datefmt='%m/%d %I:%M:%S %p')
+    jobs = read_jobs(args)
+    if not jobs:
+        parser.error('nothing to evaluate, pass --models or --manifest')
+    logging.info('args = %s', args)
+    test_sets = dict((name, load_test_set(name, args.data)) for name in sorted(set(job['dataset'] for job in jobs)))
+    num_gpus = torch.cuda.device_count() if execution.get_device(args.device).type == 'cuda' else 0
+
+    start = time.time()
+    if args.workers > 1:
+        with mp.get_context('spawn').Pool(args.workers, initializer=init_worker, initargs=(args, test_sets, num_gpus)) as pool:
+            rows = pool.map(run_job, jobs, chunksize=1)
+    else:
+        init_worker(args, test_sets, num_gpus)
+        rows = [run_job(job) for job in jobs]
+    logging.info('evaluated %d models in %ds', len(rows), time.time() - start)
+
+    write_table(rows, args.save)
+    for row in sorted(rows, key=lambda r: r.get('top1', -1), reverse=True):
+        if 'error' in row:
+            logging.info('%-14s %-8s failed: %s (%s)', row['arch'], row['dataset'], row['error'], row['model_path'])
+            continue
+        logging.info('%-14s %-8s top1 %6.2f top5 %6.2f loss %.4f %7.0f img/s %s (%s)', row['arch'], row['dataset'],
+                     row['top1'], row['top5'], row['loss'], row['images_per_s'],
+                     '%.2f ms' % row['latency_mean_ms'] if 'latency_mean_ms' in row else '', row['model_path'])
+    logging.info('results written to %s', args.save)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,182 @@
+"""Structured run logs. train_search.py, train_cifar.py and train_imagenet.py append one
+JSON record per line to <save>/events.jsonl next to log.txt:
+
+    run_start  script, args (and genotype, params_mb for the evaluation scripts)
+    stage      a search stage begins: stage, channels, layers, drop_rate, params_mb
+    epoch      epoch (and stage), lr, train/valid accuracy and loss, epoch_time, ...
+    alphas     softmax of the search architecture weights, normal and reduce (14 x ops)
+    switches   the primitives still switched on after a search stage drops paths
+    genotype   a derived genotype (with max_skip when skip-connects are restricted)
+    early_stop the learning-curve prediction that stopped a train_cifar.py run
+    run_end    the final numbers and the total time
+
+Every record has 'event' and 'time' (unix seconds). Records are serialized and written
+by a background thread, flushed every few seconds and when the run exits.
+
+    python events.py 'results/*/events.jsonl' --event epoch --save epochs.csv
+"""
+import argparse
+import atexit
+import csv
+import glob
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import sys
+import threading
+import time
+import numpy as np
+import torch
+
+
+def add_event_args(parser):
+    parser.add_argument('--events', type=str, default='events.jsonl', help='structured event log written to the experiment directory, empty to disable')
+
+
+def plain(value):
+    """`value` with tensors, arrays, namedtuples (genotypes) and ranges turned into
+    json-friendly lists and dicts; tensors are copied now, so they may change later"""
+    if isinstance(value, torch.Tensor):
+        return value.detach().cpu().tolist()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, tuple) and hasattr(value, '_asdict'):
+        return dict((k, plain(v)) for k, v in value._asdict().items())
+    if isinstance(value, argparse.Namespace):
+        return plain(vars(value))
+    if isinstance(value, dict):
+        return dict((str(k), plain(v)) for k, v in value.items())
+    if isinstance(value, (list, tuple, range)):
+        return [plain(v) for v in value]
+    return value
+
+
+class EventLog(object):
+    """appends records to a JSON lines file from a background thread; without a path
+    (disabled, or not the main process) `emit` does nothing"""
+
+    def __init__(self, path=None, flush_secs=5.):
+        self.path = path
+        self.flush_secs = flush_secs
+        self._queue = None
+        if path:
+            self._queue = queue.Queue()
+            self._thread = threading.Thread(target=self._write, daemon=True)
+            self._thread.start()
+            atexit.register(self.close)
+
+    @classmethod
+    def from_args(cls, args, enabled=True):
+        if not args.events or not enabled:
+            return cls(None)
+        return cls(os.path.join(args.save, args.events))
+
+    def emit(self, event, **fields):
+        if self._queue is None:
+            return
+        record = {'event': event, 'time': time.time()}
+        record.update((k, plain(v)) for k, v in fields.items())
+        self._queue.put(record)
+
+    def _write(self):
+        with open(self.path, 'a') as f:
+            last_flush = time.time()
+            while True:
+                try:
+                    record = self._queue.get(timeout=self.flush_secs)
+                except queue.Empty:
+                    record = False
+                if record is None:
+                    break
+                if record:
+                    f.write(json.dumps(record, default=str) + '\n')
+                if time.time() - last_flush >= self.flush_secs:
+                    f.flush()
+                    last_flush = time.time()
+
+    def close(self):
+        """writes out everything emitted so far and stops the writer"""
+        if self._queue is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._queue = None
+
+
+def read_events(path, events=None):
+    """the records of one events.jsonl, each with 'run' set to its directory name;
+    with `events`, lines of other kinds are skipped before being parsed"""
+    run = os.path.basename(os.path.dirname(os.path.abspath(path)))
+    keys = ['"event": "%s"' % e for e in events] if events else None
+    records = []
+    with open(path) as f:
+        for line in f:
+            if keys is not None and not any(key in line for key in keys):
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # the last line of a run that is still being written
+                continue
+            record['run'] = run
+            records.append(record)
+    return records
+
+
+def _read(job):
+    return read_events(*job)
+
+
+def load_runs(patterns, events=None, workers=0):
+    """the records of every events.jsonl matching `patterns` (files or run directories),
+    parsed by `workers` processes (all cores by default)"""
+    if isinstance(patterns, str):
+        patterns = [patterns]
+    paths = []
+    for pattern in patterns:
+        for path in sorted(glob.glob(pattern)):
+            paths.append(os.path.join(path, 'events.jsonl') if os.path.isdir(path) else path)
+    jobs = [(path, events) for path in paths if os.path.exists(path)]
+    workers = min(workers or os.cpu_count() or 1, len(jobs))
+    if workers > 1:
+        with multiprocessing.get_context('spawn').Pool(workers) as pool:
+            chunks = pool.map(_read, jobs, chunksize=max(1, len(jobs) // (4 * workers)))
+    else:
+        chunks = [_read(job) for job in jobs]
+    return [record for chunk in chunks for record in chunk]
+
+
+def to_frame(records):
+    """the records as a pandas DataFrame, one column per field"""
+    import pandas
+    return pandas.DataFrame.from_records(records)
+
+
+def main():
+    parser = argparse.ArgumentParser("events")
+    parser.add_argument('runs', type=str, nargs='+', help='events.jsonl files or run directories (globs)')
+    parser.add_argument('--event', type=str, default='epoch', help='comma separated event kinds to export')
+    parser.add_argument('--workers', type=int, default=0, help='parsing processes, 0 for all cores')
+    parser.add_argument('--save', type=str, default='events.csv', help='table of the selected records (.csv)')
+    args = parser.parse_args()
+    logging.basicConfig(stream=sys.stdout, level=logging.INFO, format='%(asctime)s %(message)s', datefmt='%m/%d %I:%M:%S %p')
+
+    start = time.time()
+    records = load_runs(args.runs, args.event.split(','), args.workers)
+    logging.info('%d records of %d runs read in %.2fs', len(records), len(set(r['run'] for r in records)), time.time() - start)
+    columns = ['run']
+    for record in records:
+        columns.extend(k for k in record if k not in columns)
+    with open(args.save, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=columns)
+        writer.writeheader()
+        for record in records:
+            writer.writerow(dict((k, json.dumps(v) if isinstance(v, (list, dict)) else v) for k, v in record.items()))
+    logging.info('written to %s', args.save)
+
+
+if __name__ == '__main__':
+    main()
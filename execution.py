@@ -0,0 +1,129 @@
+import contextlib
+import logging
+import os
+import torch
+import torch.nn as nn
+import torch.backends.cudnn as cudnn
+
+
+PRECISIONS = {
+    'fp32': None,
+    'bf16': torch.bfloat16,
+    'fp16': torch.float16,
+}
+
+
+def add_device_args(parser):
+    parser.add_argument('--device', type=str, default='auto', choices=['auto', 'cuda', 'cpu'], help='device to run on, auto prefers cuda')
+    parser.add_argument('--threads', type=int, default=0, help='intra-op threads on cpu, 0 divides the cores among local processes')
+
+
+def get_device(name='auto', index=0):
+    """resolves --device, falling back to the cpu when cuda is not available"""
+    if name == 'auto':
+        name = 'cuda' if torch.cuda.is_available() else 'cpu'
+    if name == 'cuda' and not torch.cuda.is_available():
+        logging.getLogger(__name__).warning('No GPU device available, running on cpu')
+        name = 'cpu'
+    if name == 'cuda':
+        return torch.device('cuda', index)
+    return torch.device('cpu')
+
+
+def configure_cpu_threads(threads=0):
+    """sets the intra-op thread count, by default the cores of this node divided
+    among the processes started on it"""
+    if threads <= 0:
+        local_procs = int(os.environ.get('LOCAL_WORLD_SIZE', 1))
+        threads = max(1, (os.cpu_count() or 1) // local_procs)
+    torch.set_num_threads(threads)
+    return threads
+
+
+def setup_device(device, seed, threads=0):
+    """seeds torch and tunes the backend of `device`, returns the cpu thread count"""
+    torch.manual_seed(seed)
+    if device.type == 'cuda':
+        torch.cuda.set_device(device)
+        cudnn.benchmark = True
+        cudnn.enabled = True
+        torch.cuda.manual_seed(seed)
+    else:
+        threads = configure_cpu_threads(threads)
+    return threads
+
+
+def loader_kwargs(device, workers):
+    """DataLoader settings for `device`: pinned memory only helps host-to-GPU copies,
+    and persistent workers avoid re-forking the loader every epoch"""
+    kwargs = {'num_workers': workers, 'pin_memory': device.type == 'cuda'}
+    if workers > 0:
+        kwargs['persistent_workers'] = True
+    return kwargs
+
+
+def add_execution_args(parser):
+    parser.add_argument('--channels_last', action='store_true', default=False, help='run models and inputs in channels_last memory format')
+    parser.add_argument('--precision', type=str, default='fp32', choices=list(PRECISIONS), help='autocast precision, weights stay fp32')
+
+
+class ExecutionPolicy(object):
+    """memory format and autocast precision shared by the training and search loops.
+    Parameters (including alphas_normal/alphas_reduce) and their optimizer state stay
+    fp32; only activations run in reduced precision."""
+
+    def __init__(self, device='cuda', channels_last=False, precision='fp32'):
+        if precision not in PRECISIONS:
+            raise ValueError('Unknown precision: {}'.format(precision))
+        self.device = torch.device(device)
+        self.device_type = self.device.type
+        if precision == 'fp16' and self.device_type != 'cuda':
+            raise ValueError('fp16 autocast needs a CUDA device, use bf16 instead')
+        self.channels_last = channels_last
+        self.precision = precision
+        self.dtype = PRECISIONS[precision]
+        # fp16 gradients underflow without loss scaling, bf16 keeps the fp32 exponent range
+        self.scaler = torch.cuda.amp.GradScaler() if precision == 'fp16' else None
+
+    @classmethod
+    def from_args(cls, args, device):
+        return cls(device, channels_last=args.channels_last, precision=args.precision)
+
+    def __repr__(self):
+        return 'ExecutionPolicy(device={}, channels_last={}, precision={})'.format(
+            self.device, self.channels_last, self.precision)
+
+    def prepare_model(self, model):
+        if self.channels_last:
+            model = model.to(memory_format=torch.channels_last)
+        return model
+
+    def prepare_input(self, input):
+        """moves a batch to the device in the policy's memory format"""
+        if self.channels_last:
+            return input.to(self.device, non_blocking=True, memory_format=torch.channels_last)
+        return input.to(self.device, non_blocking=True)
+
+    def prepare_target(self, target):
+        return target.to(self.device, non_blocking=True)
+
+    def autocast(self):
+        if self.dtype is None:
+            return contextlib.nullcontext()
+        return torch.autocast(device_type=self.device_type, dtype=self.dtype)
+
+    def backward(self, loss):
+        if self.scaler is not None:
+            loss = self.scaler.scale(loss)
+        loss.backward()
+
+    def step(self, optimizer, params, grad_clip):
+        """clips and applies the gradients of `params` held by `optimizer`"""
+        if self.scaler is None:
+            nn.utils.clip_grad_norm_(params, grad_clip)
+            optimizer.step()
+            return
+        self.scaler.unscale_(optimizer)
+        nn.utils.clip_grad_norm_(params, grad_clip)
+        self.scaler.step(optimizer)
+        self.scaler.update()
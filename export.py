@@ -0,0 +1,137 @@
+"""Exports a trained genotype to TorchScript and ONNX for inference runtimes.
+
+    python export.py --arch PDARTS --model_path CIFAR10.pt --auxiliary --out pdarts_c10
+    python export.py --arch PDARTS --dataset imagenet --model_path eval-try/model_best.pth.tar --auxiliary --out pdarts_imagenet
+
+ImageNet models are read from the checkpoints train_imagenet.py writes (weights under
+'state_dict', saved from the DataParallel/DDP wrapper or not) and exported at 224px.
+
+The exported network takes a float (N, 3, H, W) batch, normalized like the training
+data, and returns the logits only: BN is folded, the auxiliary head and drop path
+are removed and the cells are compiled to plain graphs, so nothing depends on
+attributes the training scripts set. The batch dimension is dynamic. Both exports
+are checked against the eager model on random batches of every --check_batches size
+(ONNX through onnxruntime, or the reference evaluator of onnx without it).
+"""
+import argparse
+import logging
+import os
+import sys
+import torch
+import torch.nn as nn
+
+import execution
+import fusion
+import compile_cells
+from serve import DATASETS, load_model
+
+
+parser = argparse.ArgumentParser("export")
+parser.add_argument('--arch', type=str, default='PDARTS', help='which architecture to use')
+parser.add_argument('--model_path', type=str, required=True, help='path of the trained model')
+parser.add_argument('--dataset', type=str, default='cifar10', choices=list(DATASETS), help='dataset the model was trained on')
+parser.add_argument('--init_channels', type=int, default=0, help='num of init channels, 0 for the dataset default')
+parser.add_argument('--layers', type=int, default=0, help='total number of layers, 0 for the dataset default')
+parser.add_argument('--auxiliary', action='store_true', default=False, help='the checkpoint has an auxiliary tower')
+parser.add_argument('--out', type=str, default='model', help='output prefix, writes <out>.pt and <out>.onnx')
+parser.add_argument('--formats', type=str, default='torchscript,onnx', help='comma separated: torchscript, onnx')
+parser.add_argument('--opset', type=int, default=13, help='ONNX opset version')
+parser.add_argument('--input_size', type=int, default=0, help='image side, 0 for 32 on cifar and 224 on imagenet')
+parser.add_argument('--check_batches', type=str, default='1,7', help='batch sizes the exports are validated on')
+parser.add_argument('--atol', type=float, default=1e-4, help='largest logit difference accepted')
+
+
+class InferenceNetwork(nn.Module):
+    """the logits of a fused, compiled network, without the (logits, logits_aux) tuple"""
+
+    def __init__(self, net):
+        super(InferenceNetwork, self).__init__()
+        self.net = net
+
+    def forward(self, input):
+        logits, _ = self.net(input)
+        return logits
+
+
+def prepare(model):
+    net = fusion.fuse_network(model)
+    compile_cells.compile_network(net, use_buffer=False)
+    return InferenceNetwork(net).eval()
+
+
+def export_torchscript(module, example, path):
+    with torch.no_grad():
+        traced = torch.jit.trace(module, example)
+    traced = torch.jit.freeze(traced)
+    torch.jit.save(traced, path)
+    return torch.jit.load(path)
+
+
+def export_onnx(module, example, path, opset):
+    with torch.no_grad():
+        torch.onnx.export(module, example, path, input_names=['input'], output_names=['logits'],
+                          dynamic_axes={'input': {0: 'batch'}, 'logits': {0: 'batch'}}, opset_version=opset)
+    try:
+        import onnxruntime
+        session = onnxruntime.InferenceSession(path, providers=['CPUExecutionProvider'])
+    except ImportError:
+        # the (slow) reference implementation shipped with onnx still checks the graph
+        try:
+            from onnx.reference import ReferenceEvaluator
+        except ImportError:
+            logging.warning('neither onnxruntime nor onnx is installed, %s is exported but not validated', path)
+            return None
+        session = ReferenceEvaluator(path)
+    return lambda x: torch.from_numpy(session.run(['logits'], {'input': x.numpy()})[0])
+
+
+def validate(name, run, reference, inputs, atol):
+    worst = 0.
+    for x in inputs:
+        with torch.no_grad():
+            out = run(x)
+            ref, _ = reference(x)
+        if out.shape != ref.shape:
+            raise RuntimeError('%s output has shape %s, expected %s' % (name, tuple(out.shape), tuple(ref.shape)))
+        worst = max(worst, (out - ref).abs().max().item())
+    logging.info('%s: max |logit diff| = %e over batches of %s', name, worst, [x.size(0) for x in inputs])
+    if worst > atol:
+        raise RuntimeError('%s deviates from the eager model: max |diff| = %e > %e' % (name, worst, atol))
+    return worst
+
+
+def main():
+    args = parser.parse_args()
+    logging.basicConfig(stream=sys.stdout, level=logging.INFO, format='%(asctime)s %(message)s', datefmt='%m/%d %I:%M:%S %p')
+    device = torch.device('cpu')
+    execution.setup_device(device, 0)
+    args.fuse = args.compile = False
+    model = load_model(args, device)
+    module = prepare(model)
+
+    size = args.input_size or (224 if args.dataset == 'imagenet' else 32)
+    example = torch.randn(2, 3, size, size)
+    g = torch.Generator().manual_seed(0)
+    inputs = [torch.randn(int(n), 3, size, size, generator=g) for n in args.check_batches.split(',')]
+    formats = args.formats.split(',')
+    for fmt in formats:
+        if fmt not in ('torchscript', 'onnx'):
+            parser.error('unknown format %s' % fmt)
+
+    if 'torchscript' in formats:
+        path = args.out + '.pt'
+        if os.path.abspath(path) == os.path.abspath(args.model_path):
+            parser.error('--out would overwrite the checkpoint %s' % args.model_path)
+        scripted = export_torchscript(module, example, path)
+        validate('torchscript', scripted, model, inputs, args.atol)
+        logging.info('TorchScript written to %s', path)
+    if 'onnx' in formats:
+        path = args.out + '.onnx'
+        run = export_onnx(module, example, path, args.opset)
+        if run is not None:
+            validate('onnx', run, model, inputs, args.atol)
+        logging.info('ONNX written to %s', path)
+
+
+if __name__ == '__main__':
+    main()
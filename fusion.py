@@ -0,0 +1,104 @@
+import copy
+import torch
+import torch.nn as nn
+from operations import FactorizedReduce
+
+
+def fold_bn(conv, bn, channels=None):
+    """returns a biased Conv2d equivalent to bn(conv(x)) with bn in eval mode.
+    `channels` selects the slice of bn that belongs to conv (FactorizedReduce)."""
+    if channels is None:
+        channels = slice(0, bn.num_features)
+    mean = bn.running_mean[channels]
+    var = bn.running_var[channels]
+    if bn.affine:
+        gamma = bn.weight[channels]
+        beta = bn.bias[channels]
+    else:
+        gamma = torch.ones_like(mean)
+        beta = torch.zeros_like(mean)
+    fused = nn.Conv2d(conv.in_channels, conv.out_channels, conv.kernel_size,
+                      stride=conv.stride, padding=conv.padding, dilation=conv.dilation,
+                      groups=conv.groups, bias=True)
+    fused = fused.to(device=conv.weight.device, dtype=conv.weight.dtype)
+    scale = gamma / torch.sqrt(var + bn.eps)
+    bias = conv.bias if conv.bias is not None else torch.zeros_like(mean)
+    with torch.no_grad():
+        fused.weight.copy_(conv.weight * scale.view(-1, 1, 1, 1))
+        fused.bias.copy_((bias - mean) * scale + beta)
+    return fused
+
+
+def _fuse_sequential(seq):
+    layers = list(seq)
+    out = []
+    i = 0
+    while i < len(layers):
+        layer = layers[i]
+        if isinstance(layer, nn.Conv2d) and i + 1 < len(layers) and isinstance(layers[i+1], nn.BatchNorm2d):
+            out.append(fold_bn(layer, layers[i+1]))
+            i += 2
+        else:
+            out.append(layer)
+            i += 1
+    return nn.Sequential(*out)
+
+
+def _fuse_factorized_reduce(op):
+    half = op.conv_1.out_channels
+    op.conv_1 = fold_bn(op.conv_1, op.bn, slice(0, half))
+    op.conv_2 = fold_bn(op.conv_2, op.bn, slice(half, 2 * half))
+    op.bn = nn.Identity()
+
+
+def fuse_modules(module):
+    """folds every Conv2d -> BatchNorm2d pair below `module` in place"""
+    for name, child in module.named_children():
+        if isinstance(child, FactorizedReduce):
+            _fuse_factorized_reduce(child)
+        elif isinstance(child, nn.Sequential):
+            fuse_modules(child)
+            setattr(module, name, _fuse_sequential(child))
+        else:
+            fuse_modules(child)
+    return module
+
+
+def fuse_network(model):
+    """returns an inference-only copy of a trained NetworkCIFAR/NetworkImageNet
+    with BN folded into the convolutions, no auxiliary head and no drop path"""
+    if isinstance(model, (nn.DataParallel, nn.parallel.DistributedDataParallel)):
+        model = model.module
+    fused = copy.deepcopy(model)
+    fused.eval()
+    if hasattr(fused, 'auxiliary_head'):
+        del fused.auxiliary_head
+    fused._auxiliary = False
+    fused.drop_path_prob = 0.0
+    fuse_modules(fused)
+    for p in fused.parameters():
+        p.requires_grad_(False)
+    return fused
+
+
+def max_output_diff(model, fused, input):
+    """largest absolute logit difference between `model` and its fused copy"""
+    if isinstance(model, (nn.DataParallel, nn.parallel.DistributedDataParallel)):
+        model = model.module
+    was_training = model.training
+    model.eval()
+    drop_path_prob = getattr(model, 'drop_path_prob', 0.0)
+    model.drop_path_prob = 0.0
+    with torch.no_grad():
+        ref, _ = model(input)
+        out, _ = fused(input)
+    model.drop_path_prob = drop_path_prob
+    model.train(was_training)
+    return (ref - out).abs().max().item()
+
+
+def check_equivalence(model, fused, input, atol=1e-4):
+    diff = max_output_diff(model, fused, input)
+    if diff > atol:
+        raise RuntimeError('fused model deviates from the original: max |diff| = %e > %e' % (diff, atol))
+    return diff
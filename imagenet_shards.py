@@ -0,0 +1,192 @@
+import itertools
+import json
+import math
+import os
+import numpy as np
+import torch
+import torchvision.transforms.functional as TF
+from torchvision.io import decode_jpeg
+
+import distributed
+
+
+IMAGENET_MEAN = [0.485, 0.456, 0.406]
+IMAGENET_STD = [0.229, 0.224, 0.225]
+
+
+class ShardedImageNet(torch.utils.data.IterableDataset):
+    """streams a split written by pack_imagenet.py. Each shard is read with a single
+    sequential read and its JPEGs decoded in the loader worker that owns it; shards
+    are divided among processes, then among loader workers. Samples are uint8
+    (3, size, size) tensors: random-resized crops for training, center crops of the
+    image resized to a shorter side of size / 0.875 (256 for 224) otherwise. Flip,
+    color jitter and normalization are left to BatchAugment.
+
+    The shuffle changes with `set_epoch` (non-persistent workers) and with every
+    pass a persistent worker makes, so either kind of loader reshuffles. When
+    training on several processes every process yields as many samples as the one
+    with the fewest, so they all take the same number of steps. Each loader worker
+    batches its own samples, so for training the workers split that count evenly
+    and drop what does not fill a whole batch (see `set_batching`); len() of the
+    DataLoader is then the number of batches it yields."""
+
+    def __init__(self, root, split, train, size=224, scale=(0.08, 1.0), seed=0):
+        super(ShardedImageNet, self).__init__()
+        with open(os.path.join(root, split + '.json')) as f:
+            meta = json.load(f)
+        self.root = root
+        self.classes = meta['classes']
+        self.shards = meta['shards']
+        self.train = train
+        self.size = size
+        self.scale = scale
+        self.seed = seed
+        self.batch_size = 1
+        self.num_workers = 0
+        self.epoch = 0
+        self._passes = 0
+        self.rank = distributed.get_rank()
+        self.world_size = distributed.get_world_size()
+        self.count = sum(s['count'] for s in self.shards[self.rank::self.world_size])
+        if train and self.world_size > 1:
+            self.count = min(sum(s['count'] for s in self.shards[r::self.world_size]) for r in range(self.world_size))
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def set_batching(self, batch_size, num_workers):
+        """the batch size and number of workers of the DataLoader reading the dataset,
+        set before it starts iterating"""
+        self.batch_size = batch_size
+        self.num_workers = num_workers
+
+    def _quota(self, worker, num_workers):
+        quota = self.count // num_workers + (worker < self.count % num_workers)
+        return quota - quota % self.batch_size
+
+    def __len__(self):
+        if not self.train:
+            return self.count
+        num_workers = max(self.num_workers, 1)
+        return sum(self._quota(w, num_workers) for w in range(num_workers))
+
+    def _crop_params(self, height, width, generator):
+        """RandomResizedCrop.get_params, drawing from `generator` rather than the global RNG"""
+        area = height * width
+        log_ratio = (math.log(3. / 4.), math.log(4. / 3.))
+        for _ in range(10):
+            u = torch.rand(4, generator=generator).tolist()
+            target_area = area * (self.scale[0] + u[0] * (self.scale[1] - self.scale[0]))
+            aspect_ratio = math.exp(log_ratio[0] + u[1] * (log_ratio[1] - log_ratio[0]))
+            w = int(round(math.sqrt(target_area * aspect_ratio)))
+            h = int(round(math.sqrt(target_area / aspect_ratio)))
+            if 0 < w <= width and 0 < h <= height:
+                return int(u[2] * (height - h + 1)), int(u[3] * (width - w + 1)), h, w
+        # fallback to a central crop of the clamped aspect ratio
+        in_ratio = float(width) / float(height)
+        if in_ratio < 3. / 4.:
+            w, h = width, int(round(width / (3. / 4.)))
+        elif in_ratio > 4. / 3.:
+            h, w = height, int(round(height * (4. / 3.)))
+        else:
+            w, h = width, height
+        return (height - h) // 2, (width - w) // 2, h, w
+
+    def _decode(self, data, generator):
+        img = decode_jpeg(torch.frombuffer(data, dtype=torch.uint8))
+        if img.size(0) == 1:
+            img = img.expand(3, -1, -1)
+        if self.train:
+            i, j, h, w = self._crop_params(img.size(1), img.size(2), generator)
+            return TF.resized_crop(img, i, j, h, w, [self.size, self.size], antialias=True)
+        # the Resize(256) + CenterCrop(224) protocol of the folder loader
+        short_side = int(round(self.size / 0.875))
+        if min(img.size(1), img.size(2)) != short_side:
+            img = TF.resize(img, short_side, antialias=True)
+        return TF.center_crop(img, [self.size, self.size])
+
+    def __iter__(self):
+        shards = self.shards[self.rank::self.world_size]
+        info = torch.utils.data.get_worker_info()
+        worker, num_workers = (info.id, info.num_workers) if info is not None else (0, 1)
+        pass_id = self.epoch + self._passes
+        self._passes += 1
+        rng = np.random.RandomState(self.seed + 1000 * pass_id + 7 * self.rank + worker)
+        if self.train:
+            # same permutation in every worker, so they still split the shards evenly
+            order = np.random.RandomState(self.seed + pass_id).permutation(len(shards))
+            shards = [shards[k] for k in order]
+        generator = torch.Generator()
+        generator.manual_seed(int(rng.randint(2**31)))
+        if not self.train:
+            return self._samples(shards[worker::num_workers], rng, generator)
+        # the workers split the common count evenly, cycling their shards if they run short
+        quota = self._quota(worker, num_workers)
+        return itertools.islice(self._cycle(shards[worker::num_workers] or shards, rng, generator), quota)
+
+    def _cycle(self, shards, rng, generator):
+        while True:
+            for sample in self._samples(shards, rng, generator):
+                yield sample
+
+    def _samples(self, shards, rng, generator):
+        for shard in shards:
+            index = np.load(os.path.join(self.root, shard['index']))
+            with open(os.path.join(self.root, shard['file']), 'rb') as f:
+                data = memoryview(bytearray(f.read()))
+            rows = rng.permutation(len(index)) if self.train else range(len(index))
+            for k in rows:
+                offset, length, label = index[k]
+                yield self._decode(data[offset:offset + length], generator), int(label)
+
+
+class BatchAugment(object):
+    """prefetcher batch_transform turning uint8 batches into normalized float ones,
+    with per-sample horizontal flips and brightness/contrast/saturation/hue jitter
+    (the ColorJitter ranges of train_imagenet.py) applied to the whole batch at once"""
+
+    def __init__(self, train, brightness=0.4, contrast=0.4, saturation=0.4, hue=0.2,
+                 mean=IMAGENET_MEAN, std=IMAGENET_STD):
+        self.train = train
+        self.brightness = brightness
+        self.contrast = contrast
+        self.saturation = saturation
+        self.hue = hue
+        self.mean = torch.tensor(mean).view(1, 3, 1, 1)
+        self.std = torch.tensor(std).view(1, 3, 1, 1)
+
+    def _factor(self, x, spread):
+        return torch.empty(x.size(0), 1, 1, 1, device=x.device).uniform_(1 - spread, 1 + spread)
+
+    def _jitter(self, x):
+        x = x * self._factor(x, self.brightness)
+        mean = (0.299 * x[:, 0:1] + 0.587 * x[:, 1:2] + 0.114 * x[:, 2:3]).mean(dim=(2, 3), keepdim=True)
+        c = self._factor(x, self.contrast)
+        x = x * c + mean * (1 - c)
+        gray = (0.299 * x[:, 0:1] + 0.587 * x[:, 1:2] + 0.114 * x[:, 2:3])
+        s = self._factor(x, self.saturation)
+        x = x * s + gray * (1 - s)
+        if self.hue > 0:
+            # rotation of the chroma plane in YIQ space
+            theta = torch.empty(x.size(0), device=x.device).uniform_(-self.hue, self.hue) * 2 * math.pi
+            cos, sin = torch.cos(theta), torch.sin(theta)
+            to_yiq = x.new_tensor([[0.299, 0.587, 0.114], [0.596, -0.274, -0.322], [0.211, -0.523, 0.312]])
+            to_rgb = torch.linalg.inv(to_yiq)
+            rot = torch.zeros(x.size(0), 3, 3, device=x.device)
+            rot[:, 0, 0] = 1
+            rot[:, 1, 1], rot[:, 1, 2] = cos, -sin
+            rot[:, 2, 1], rot[:, 2, 2] = sin, cos
+            m = to_rgb @ rot @ to_yiq
+            x = torch.einsum('nij,njhw->nihw', m, x)
+        return x.clamp_(0, 1)
+
+    def __call__(self, input, target):
+        x = input.float().div_(255)
+        if self.train:
+            flip = torch.rand(x.size(0), 1, 1, 1, device=x.device) < 0.5
+            x = torch.where(flip, x.flip(3), x)
+            x = self._jitter(x)
+        x = x.sub_(self.mean.to(x.device)).div_(self.std.to(x.device))
+        if input.is_contiguous(memory_format=torch.channels_last):
+            x = x.contiguous(memory_format=torch.channels_last)
+        return x, target
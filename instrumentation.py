@@ -0,0 +1,133 @@
+import csv
+import json
+import logging
+import os
+import time
+import torch
+
+
+PHASES = ('data', 'forward', 'backward', 'optimizer', 'arch', 'logging')
+# waiting on the loader and logging are host-side; the other phases are timed on the
+# device when it runs asynchronously
+HOST_PHASES = ('data', 'logging')
+
+
+def add_timing_args(parser):
+    parser.add_argument('--timing_trace', type=str, default=None, help='append per-step phase timings to this .jsonl or .csv file')
+
+
+class StepTimer(object):
+    """splits each step of a loop into PHASES. Call `mark(phase)` when a phase ends,
+    the time since the previous mark is charged to it, and `step(n)` at the end of
+    a step of n samples. On cuda the device phases are timed with events that are
+    only read back every `report_freq` steps, so timing adds no per-step sync."""
+
+    def __init__(self, name, device, report_freq=50, trace=None):
+        self.name = name
+        self.device = torch.device(device)
+        self.use_events = self.device.type == 'cuda'
+        self.report_freq = max(int(report_freq), 1)
+        self.trace = trace
+        self.steps = 0
+        self.samples = 0
+        self.totals = dict.fromkeys(PHASES, 0.)
+        self._window = []
+        self.start()
+
+    def start(self):
+        self._host = time.perf_counter()
+        self._window_start = self._host
+        self._event = self._record() if self.use_events else None
+        self._current = ({}, [])
+
+    def _record(self):
+        event = torch.cuda.Event(enable_timing=True)
+        event.record()
+        return event
+
+    def mark(self, phase):
+        now = time.perf_counter()
+        host, device = self._current
+        if self.use_events:
+            event = self._record()
+            if phase not in HOST_PHASES:
+                device.append((phase, self._event, event))
+            self._event = event
+        if not self.use_events or phase in HOST_PHASES:
+            host[phase] = host.get(phase, 0.) + (now - self._host)
+        self._host = now
+
+    def step(self, n):
+        self._window.append((self.steps, n, self._current))
+        self._current = ({}, [])
+        self.steps += 1
+        self.samples += n
+        if self.steps % self.report_freq == 0:
+            self.flush()
+
+    def _resolve(self):
+        rows = []
+        for step, n, (host, device) in self._window:
+            row = dict.fromkeys(PHASES, 0.)
+            for phase, seconds in host.items():
+                row[phase] += seconds * 1e3
+            for phase, begin, end in device:
+                row[phase] += begin.elapsed_time(end)
+            rows.append((step, n, row))
+        return rows
+
+    def flush(self):
+        """reads back the pending steps, logs a summary of them and appends them to the trace"""
+        if not self._window:
+            return
+        if self.use_events:
+            torch.cuda.synchronize(self.device)
+        rows = self._resolve()
+        wall = time.perf_counter() - self._window_start
+        window = dict.fromkeys(PHASES, 0.)
+        samples = 0
+        for step, n, row in rows:
+            samples += n
+            for phase in PHASES:
+                window[phase] += row[phase]
+                self.totals[phase] += row[phase] / 1e3
+        step_ms = sum(window.values()) / len(rows)
+        logging.info('%s timing: %d steps %.1f ms/step %.1f samples/s | %s', self.name, len(rows), step_ms,
+                     samples / max(wall, 1e-9), ' '.join('%s %.1f' % (phase, window[phase] / len(rows))
+                                                         for phase in PHASES if window[phase] > 0))
+        if self.trace:
+            self._write(rows)
+        self._window = []
+        self._window_start = time.perf_counter()
+
+    def _write(self, rows):
+        records = []
+        for step, n, row in rows:
+            record = {'loop': self.name, 'step': step, 'samples': n}
+            record.update((phase, round(row[phase], 4)) for phase in PHASES)
+            record['total'] = round(sum(row.values()), 4)
+            records.append(record)
+        if self.trace.endswith('.csv'):
+            new = not os.path.exists(self.trace) or os.path.getsize(self.trace) == 0
+            with open(self.trace, 'a', newline='') as f:
+                writer = csv.DictWriter(f, fieldnames=list(records[0]))
+                if new:
+                    writer.writeheader()
+                writer.writerows(records)
+        else:
+            with open(self.trace, 'a') as f:
+                for record in records:
+                    f.write(json.dumps(record) + '\n')
+
+    def summary(self):
+        """flushes, logs the share of each phase and returns the seconds spent in
+        each phase over the whole loop"""
+        self.flush()
+        total = sum(self.totals.values())
+        if total > 0:
+            logging.info('%s time split over %d steps: %s', self.name, self.steps, ' '.join(
+                '%s %.0f%%' % (phase, 100. * self.totals[phase] / total) for phase in PHASES if self.totals[phase] > 0))
+        summary = dict(self.totals)
+        summary['steps'] = self.steps
+        summary['samples'] = self.samples
+        return summary
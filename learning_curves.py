@@ -0,0 +1,252 @@
+"""Predicts the final validation accuracy of a train_cifar.py run from its first epochs.
+
+The per-epoch Valid_acc of finished runs is parsed from their logs into one .npz
+store. A new curve is extrapolated to its last epoch by an ensemble of saturating
+parametric curves (pow3, exp3, log-power, Janoschek) fitted on time normalized to
+the run length, and the ensemble is then corrected by the store: the same prefix of
+every finished run is extrapolated as well, and the mean and spread of their
+errors give the bias and uncertainty of the prediction. train_cifar.py --lc_store
+consults the prediction every epoch and stops runs unlikely to beat the incumbent.
+
+    python learning_curves.py --logs 'results/eval-*/log.txt' --store curves.npz
+    python learning_curves.py --store curves.npz --prefix 20,50,100,200
+    python learning_curves.py --store curves.npz --predict results/eval-new/log.txt
+"""
+import argparse
+import glob
+import logging
+import math
+import re
+import sys
+import numpy as np
+import torch
+
+
+def add_lc_args(parser):
+    parser.add_argument('--lc_store', type=str, default='', help='learning-curve store (learning_curves.py); enables early stopping')
+    parser.add_argument('--lc_min_epochs', type=int, default=20, help='epochs before the first stop decision')
+    parser.add_argument('--lc_threshold', type=float, default=0.05, help='stop once the chance of beating the incumbent falls below this')
+    parser.add_argument('--lc_incumbent', type=float, default=0, help='accuracy to beat, 0 for the best final accuracy in the store')
+
+
+def _pow3(t, p):
+    c, a, alpha = p
+    return c - a * t ** -alpha.exp()
+
+
+def _exp3(t, p):
+    c, a, b = p
+    return c - a * torch.exp(-b.exp() * t)
+
+
+def _log_power(t, p):
+    a, b, c = p
+    return a / (1 + (t / b.exp()) ** -c.exp())
+
+
+def _janoschek(t, p):
+    a, b, k, d = p
+    return a - (a - b) * torch.exp(-k.exp() * t ** d.exp())
+
+
+# name -> (curve of normalized time t in (0, 1] and raw parameters, initial parameters)
+CURVES = {
+    'pow3': (_pow3, [0.9, 0.1, -1.]),
+    'exp3': (_exp3, [0.9, 0.5, 1.5]),
+    'log_power': (_log_power, [0.9, -3., 0.]),
+    'janoschek': (_janoschek, [0.9, 0.1, 1.5, 0.]),
+}
+
+
+def fit_curve(t, y, name, iters=100):
+    """least-squares fit of CURVES[name] to accuracies y (in [0, 1]) at times t;
+    returns the parameters and the mean squared error"""
+    fn, init = CURVES[name]
+    params = torch.tensor(init, dtype=torch.float64, requires_grad=True)
+    optimizer = torch.optim.LBFGS([params], max_iter=iters, line_search_fn='strong_wolfe')
+
+    def closure():
+        optimizer.zero_grad()
+        loss = ((fn(t, params) - y) ** 2).mean()
+        loss.backward()
+        return loss
+
+    optimizer.step(closure)
+    with torch.no_grad():
+        mse = ((fn(t, params) - y) ** 2).mean().item()
+    return params.detach(), mse
+
+
+def extrapolate(accs, total_epochs):
+    """(mean, std) of the accuracy at epoch `total_epochs` predicted by the curve ensemble
+    from the valid accuracies (percent) of the first epochs; models are weighted by
+    the inverse of their fit error"""
+    n = len(accs)
+    t = torch.arange(1, n + 1, dtype=torch.float64) / total_epochs
+    y = torch.tensor(accs, dtype=torch.float64) / 100
+    end = torch.ones(1, dtype=torch.float64)
+    preds, weights = [], []
+    for name, (fn, _) in CURVES.items():
+        params, mse = fit_curve(t, y, name)
+        with torch.no_grad():
+            pred = fn(end, params).item()
+        if math.isfinite(pred) and math.isfinite(mse):
+            preds.append(min(max(pred, 0.), 1.))
+            weights.append(1. / (mse + 1e-8))
+    if not preds:
+        return float(accs[-1]), float('inf')
+    preds, weights = np.array(preds), np.array(weights) / np.sum(weights)
+    mean = float(np.sum(weights * preds))
+    std = float(np.sqrt(np.sum(weights * (preds - mean) ** 2)))
+    return 100 * mean, 100 * std
+
+
+def parse_log(path):
+    """arch, dataset, scheduled epochs and the per-epoch Valid_acc of a train_cifar.py log"""
+    args_re = re.compile(r'args = Namespace\((.*)\)')
+    acc_re = re.compile(r'Valid_acc: ([0-9.]+)')
+    run = {'arch': '', 'dataset': 'cifar10', 'epochs': 0, 'accs': []}
+    with open(path) as f:
+        for line in f:
+            m = args_re.search(line)
+            if m and not run['epochs']:
+                fields = m.group(1)
+                arch = re.search(r"arch='([^']+)'", fields)
+                epochs = re.search(r'\bepochs=(\d+)', fields)
+                run['arch'] = arch.group(1) if arch else ''
+                run['epochs'] = int(epochs.group(1)) if epochs else 0
+                run['dataset'] = 'cifar100' if 'cifar100=True' in fields else 'cifar10'
+            m = acc_re.search(line)
+            if m:
+                run['accs'].append(float(m.group(1)))
+    return run
+
+
+def build_store(paths):
+    runs = [dict(parse_log(path), path=path) for path in paths]
+    runs = [run for run in runs if run['accs'] and run['epochs']]
+    length = max(len(run['accs']) for run in runs) if runs else 0
+    curves = np.full((len(runs), length), np.nan, dtype=np.float32)
+    for i, run in enumerate(runs):
+        curves[i, :len(run['accs'])] = run['accs']
+    return {
+        'path': np.array([run['path'] for run in runs]),
+        'arch': np.array([run['arch'] for run in runs]),
+        'dataset': np.array([run['dataset'] for run in runs]),
+        'epochs': np.array([run['epochs'] for run in runs], dtype=np.int32),
+        'length': np.array([len(run['accs']) for run in runs], dtype=np.int32),
+        'curves': curves,
+    }
+
+
+def save_store(store, path):
+    np.savez_compressed(path, **store)
+
+
+def load_store(path):
+    with np.load(path) as data:
+        return dict((k, data[k]) for k in data.files)
+
+
+class CurvePredictor(object):
+    """extrapolates curves and corrects them with the finished runs of a store:
+    for a prefix of `n` out of `total_epochs` epochs, the same fraction of every
+    finished run (of the same dataset, at most `max_calib` of them) is extrapolated,
+    and the mean and standard deviation of the errors become the bias and the
+    uncertainty of the prediction"""
+
+    def __init__(self, store=None, dataset='cifar10', max_calib=50):
+        self.finished = []
+        self.incumbent = None
+        if store is not None:
+            done = np.flatnonzero((store['length'] >= store['epochs']) & (store['dataset'] == dataset))
+            for i in done:
+                self.finished.append((store['curves'][i, :store['epochs'][i]].astype(np.float64), int(store['epochs'][i])))
+            if self.finished:
+                self.incumbent = max(curve[-1] for curve, _ in self.finished)
+            self.finished = self.finished[:max_calib]
+        self._calibration = {}
+
+    @classmethod
+    def from_args(cls, args):
+        if not args.lc_store:
+            return None
+        return cls(load_store(args.lc_store), 'cifar100' if args.cifar100 else 'cifar10')
+
+    def calibration(self, fraction):
+        """(bias, std) of the ensemble's error at a prefix of `fraction` of the run, in steps of 2%"""
+        key = round(fraction * 50) / 50.
+        if key not in self._calibration:
+            errors = []
+            for curve, epochs in self.finished:
+                n = max(3, int(round(key * epochs)))
+                if n < epochs:
+                    errors.append(curve[-1] - extrapolate(curve[:n], epochs)[0])
+            self._calibration[key] = (float(np.mean(errors)), float(np.std(errors))) if len(errors) >= 3 else None
+        return self._calibration[key]
+
+    def predict(self, accs, total_epochs):
+        mean, std = extrapolate(accs, total_epochs)
+        calibration = self.calibration(len(accs) / float(total_epochs))
+        if calibration is not None:
+            bias, spread = calibration
+            mean, std = mean + bias, spread
+        return min(mean, 100.), std
+
+    def decide(self, accs, total_epochs, incumbent=None, threshold=0.05):
+        """(stop, predicted mean, std, probability of beating the incumbent)"""
+        incumbent = incumbent or self.incumbent
+        mean, std = self.predict(accs, total_epochs)
+        if incumbent is None:
+            return False, mean, std, 1.
+        p = 0.5 * math.erfc((incumbent - mean) / (math.sqrt(2) * max(std, 1e-6)))
+        return p < threshold, mean, std, p
+
+
+def main():
+    parser = argparse.ArgumentParser("learning_curves")
+    parser.add_argument('--store', type=str, default='curves.npz', help='learning-curve store (.npz)')
+    parser.add_argument('--logs', type=str, nargs='*', default=[], help='train_cifar.py logs (globs) to (re)build the store from')
+    parser.add_argument('--prefix', type=str, default='', help='comma separated epoch counts to measure the prediction error at')
+    parser.add_argument('--predict', type=str, default='', help='train_cifar.py log of a run to predict')
+    parser.add_argument('--cifar100', action='store_true', default=False, help='use the cifar100 runs of the store')
+    args = parser.parse_args()
+    logging.basicConfig(stream=sys.stdout, level=logging.INFO, format='%(asctime)s %(message)s', datefmt='%m/%d %I:%M:%S %p')
+    dataset = 'cifar100' if args.cifar100 else 'cifar10'
+
+    if args.logs:
+        store = build_store(sorted(p for pattern in args.logs for p in glob.glob(pattern)))
+        save_store(store, args.store)
+        logging.info('%d runs (%d finished) stored in %s', len(store['arch']),
+                     int(np.sum(store['length'] >= store['epochs'])), args.store)
+    store = load_store(args.store)
+
+    if args.prefix:
+        # leave-one-out: every finished run is predicted with the errors on the others as calibration
+        finished = CurvePredictor(store, dataset, max_calib=len(store['arch'])).finished
+        for n in [int(p) for p in args.prefix.split(',')]:
+            runs = [(curve[-1],) + extrapolate(curve[:n], epochs) for curve, epochs in finished if n < epochs]
+            if len(runs) < 4:
+                continue
+            final, mean, _ = [np.array(x) for x in zip(*runs)]
+            errors = []
+            covered = 0
+            for i in range(len(runs)):
+                others = np.delete(final - mean, i)
+                pred, spread = mean[i] + others.mean(), others.std()
+                errors.append(pred - final[i])
+                covered += abs(pred - final[i]) <= 2 * spread
+            logging.info('%4d epochs: mean abs error %.2f, bias %.2f over %d runs, %.0f%% within 2 std', n,
+                         np.mean(np.abs(errors)), np.mean(errors), len(errors), 100. * covered / len(errors))
+
+    if args.predict:
+        run = parse_log(args.predict)
+        predictor = CurvePredictor(store, run['dataset'])
+        stop, mean, std, p = predictor.decide(run['accs'], run['epochs'])
+        logging.info('%s (%s) after %d of %d epochs at %.2f: predicted final %.2f +- %.2f, P(beats %.2f) = %.3f%s',
+                     args.predict, run['arch'], len(run['accs']), run['epochs'], run['accs'][-1], mean, std,
+                     predictor.incumbent or 0, p, ', stop' if stop else '')
+
+
+if __name__ == '__main__':
+    main()
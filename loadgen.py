@@ -0,0 +1,102 @@
+"""Closed-loop load generator for serve.py: for every --concurrency level, that many
+clients send random images back to back for --duration seconds. Reports client-side
+throughput and latency percentiles per level, next to the server's own metrics.
+
+    python loadgen.py --url http://127.0.0.1:8000 --concurrency 1,4,16,64 --size 32
+"""
+import argparse
+import io
+import json
+import threading
+import time
+import urllib.request
+import numpy as np
+
+from timing import latency_stats
+
+
+parser = argparse.ArgumentParser("loadgen")
+parser.add_argument('--url', type=str, default='http://127.0.0.1:8000', help='address of serve.py')
+parser.add_argument('--concurrency', type=str, default='1,4,16', help='comma separated numbers of concurrent clients')
+parser.add_argument('--duration', type=float, default=10., help='seconds per concurrency level')
+parser.add_argument('--images', type=int, default=1, help='images per request')
+parser.add_argument('--size', type=int, default=32, help='image side, 224 for imagenet models')
+parser.add_argument('--save', type=str, default='', help='write the results as JSON here')
+
+
+def encode(images):
+    buf = io.BytesIO()
+    np.save(buf, images)
+    return buf.getvalue()
+
+
+def get(url):
+    with urllib.request.urlopen(url) as r:
+        return json.loads(r.read())
+
+
+def client(url, bodies, stop, latencies, errors):
+    k = 0
+    while not stop.is_set():
+        request = urllib.request.Request(url + '/predict', data=bodies[k % len(bodies)],
+                                         headers={'Content-Type': 'application/octet-stream'})
+        start = time.perf_counter()
+        try:
+            with urllib.request.urlopen(request) as r:
+                r.read()
+            latencies.append((time.perf_counter() - start) * 1e3)
+        except Exception:
+            errors.append(1)
+        k += 1
+
+
+def run_level(args, concurrency, bodies):
+    stop = threading.Event()
+    latencies, errors = [], []
+    threads = [threading.Thread(target=client, args=(args.url, bodies[i::concurrency] or bodies, stop, latencies, errors), daemon=True)
+               for i in range(concurrency)]
+    before = get(args.url + '/metrics')
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    time.sleep(args.duration)
+    stop.set()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    after = get(args.url + '/metrics')
+    batches = after['batches'] - before['batches']
+    result = {
+        'concurrency': concurrency,
+        'requests': len(latencies),
+        'errors': len(errors),
+        'requests_per_s': len(latencies) / elapsed,
+        'images_per_s': len(latencies) * args.images / elapsed,
+        'server_mean_batch': (after['images'] - before['images']) / float(max(batches, 1)),
+    }
+    if latencies:
+        result.update(latency_stats(latencies))
+    return result
+
+
+def main():
+    args = parser.parse_args()
+    rng = np.random.RandomState(0)
+    bodies = [encode(rng.randint(0, 256, (args.images, args.size, args.size, 3), dtype=np.uint8)) for _ in range(64)]
+    get(args.url + '/health')
+    results = []
+    for concurrency in [int(c) for c in args.concurrency.split(',')]:
+        r = run_level(args, concurrency, bodies)
+        results.append(r)
+        print('concurrency %3d: %8.1f images/s %7.1f req/s batch %5.1f | latency mean %.1f p50 %.1f p90 %.1f p99 %.1f ms | errors %d' % (
+            concurrency, r['images_per_s'], r['requests_per_s'], r['server_mean_batch'], r.get('mean_ms', 0),
+            r.get('p50_ms', 0), r.get('p90_ms', 0), r.get('p99_ms', 0), r['errors']))
+    server = get(args.url + '/metrics')
+    print('server: %s' % json.dumps(server))
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'client': results, 'server': server}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
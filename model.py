@@ -1,5 +1,6 @@
 import torch
 import torch.nn as nn
+import torch.nn.functional as F
 from operations import *
 from torch.autograd import Variable
 from pdarts_utils import drop_path
@@ -9,6 +10,7 @@ class Cell(nn.Module):
 
     def __init__(self, genotype, C_prev_prev, C_prev, C, reduction, reduction_prev):
         super(Cell, self).__init__()
+        self.reduction = reduction
         if reduction_prev:
             self.preprocess0 = FactorizedReduce(C_prev_prev, C)
         else:
@@ -29,17 +31,28 @@ class Cell(nn.Module):
         self.multiplier = len(concat)
 
         self._ops = nn.ModuleList()
+        self._op_names = list(op_names)
         for name, index in zip(op_names, indices):
             stride = 2 if reduction and index < 2 else 1
             op = OPS[name](C, stride, True)
             self._ops += [op]
         self._indices = indices
+        # the buffer path needs every concatenated state to be an intermediate node
+        if min(concat) >= 2:
+            self._slots = {state: slot for slot, state in enumerate(concat)}
+        else:
+            self._slots = None
 
     def forward(self, s0, s1, drop_prob):
         s0 = self.preprocess0(s0)
         s1 = self.preprocess1(s1)
 
         states = [s0, s1]
+        # without grad, intermediate nodes that are part of the output are summed straight
+        # into their slice of a preallocated buffer instead of being concatenated afterwards
+        # (see operations.add_into)
+        slots = self._slots if not torch.is_grad_enabled() else None
+        out = None
         for i in range(self._steps):
             h1 = states[self._indices[2*i]]
             h2 = states[self._indices[2*i+1]]
@@ -48,13 +61,20 @@ class Cell(nn.Module):
             h1 = op1(h1)
             h2 = op2(h2)
             if self.training and drop_prob > 0.:
-                if not isinstance(op1, Identity):
+                if not isinstance(op1, (Identity, Zero)):
                     h1 = drop_path(h1, drop_prob)
-                if not isinstance(op2, Identity):
+                if not isinstance(op2, (Identity, Zero)):
                     h2 = drop_path(h2, drop_prob)
-            s = h1 + h2
+            if slots is not None and 2+i in slots:
+                if out is None:
+                    out = concat_buffer(h1, self.multiplier)
+                s = add_into(h1, h2, out, slots[2+i])
+            else:
+                s = h1 + h2
             states += [s]
-        return torch.cat([states[i] for i in self._concat], dim=1)
+        if slots is None:
+            return torch.cat([states[i] for i in self._concat], dim=1)
+        return out
 
 
 class AuxiliaryHeadCIFAR(nn.Module):
@@ -62,8 +82,9 @@ class AuxiliaryHeadCIFAR(nn.Module):
     def __init__(self, C, num_classes):
         """assuming input size 8x8"""
         super(AuxiliaryHeadCIFAR, self).__init__()
+        # not in place: the input is the cell output shared with the following cells
         self.features = nn.Sequential(
-            nn.ReLU(inplace=True),
+            nn.ReLU(inplace=False),
             nn.AvgPool2d(5, stride=3, padding=0, count_include_pad=False), # image size = 2 x 2
             nn.Conv2d(C, 128, 1, bias=False),
             nn.BatchNorm2d(128),
@@ -80,14 +101,26 @@ class AuxiliaryHeadCIFAR(nn.Module):
         return x
 
 
+class AuxiliaryPool(nn.Module):
+    """the 5x5/2 average pooling of the ImageNet auxiliary head, which maps the 7x7
+    features of a 224 input to 2x2; other resolutions are pooled to 2x2 adaptively"""
+
+    def forward(self, x):
+        if x.size(2) >= 5 and x.size(3) >= 5:
+            x = F.avg_pool2d(x, 5, stride=2, padding=0, count_include_pad=False)
+        if x.size(2) != 2 or x.size(3) != 2:
+            x = F.adaptive_avg_pool2d(x, 2)
+        return x
+
+
 class AuxiliaryHeadImageNet(nn.Module):
 
     def __init__(self, C, num_classes):
-        """assuming input size 14x14"""
+        """assuming input size 7x7, any other size is pooled to the same 2x2"""
         super(AuxiliaryHeadImageNet, self).__init__()
         self.features = nn.Sequential(
-            nn.ReLU(inplace=True),
-            nn.AvgPool2d(5, stride=2, padding=0, count_include_pad=False),
+            nn.ReLU(inplace=False),
+            AuxiliaryPool(),
             nn.Conv2d(C, 128, 1, bias=False),
             nn.BatchNorm2d(128),
             nn.ReLU(inplace=True),
@@ -185,7 +218,8 @@ class NetworkImageNet(nn.Module):
 
         if auxiliary:
             self.auxiliary_head = AuxiliaryHeadImageNet(C_to_auxiliary, num_classes)
-        self.global_pooling = nn.AvgPool2d(7)
+        # adaptive, so the network trains and evaluates at any resolution
+        self.global_pooling = nn.AdaptiveAvgPool2d(1)
         self.classifier = nn.Linear(C_prev, num_classes)
 
     def forward(self, input):
@@ -13,10 +13,12 @@ class MixedOp(nn.Module):
     def __init__(self, C, stride, switch, p):
         super(MixedOp, self).__init__()
         self.m_ops = nn.ModuleList()
+        self.primitives = []
         self.p = p
         for i in range(len(switch)):
             if switch[i]:
                 primitive = PRIMITIVES[i]
+                self.primitives.append(primitive)
                 op = OPS[primitive](C, stride, False)
                 if 'pool' in primitive:
                     op = nn.Sequential(op, nn.BatchNorm2d(C, affine=False))
@@ -31,7 +33,19 @@ class MixedOp(nn.Module):
                     op[1].p = self.p
                     
     def forward(self, x, weights):
-        return sum(w * op(x) for w, op in zip(weights, self.m_ops))
+        # the softmaxed weights are fp32; under autocast they follow the op output
+        # precision so the edge sum is not promoted back to fp32.
+        # Zero adds nothing to the sum nor to the gradient of its weight, so it is skipped
+        out = None
+        for w, op in zip(weights, self.m_ops):
+            if isinstance(op, Zero):
+                continue
+            h = op(x)
+            h = w.to(h.dtype) * h
+            out = h if out is None else out + h
+        if out is None:
+            return self.m_ops[0](x)
+        return out
 
 
 class Cell(nn.Module):
@@ -67,12 +81,25 @@ class Cell(nn.Module):
         s1 = self.preprocess1(s1)
         states = [s0, s1]
         offset = 0
+        out = None
+        first_slot = self._steps - self._multiplier
         for i in range(self._steps):
-            s = sum(self.cell_ops[offset+j](h, weights[offset+j]) for j, h in enumerate(states))
+            last = len(states) - 1
+            s = sum(self.cell_ops[offset+j](h, weights[offset+j]) for j, h in enumerate(states[:last]))
+            h = self.cell_ops[offset+last](states[last], weights[offset+last])
             offset += len(states)
-            states.append(s)
+            if i < first_slot or torch.is_grad_enabled():
+                states.append(s + h)
+                continue
+            # without grad the last edge is summed straight into this node's slice of
+            # the cell output (see operations.add_into)
+            if out is None:
+                out = concat_buffer(h, self._multiplier)
+            states.append(add_into(s, h, out, i - first_slot))
 
-        return torch.cat(states[-self._multiplier:], dim=1)
+        if out is None:
+            return torch.cat(states[-self._multiplier:], dim=1)
+        return out
 
 
 class Network(nn.Module):
@@ -87,6 +114,7 @@ class Network(nn.Module):
         self._multiplier = multiplier
         self.p = p
         self.switches_normal = switches_normal
+        self.switches_reduce = switches_reduce
         switch_ons = []
         for i in range(len(switches_normal)):
             ons = 0
@@ -96,12 +96,27 @@ class Zero(nn.Module):
     n, c, h, w = x.size()
     h //= self.stride
     w //= self.stride
-    if x.is_cuda:
-      with torch.cuda.device(x.get_device()):
-        padding = torch.cuda.FloatTensor(n, c, h, w).fill_(0)
-    else:
-      padding = torch.FloatTensor(n, c, h, w).fill_(0)
-    return padding    
+    # a single broadcast zero: it is only ever multiplied and summed, never written to
+    return x.new_zeros(1, 1, 1, 1).expand(n, c, h, w)
+
+def concat_buffer(x, multiplier):
+  """uninitialized (N, multiplier*C, H, W) cell output shaped after node tensor x"""
+  n, c, h, w = x.size()
+  if x.is_contiguous(memory_format=torch.channels_last) and not x.is_contiguous():
+    memory_format = torch.channels_last
+  else:
+    memory_format = torch.contiguous_format
+  return torch.empty((n, multiplier * c, h, w), dtype=x.dtype, device=x.device, memory_format=memory_format)
+
+
+def add_into(a, b, out, slot):
+  """a + b written into channel slot `slot` of `out`, returned as a view of it.
+  Inference only: the cells take this path just when grad is disabled. Under autograd
+  the write would have to go around the buffer's version counter (the other slots may
+  already be saved for backward), so training concatenates instead."""
+  width = a.size(1)
+  return torch.add(a, b, out=out.narrow(1, slot * width, width))
+
 
 class FactorizedReduce(nn.Module):
 
@@ -0,0 +1,153 @@
+import math
+import torch
+
+
+def add_optimizer_args(parser):
+    parser.add_argument('--optimizer', type=str, default='sgd', choices=['sgd', 'lars', 'lamb'], help='sgd, or a layer-wise adaptive optimizer for large batches')
+    parser.add_argument('--trust_coefficient', type=float, default=0.001, help='LARS trust coefficient')
+    parser.add_argument('--beta2', type=float, default=0.999, help='LAMB second moment decay, --momentum is the first')
+    parser.add_argument('--warmup_epochs', type=float, default=-1, help='linear lr warmup in (fractional) epochs, updated every step; -1 warms up 5 epochs for batches above 256')
+    parser.add_argument('--no_decay_bn', action='store_true', default=False, help='no weight decay on BatchNorm parameters and biases')
+    parser.add_argument('--accum_steps', type=int, default=1, help='micro-batches each --batch_size step is accumulated from')
+
+
+def param_groups(model, weight_decay, no_decay_bn=False):
+    """splits the parameters into conv/linear weights and 1-d ones (BatchNorm affine
+    parameters and biases). The 1-d group is never layer-wise adapted, and with
+    `no_decay_bn` not decayed either."""
+    decay, no_decay = [], []
+    for p in model.parameters():
+        if p.requires_grad:
+            (no_decay if p.dim() <= 1 else decay).append(p)
+    return [
+        {'params': decay, 'weight_decay': weight_decay, 'adapt': True},
+        {'params': no_decay, 'weight_decay': 0. if no_decay_bn else weight_decay, 'adapt': False},
+    ]
+
+
+def _trust_ratio(w_norm, u_norm, coefficient=1., eps=0.):
+    # 1 where either norm is zero; kept on the device so no step waits on a .item()
+    ratio = coefficient * w_norm / (u_norm + eps)
+    return torch.where((w_norm > 0) & (u_norm > 0), ratio, torch.ones_like(ratio))
+
+
+class LARS(torch.optim.Optimizer):
+    """SGD with momentum whose per-tensor step is scaled by
+    trust_coefficient * ||w|| / ||g + weight_decay * w|| (You et al., 2017).
+    Groups with adapt=False take plain SGD steps."""
+
+    def __init__(self, params, lr, momentum=0.9, weight_decay=0., trust_coefficient=0.001, eps=1e-8):
+        defaults = dict(lr=lr, momentum=momentum, weight_decay=weight_decay,
+                        trust_coefficient=trust_coefficient, eps=eps, adapt=True)
+        super(LARS, self).__init__(params, defaults)
+
+    @torch.no_grad()
+    def step(self, closure=None):
+        loss = None
+        if closure is not None:
+            with torch.enable_grad():
+                loss = closure()
+        for group in self.param_groups:
+            for p in group['params']:
+                if p.grad is None:
+                    continue
+                g = p.grad
+                if group['weight_decay'] != 0:
+                    g = g.add(p, alpha=group['weight_decay'])
+                if group['adapt']:
+                    g = g.mul(_trust_ratio(p.norm(), g.norm(), group['trust_coefficient'], group['eps']))
+                state = self.state[p]
+                if 'momentum_buffer' not in state:
+                    state['momentum_buffer'] = g.clone()
+                else:
+                    state['momentum_buffer'].mul_(group['momentum']).add_(g)
+                p.add_(state['momentum_buffer'], alpha=-group['lr'])
+        return loss
+
+
+class LAMB(torch.optim.Optimizer):
+    """Adam with decoupled weight decay whose per-tensor update u is scaled by
+    ||w|| / ||u|| (You et al., 2019). Groups with adapt=False take AdamW steps."""
+
+    def __init__(self, params, lr, betas=(0.9, 0.999), eps=1e-6, weight_decay=0.):
+        defaults = dict(lr=lr, betas=betas, eps=eps, weight_decay=weight_decay, adapt=True)
+        super(LAMB, self).__init__(params, defaults)
+
+    @torch.no_grad()
+    def step(self, closure=None):
+        loss = None
+        if closure is not None:
+            with torch.enable_grad():
+                loss = closure()
+        for group in self.param_groups:
+            beta1, beta2 = group['betas']
+            for p in group['params']:
+                if p.grad is None:
+                    continue
+                state = self.state[p]
+                if not state:
+                    state['step'] = 0
+                    state['exp_avg'] = torch.zeros_like(p)
+                    state['exp_avg_sq'] = torch.zeros_like(p)
+                state['step'] += 1
+                exp_avg, exp_avg_sq = state['exp_avg'], state['exp_avg_sq']
+                exp_avg.mul_(beta1).add_(p.grad, alpha=1 - beta1)
+                exp_avg_sq.mul_(beta2).addcmul_(p.grad, p.grad, value=1 - beta2)
+                m = exp_avg / (1 - beta1 ** state['step'])
+                v = exp_avg_sq / (1 - beta2 ** state['step'])
+                update = m.div_(v.sqrt_().add_(group['eps']))
+                if group['weight_decay'] != 0:
+                    update.add_(p, alpha=group['weight_decay'])
+                if group['adapt']:
+                    update.mul_(_trust_ratio(p.norm(), update.norm()))
+                p.add_(update, alpha=-group['lr'])
+        return loss
+
+
+def build_optimizer(args, model):
+    """the --optimizer of `args` over the param_groups of `model`"""
+    groups = param_groups(model, args.weight_decay, args.no_decay_bn)
+    if args.optimizer == 'lars':
+        return LARS(groups, args.learning_rate, momentum=args.momentum, weight_decay=args.weight_decay,
+                    trust_coefficient=args.trust_coefficient)
+    if args.optimizer == 'lamb':
+        return LAMB(groups, args.learning_rate, betas=(args.momentum, args.beta2), weight_decay=args.weight_decay)
+    return torch.optim.SGD(groups, args.learning_rate, momentum=args.momentum, weight_decay=args.weight_decay)
+
+
+class LRSchedule(object):
+    """learning rate as a function of the fractional epoch, so it can be updated
+    every step: a linear warmup over `warmup_epochs` (from 0), then 'cosine' decay
+    to 0 or the 'linear' decay of train_imagenet.py, whose last 5 epochs have a
+    smaller slope. `scale` multiplies the result, e.g. for a larger batch."""
+
+    def __init__(self, base_lr, epochs, kind='cosine', warmup_epochs=0.):
+        if kind not in ('cosine', 'linear'):
+            raise ValueError('Unknown lr schedule: {}'.format(kind))
+        self.base_lr = base_lr
+        self.epochs = epochs
+        self.kind = kind
+        self.warmup_epochs = warmup_epochs
+        self.scale = 1.
+
+    def __call__(self, t):
+        if self.kind == 'cosine':
+            lr = 0.5 * self.base_lr * (1 + math.cos(math.pi * t / self.epochs))
+        elif self.epochs - t > 5:
+            lr = self.base_lr * (self.epochs - 5 - t) / (self.epochs - 5)
+        else:
+            lr = self.base_lr * (self.epochs - t) / ((self.epochs - 5) * 5)
+        if t < self.warmup_epochs:
+            lr *= t / self.warmup_epochs
+        return lr * self.scale
+
+    def step(self, optimizer, t):
+        """sets the lr of every group of `optimizer` for fractional epoch `t` and returns it"""
+        lr = self(t)
+        for group in optimizer.param_groups:
+            group['lr'] = lr
+        return lr
+
+    def __repr__(self):
+        return 'LRSchedule(base_lr={}, epochs={}, kind={}, warmup_epochs={})'.format(
+            self.base_lr, self.epochs, self.kind, self.warmup_epochs)
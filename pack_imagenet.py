@@ -0,0 +1,98 @@
+"""Packs an ImageNet folder (train/<class>/*.JPEG, val/<class>/*.JPEG) into shards of
+pre-resized JPEGs read by imagenet_shards.ShardedImageNet.
+
+    python pack_imagenet.py --data /path/to/imagenet --out /path/to/imagenet_shards
+
+For every split this writes <split>-NNNNN.bin (the concatenated JPEG bytes),
+<split>-NNNNN.npy (int64 rows of offset, length, label) and <split>.json listing
+the classes and shards. Training images are shuffled across shards.
+"""
+import argparse
+import io
+import json
+import multiprocessing
+import os
+import random
+import sys
+import time
+import numpy as np
+from PIL import Image
+from torchvision.datasets.folder import find_classes, make_dataset, IMG_EXTENSIONS
+
+
+parser = argparse.ArgumentParser("pack_imagenet")
+parser.add_argument('--data', type=str, required=True, help='ImageNet root holding train/ and val/')
+parser.add_argument('--out', type=str, required=True, help='output directory')
+parser.add_argument('--splits', type=str, default='train,val', help='comma separated splits to pack')
+parser.add_argument('--short_side', type=int, default=256, help='shorter image side after resizing (training images are never enlarged), 0 keeps the original size')
+parser.add_argument('--quality', type=int, default=90, help='JPEG quality of the re-encoded images')
+parser.add_argument('--shard_size', type=int, default=2048, help='images per shard')
+parser.add_argument('--workers', type=int, default=16, help='processes resizing and encoding images')
+parser.add_argument('--seed', type=int, default=0, help='seed of the training shuffle')
+
+
+def encode(job):
+    path, short_side, exact, quality = job
+    with open(path, 'rb') as f:
+        img = Image.open(f).convert('RGB')
+    if short_side > 0:
+        w, h = img.size
+        scale = short_side / float(min(w, h))
+        # training images are only shrunk, the random crops rescale them anyway; evaluation
+        # images get exactly the short side the center crop is taken from (Resize(256))
+        if scale < 1 or (exact and scale != 1):
+            img = img.resize((max(1, round(w * scale)), max(1, round(h * scale))), Image.BILINEAR)
+    buf = io.BytesIO()
+    img.save(buf, format='JPEG', quality=quality)
+    return buf.getvalue()
+
+
+def pack_split(args, split, pool):
+    classes, class_to_idx = find_classes(os.path.join(args.data, split))
+    samples = make_dataset(os.path.join(args.data, split), class_to_idx, extensions=IMG_EXTENSIONS)
+    if split == 'train':
+        random.Random(args.seed).shuffle(samples)
+    jobs = ((path, args.short_side, split != 'train', args.quality) for path, _ in samples)
+
+    shards = []
+    start = time.time()
+    out, index, offset = None, [], 0
+
+    def close():
+        out.close()
+        np.save(os.path.join(args.out, shards[-1]['index']), np.asarray(index, dtype=np.int64).reshape(-1, 3))
+        shards[-1]['count'] = len(index)
+
+    for i, data in enumerate(pool.imap(encode, jobs, chunksize=64)):
+        if i % args.shard_size == 0:
+            if out is not None:
+                close()
+            name = '%s-%05d' % (split, len(shards))
+            shards.append({'file': name + '.bin', 'index': name + '.npy'})
+            out = open(os.path.join(args.out, name + '.bin'), 'wb')
+            index, offset = [], 0
+        out.write(data)
+        index.append((offset, len(data), samples[i][1]))
+        offset += len(data)
+        if (i + 1) % 10000 == 0:
+            print('%s: %d/%d images, %.0f images/s' % (split, i + 1, len(samples), (i + 1) / (time.time() - start)))
+            sys.stdout.flush()
+    if out is not None:
+        close()
+
+    meta = {'classes': classes, 'count': len(samples), 'short_side': args.short_side, 'shards': shards}
+    with open(os.path.join(args.out, split + '.json'), 'w') as f:
+        json.dump(meta, f)
+    print('%s: %d images in %d shards' % (split, len(samples), len(shards)))
+
+
+def main():
+    args = parser.parse_args()
+    os.makedirs(args.out, exist_ok=True)
+    with multiprocessing.Pool(args.workers) as pool:
+        for split in args.splits.split(','):
+            pack_split(args, split, pool)
+
+
+if __name__ == '__main__':
+    main()
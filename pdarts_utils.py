@@ -7,34 +7,38 @@ from torch.autograd import Variable
 
 
 class AvgrageMeter(object):
+  """running average. Tensor values are summed on their device and only read back
+  when `avg` is, so updating the meter does not sync with the device."""
 
   def __init__(self):
     self.reset()
 
   def reset(self):
-    self.avg = 0
     self.sum = 0
     self.cnt = 0
 
   def update(self, val, n=1):
-    self.sum += val * n
+    if torch.is_tensor(val):
+      val = val.detach().double()
+    self.sum = self.sum + val * n
     self.cnt += n
-    self.avg = self.sum / self.cnt
+
+  @property
+  def avg(self):
+    if self.cnt == 0:
+      return 0
+    return float(self.sum) / self.cnt
 
 
 def accuracy(output, target, topk=(1,)):
+  """top-k accuracies in percent as 0-dim tensors, all k from a single topk call"""
   maxk = max(topk)
   batch_size = target.size(0)
 
   _, pred = output.topk(maxk, 1, True, True)
-  pred = pred.t()
-  correct = pred.eq(target.view(1, -1).expand_as(pred))
-
-  res = []
-  for k in topk:
-    correct_k = correct[:k].reshape(-1).float().sum(0)
-    res.append(correct_k.mul_(100.0/batch_size))
-  return res
+  # at most one hit per row, so the running count along the ranks is correct@k
+  correct = pred.eq(target.view(-1, 1)).sum(0).cumsum(0).float().mul_(100.0/batch_size)
+  return [correct[k-1] for k in topk]
 
 
 class Cutout(object):
@@ -179,14 +183,15 @@ def save(model, model_path):
 
 
 def load(model, model_path):
-  model.load_state_dict(torch.load(model_path))
+  # load_state_dict copies onto the model's device, so checkpoints written on a gpu load anywhere
+  model.load_state_dict(torch.load(model_path, map_location='cpu'))
 
 
 def drop_path(x, drop_prob):
   if drop_prob > 0.:
     keep_prob = 1.-drop_prob
-    mask = Variable(torch.cuda.FloatTensor(x.size(0), 1, 1, 1).bernoulli_(keep_prob))
-    x.div_(keep_prob)
+    # the 1/keep_prob scale goes into the per-sample mask, so x is touched once
+    mask = x.new_empty(x.size(0), 1, 1, 1).bernoulli_(keep_prob).div_(keep_prob)
     x.mul_(mask)
   return x
 
@@ -0,0 +1,168 @@
+import queue
+import threading
+import torch
+
+
+def _to_device(device):
+    def move(t):
+        return t.to(device, non_blocking=True)
+    return move
+
+
+class Normalize(object):
+    """per-channel normalization of a staged (N, C, H, W) batch, for loaders that
+    yield unnormalized tensors"""
+
+    def __init__(self, mean, std):
+        self.mean = torch.tensor(mean).view(1, -1, 1, 1)
+        self.std = torch.tensor(std).view(1, -1, 1, 1)
+
+    def __call__(self, input, target):
+        mean = self.mean.to(input.device, input.dtype)
+        std = self.std.to(input.device, input.dtype)
+        return input.sub(mean).div_(std), target
+
+
+class DataPrefetcher(object):
+    """wraps a DataLoader so that the next batch is staged on `device` while the
+    current one is computed. On cuda the copies (and `batch_transform`) run on a
+    side stream; elsewhere a background thread fetches, moves and transforms up to
+    `depth` batches ahead. Every `iter()` starts a new pass over the loader; an
+    iterator dropped before the end of its pass should be `close()`d first, since a
+    loader with persistent workers hands the next pass the same underlying iterator."""
+
+    def __init__(self, loader, device, prepare_input=None, prepare_target=None, batch_transform=None, depth=2):
+        self.loader = loader
+        self.device = torch.device(device)
+        self.prepare_input = prepare_input or _to_device(self.device)
+        self.prepare_target = prepare_target or _to_device(self.device)
+        self.batch_transform = batch_transform
+        self.depth = depth
+
+    def __len__(self):
+        return len(self.loader)
+
+    @property
+    def sampler(self):
+        return self.loader.sampler
+
+    def _stage(self, batch):
+        input, target = batch
+        input = self.prepare_input(input)
+        target = self.prepare_target(target)
+        if self.batch_transform is not None:
+            input, target = self.batch_transform(input, target)
+        return input, target
+
+    def __iter__(self):
+        if self.device.type == 'cuda':
+            return _StreamIterator(iter(self.loader), self._stage, self.device)
+        return _ThreadIterator(iter(self.loader), self._stage, self.depth)
+
+
+def for_policy(loader, policy, batch_transform=None):
+    """a DataPrefetcher staging batches the way `policy` (execution.ExecutionPolicy) expects"""
+    return DataPrefetcher(loader, policy.device, policy.prepare_input, policy.prepare_target, batch_transform)
+
+
+class _StreamIterator(object):
+
+    def __init__(self, it, stage, device):
+        self.it = it
+        self.stage = stage
+        self.stream = torch.cuda.Stream(device)
+        self.next = None
+        self._preload()
+
+    def close(self):
+        self.next = None
+
+    def _preload(self):
+        try:
+            batch = next(self.it)
+        except StopIteration:
+            self.next = None
+            return
+        with torch.cuda.stream(self.stream):
+            self.next = self.stage(batch)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.next is None:
+            raise StopIteration
+        current = torch.cuda.current_stream()
+        current.wait_stream(self.stream)
+        input, target = self.next
+        # the tensors were allocated on the side stream but are used on the current one
+        input.record_stream(current)
+        target.record_stream(current)
+        self._preload()
+        return input, target
+
+
+_END = object()
+
+
+def _worker(it, stage, out, stop):
+    try:
+        for batch in it:
+            item = stage(batch)
+            while not stop.is_set():
+                try:
+                    out.put(item, timeout=0.1)
+                    break
+                except queue.Full:
+                    pass
+            if stop.is_set():
+                return
+        item = _END
+    except Exception as e:
+        item = e
+    while not stop.is_set():
+        try:
+            out.put(item, timeout=0.1)
+            return
+        except queue.Full:
+            pass
+
+
+class _ThreadIterator(object):
+
+    def __init__(self, it, stage, depth):
+        self.queue = queue.Queue(maxsize=depth)
+        self.stop = threading.Event()
+        # the thread holds no reference to the iterator, so dropping it mid-pass closes it
+        self.thread = threading.Thread(target=_worker, args=(it, stage, self.queue, self.stop), daemon=True)
+        self.thread.start()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.stop.is_set():
+            raise StopIteration
+        item = self.queue.get()
+        if item is _END:
+            self.stop.set()
+            raise StopIteration
+        if isinstance(item, Exception):
+            self.stop.set()
+            raise item
+        return item
+
+    def close(self):
+        """stops the thread and waits for it to leave the loader iterator, which the
+        next pass may reuse"""
+        self.stop.set()
+        while True:
+            try:
+                self.queue.get_nowait()
+            except queue.Empty:
+                break
+        if self.thread.is_alive() and self.thread is not threading.current_thread():
+            self.thread.join()
+
+    def __del__(self):
+        self.close()
@@ -0,0 +1,152 @@
+import csv
+import logging
+import os
+import threading
+import torch
+from torch.profiler import profile, schedule, record_function, ProfilerActivity
+
+import distributed
+import model
+import model_search
+
+
+def add_profiling_args(parser):
+    parser.add_argument('--profile', action='store_true', default=False, help='profile a window of training steps')
+    parser.add_argument('--profile_wait', type=int, default=5, help='steps skipped before profiling')
+    parser.add_argument('--profile_warmup', type=int, default=2, help='profiled steps that are discarded')
+    parser.add_argument('--profile_steps', type=int, default=5, help='steps recorded')
+    parser.add_argument('--profile_dir', type=str, default='', help='output directory, <save>/profile by default')
+
+
+class _Ranges(object):
+    """forward hooks opening record_function ranges around a module call"""
+
+    def __init__(self):
+        self.local = threading.local()
+
+    def pre_hook(self, labels):
+        def hook(module, input):
+            stack = self.local.__dict__.setdefault('stack', [])
+            ranges = [record_function(label) for label in labels]
+            for r in ranges:
+                r.__enter__()
+            stack.append(ranges)
+        return hook
+
+    def post_hook(self, module, input, output):
+        for r in reversed(self.local.stack.pop()):
+            r.__exit__(None, None, None)
+
+
+def annotate(net, stage):
+    """labels the cells, edges and primitives of a search Network or of a
+    NetworkCIFAR/NetworkImageNet as `<stage>/cell<i>.<type>`, `<stage>/edge<j>`,
+    `<stage>/op.<primitive>` and `<stage>/preprocess`; the BatchNorm2d after the
+    search pools is labelled `<stage>/op.<pool>.bn` and left out of `op.<pool>`.
+    Returns the hook handles."""
+    ranges = _Ranges()
+    handles = []
+
+    def label(module, *labels):
+        handles.append(module.register_forward_pre_hook(ranges.pre_hook(labels)))
+        handles.append(module.register_forward_hook(ranges.post_hook))
+
+    for i, cell in enumerate(distributed.unwrap(net).cells):
+        label(cell, '%s/cell%d.%s' % (stage, i, 'reduce' if cell.reduction else 'normal'))
+        label(cell.preprocess0, '%s/preprocess' % stage)
+        label(cell.preprocess1, '%s/preprocess' % stage)
+        if isinstance(cell, model_search.Cell):
+            for j, edge in enumerate(cell.cell_ops):
+                label(edge, '%s/edge%d' % (stage, j))
+                for name, op in zip(edge.primitives, edge.m_ops):
+                    if 'pool' in name:
+                        # the pool and its BatchNorm separately, so the table does not count the BN twice
+                        label(op[0], '%s/op.%s' % (stage, name))
+                        label(op[1], '%s/op.%s.bn' % (stage, name))
+                    else:
+                        label(op, '%s/op.%s' % (stage, name))
+        elif isinstance(cell, model.Cell):
+            for j, (name, op) in enumerate(zip(cell._op_names, cell._ops)):
+                label(op, '%s/edge%d' % (stage, j), '%s/op.%s' % (stage, name))
+    return handles
+
+
+def primitive_table(events, stage):
+    """forward time and memory of each primitive and of preprocessing in `stage`,
+    most expensive first. Backward kernels run outside the forward ranges and are
+    only attributed in the trace."""
+    rows = []
+    for e in events:
+        if not e.key.startswith(stage + '/'):
+            continue
+        name = e.key[len(stage) + 1:]
+        if not (name.startswith('op.') or name == 'preprocess'):
+            continue
+        rows.append({
+            'stage': stage,
+            'primitive': name[3:] if name.startswith('op.') else name,
+            'calls': e.count,
+            'cpu_ms': e.cpu_time_total / 1e3,
+            'device_ms': e.cuda_time_total / 1e3,
+            'cpu_mem_mb': e.cpu_memory_usage / 2**20,
+            'device_mem_mb': e.cuda_memory_usage / 2**20,
+        })
+    rows.sort(key=lambda r: r['cpu_ms'] + r['device_ms'], reverse=True)
+    return rows
+
+
+class StepProfiler(object):
+    """profiles steps wait+warmup .. wait+warmup+active of a loop: call `step()` after
+    every training step. Writes a Chrome trace and the per-primitive table to
+    `out_dir` and detaches itself once the window has been recorded."""
+
+    def __init__(self, net, out_dir, stage, device, wait=5, warmup=2, active=5):
+        self.out_dir = out_dir
+        self.stage = stage
+        self.done = False
+        os.makedirs(out_dir, exist_ok=True)
+        activities = [ProfilerActivity.CPU]
+        if torch.device(device).type == 'cuda':
+            activities.append(ProfilerActivity.CUDA)
+        self.handles = annotate(net, stage)
+        self.prof = profile(activities=activities, schedule=schedule(wait=wait, warmup=warmup, active=active, repeat=1),
+                            on_trace_ready=self._export, profile_memory=True)
+        self.prof.start()
+
+    @classmethod
+    def from_args(cls, args, net, stage, device):
+        if not args.profile or not distributed.is_main_process():
+            return None
+        out_dir = args.profile_dir or os.path.join(args.save, 'profile')
+        return cls(net, out_dir, stage, device, args.profile_wait, args.profile_warmup, args.profile_steps)
+
+    def _export(self, prof):
+        trace = os.path.join(self.out_dir, 'trace-%s.json' % self.stage)
+        prof.export_chrome_trace(trace)
+        rows = primitive_table(prof.key_averages(), self.stage)
+        table = os.path.join(self.out_dir, 'primitives-%s.csv' % self.stage)
+        with open(table, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=['stage', 'primitive', 'calls', 'cpu_ms', 'device_ms', 'cpu_mem_mb', 'device_mem_mb'])
+            writer.writeheader()
+            writer.writerows(rows)
+        logging.info('profile of %s written to %s', self.stage, trace)
+        for r in rows:
+            logging.info('%s %-18s calls %5d cpu %9.2f ms device %9.2f ms mem %8.2f MB', r['stage'], r['primitive'],
+                         r['calls'], r['cpu_ms'], r['device_ms'], r['cpu_mem_mb'] + r['device_mem_mb'])
+        self.done = True
+
+    def step(self):
+        if self.prof is None:
+            return
+        self.prof.step()
+        if self.done:
+            self.close()
+
+    def close(self):
+        if self.prof is None:
+            return
+        self.prof.stop()
+        self.prof = None
+        for h in self.handles:
+            h.remove()
+        self.handles = []
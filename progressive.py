@@ -0,0 +1,75 @@
+import math
+
+
+def add_resize_args(parser):
+    parser.add_argument('--min_res', type=int, default=0, help='first training resolution of the progressive resize, 0 trains at --max_res throughout')
+    parser.add_argument('--max_res', type=int, default=224, help='resolution reached at the end of the ramp')
+    parser.add_argument('--start_ramp', type=int, default=0, help='epoch the resolution starts growing from --min_res')
+    parser.add_argument('--end_ramp', type=int, default=-1, help='epoch --max_res is reached, -1 for 3/4 of the epochs')
+    parser.add_argument('--res_step', type=int, default=32, help='resolutions are multiples of this')
+    parser.add_argument('--final_res', type=int, default=0, help='resolution of a closing fine-tune, 0 for none')
+    parser.add_argument('--final_epochs', type=int, default=0, help='epochs of the closing fine-tune')
+    parser.add_argument('--scale_batch', action='store_true', default=False,
+                        help='scale the batch size (and lr) by (max_res / res)^2 so every step sees the same number of pixels')
+
+
+class ResizeSchedule(object):
+    """training resolution and batch size of each epoch: `min_res` until `start_ramp`,
+    then a linear ramp (in steps of `res_step`) to `max_res` at `end_ramp`, then
+    `final_res` for the last `final_epochs` epochs. With `scale_batch` the batch
+    grows as the images shrink, rounded to a multiple of `multiple`."""
+
+    def __init__(self, epochs, batch_size, min_res=0, max_res=224, start_ramp=0, end_ramp=-1,
+                 res_step=32, final_res=0, final_epochs=0, scale_batch=False, multiple=8):
+        self.epochs = epochs
+        self.batch_size = batch_size
+        self.min_res = min_res or max_res
+        self.max_res = max_res
+        self.start_ramp = start_ramp
+        self.end_ramp = end_ramp if end_ramp >= 0 else (3 * epochs) // 4
+        self.res_step = res_step
+        self.final_res = final_res
+        self.final_epochs = final_epochs if final_res else 0
+        self.scale_batch = scale_batch
+        self.multiple = multiple
+        if self.end_ramp < self.start_ramp:
+            raise ValueError('end_ramp {} is before start_ramp {}'.format(self.end_ramp, self.start_ramp))
+
+    @classmethod
+    def from_args(cls, args, multiple=8):
+        return cls(args.epochs, args.batch_size, args.min_res, args.max_res, args.start_ramp, args.end_ramp,
+                   args.res_step, args.final_res, args.final_epochs, args.scale_batch, multiple)
+
+    @property
+    def enabled(self):
+        return self.min_res != self.max_res or self.final_epochs > 0 or self.scale_batch
+
+    def resolution(self, epoch):
+        if epoch >= self.epochs - self.final_epochs:
+            return self.final_res
+        if epoch <= self.start_ramp or self.min_res == self.max_res:
+            return self.min_res
+        if epoch >= self.end_ramp:
+            return self.max_res
+        res = self.min_res + (self.max_res - self.min_res) * (epoch - self.start_ramp) / float(self.end_ramp - self.start_ramp)
+        return max(self.min_res, int(res) // self.res_step * self.res_step)
+
+    def batch(self, res):
+        if not self.scale_batch:
+            return self.batch_size
+        batch = self.batch_size * (self.max_res / float(res)) ** 2
+        return max(self.multiple, int(math.floor(batch / self.multiple)) * self.multiple)
+
+    def __call__(self, epoch):
+        """(resolution, global batch size) of `epoch`"""
+        res = self.resolution(epoch)
+        return res, self.batch(res)
+
+    def __repr__(self):
+        phases, last = [], None
+        for epoch in range(self.epochs):
+            phase = self(epoch)
+            if phase != last:
+                phases.append('%d:%dpx/%d' % ((epoch,) + phase))
+                last = phase
+        return 'ResizeSchedule(%s)' % ', '.join(phases)
@@ -0,0 +1,133 @@
+"""Post-training int8 quantization of a trained NetworkCIFAR for CPU inference.
+
+    python quantize.py --auxiliary --model_path CIFAR10.pt --data ../data --save CIFAR10_int8.pt
+
+BatchNorm is folded into the convolutions (fusion.fuse_network) and every cell is
+replaced by its static graph (compile_cells, without the preallocated concat buffer),
+so the whole network traces with torch.fx: the Identity skips are plain edges, node
+sums become quantized adds and the cell output a quantized cat. Observers are
+calibrated on --calib_batches batches of un-augmented training images, then the
+network is converted and compared with the fp32 model (the one test.py evaluates)
+on the test set: top-1/top-5, accuracy drop, latency at batch 1 and --batch_size,
+and serialized size.
+"""
+import argparse
+import io
+import logging
+import sys
+import torch
+from torch.ao.quantization import get_default_qconfig_mapping
+from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+
+import execution
+import fusion
+import compile_cells
+import genotypes
+import pdarts_utils
+from evaluate import load_test_set, evaluate
+from timing import time_fn, latency_stats
+from model import NetworkCIFAR as Network
+
+
+parser = argparse.ArgumentParser("quantize")
+parser.add_argument('--data', type=str, default='../data', help='location of the data corpus')
+parser.add_argument('--cifar100', action='store_true', default=False, help='quantize a cifar100 model')
+parser.add_argument('--arch', type=str, default='PDARTS', help='which architecture to use')
+parser.add_argument('--model_path', type=str, default='CIFAR10.pt', help='path of pretrained model')
+parser.add_argument('--init_channels', type=int, default=36, help='num of init channels')
+parser.add_argument('--layers', type=int, default=20, help='total number of layers')
+parser.add_argument('--auxiliary', action='store_true', default=False, help='the checkpoint has an auxiliary tower')
+parser.add_argument('--backend', type=str, default='x86', choices=['x86', 'fbgemm', 'qnnpack', 'onednn'], help='quantized kernels to target, qnnpack on arm')
+parser.add_argument('--calib_batches', type=int, default=32, help='training batches used to calibrate the observers')
+parser.add_argument('--batch_size', type=int, default=128, help='batch size of calibration, evaluation and the batched latency')
+parser.add_argument('--latency_iters', type=int, default=50, help='timed forwards per latency measurement')
+parser.add_argument('--threads', type=int, default=0, help='intra-op threads, 0 uses all cores')
+parser.add_argument('--seed', type=int, default=0, help='seed of the calibration subset')
+parser.add_argument('--save', type=str, default='', help='save the quantized network as TorchScript here')
+
+log_format = '%(asctime)s %(message)s'
+
+
+def quantize_network(model, calib_batches, backend='x86'):
+    """an int8 fx.GraphModule of a trained NetworkCIFAR/NetworkImageNet, calibrated on
+    `calib_batches` (normalized float input batches); the model itself is left untouched"""
+    torch.backends.quantized.engine = backend
+    fused = fusion.fuse_network(model).cpu()
+    compile_cells.compile_network(fused, use_buffer=False)
+    example = calib_batches[0][:1]
+    prepared = prepare_fx(fused, get_default_qconfig_mapping(backend), (example,))
+    with torch.no_grad():
+        for input in calib_batches:
+            prepared(input)
+    return convert_fx(prepared)
+
+
+def calibration_batches(train_set, num_batches, batch_size, seed=0):
+    images, _, (mean, std) = train_set
+    g = torch.Generator().manual_seed(seed)
+    index = torch.randperm(images.size(0), generator=g)[:num_batches * batch_size]
+    mean = torch.tensor(mean).view(1, 3, 1, 1)
+    std = torch.tensor(std).view(1, 3, 1, 1)
+    return [images[index[i:i + batch_size]].float().div_(255).sub_(mean).div_(std)
+            for i in range(0, index.numel(), batch_size)]
+
+
+def serialized_mb(model):
+    buf = io.BytesIO()
+    torch.save(model.state_dict(), buf)
+    return buf.tell() / 2**20
+
+
+def latency(model, batch_size, iters):
+    x = torch.randn(batch_size, 3, 32, 32)
+    with torch.no_grad():
+        return latency_stats(time_fn(lambda: model(x), torch.device('cpu'), warmup=5, iters=iters))
+
+
+def main():
+    args = parser.parse_args()
+    logging.basicConfig(stream=sys.stdout, level=logging.INFO, format=log_format, datefmt='%m/%d %I:%M:%S %p')
+    device = torch.device('cpu')
+    threads = execution.setup_device(device, args.seed, args.threads)
+    logging.info('args = %s', args)
+    logging.info('threads = %d, backend = %s', threads, args.backend)
+
+    dataset = 'cifar100' if args.cifar100 else 'cifar10'
+    genotype = getattr(genotypes, args.arch)
+    model = Network(args.init_channels, 100 if args.cifar100 else 10, args.layers, args.auxiliary, genotype)
+    pdarts_utils.load(model, args.model_path)
+    model.drop_path_prob = 0.0
+    model.eval()
+
+    train_set = load_test_set(dataset, args.data, train=True)
+    test_set = load_test_set(dataset, args.data)
+    calib = calibration_batches(train_set, args.calib_batches, args.batch_size, args.seed)
+    logging.info('calibrating on %d training images', sum(b.size(0) for b in calib))
+    quantized = quantize_network(model, calib, args.backend)
+
+    rows = []
+    for name, net in (('fp32', model), ('int8', quantized)):
+        top1, top5, loss, images_per_s = evaluate(net, test_set, device, args.batch_size)
+        row = {'model': name, 'top1': top1, 'top5': top5, 'loss': loss, 'images_per_s': images_per_s,
+               'size_mb': serialized_mb(net),
+               'latency_1_ms': latency(net, 1, args.latency_iters)['p50_ms'],
+               'latency_%d_ms' % args.batch_size: latency(net, args.batch_size, max(args.latency_iters // 10, 3))['p50_ms']}
+        rows.append(row)
+        logging.info('%s: top1 %.2f top5 %.2f loss %.4f | %.0f img/s, p50 latency %.2f ms at batch 1, %.2f ms at batch %d | %.2f MB',
+                     name, top1, top5, loss, images_per_s, row['latency_1_ms'], row['latency_%d_ms' % args.batch_size],
+                     args.batch_size, row['size_mb'])
+    fp32, int8 = rows
+    logging.info('int8 vs fp32: top1 drop %.2f, top5 drop %.2f, %.2fx faster at batch 1, %.2fx at batch %d, %.2fx smaller',
+                 fp32['top1'] - int8['top1'], fp32['top5'] - int8['top5'],
+                 fp32['latency_1_ms'] / int8['latency_1_ms'],
+                 fp32['latency_%d_ms' % args.batch_size] / int8['latency_%d_ms' % args.batch_size], args.batch_size,
+                 fp32['size_mb'] / int8['size_mb'])
+
+    if args.save:
+        scripted = torch.jit.script(quantized)
+        torch.jit.save(scripted, args.save)
+        logging.info('quantized network saved to %s', args.save)
+
+
+if __name__ == '__main__':
+    main()
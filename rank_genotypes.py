@@ -0,0 +1,187 @@
+"""Cheap ranking of candidate genotypes before full training: every candidate is built
+at the width and depth of a saved search supernet (train_search.py --save_full_model
+writes model-<stage>.pt), inherits the supernet's weights for the ops it shares with
+it (warmstart.inherit_weights), is fine-tuned briefly and is scored on a held-out
+part of the training set. Candidates are spread over a pool of processes.
+
+    python rank_genotypes.py --supernet search-try/model-2.pt --genotypes PDARTS,DARTS_V2,RANDOM_1 --workers 4
+"""
+import argparse
+import csv
+import logging
+import math
+import os
+import sys
+import time
+import torch
+import torch.multiprocessing as mp
+import torch.nn as nn
+import torch.nn.functional as F
+
+import execution
+import genotypes
+import pdarts_utils
+import warmstart
+from evaluate import load_test_set, evaluate
+from model import NetworkCIFAR as Network
+
+
+parser = argparse.ArgumentParser("rank_genotypes")
+parser.add_argument('--supernet', type=str, required=True, help='model-<stage>.pt saved by train_search.py --save_full_model')
+parser.add_argument('--genotypes', type=str, default='all', help="comma separated genotype names from genotypes.py, or 'all'")
+parser.add_argument('--data', type=str, default='../data', help='location of the data corpus')
+parser.add_argument('--cifar100', action='store_true', default=False, help='the supernet was searched on cifar100')
+parser.add_argument('--valid_portion', type=float, default=0.1, help='held-out share of the training set the candidates are ranked on')
+parser.add_argument('--epochs', type=float, default=1, help='fine-tuning epochs, fractions allowed')
+parser.add_argument('--batch_size', type=int, default=96, help='batch size')
+parser.add_argument('--learning_rate', type=float, default=0.01, help='initial fine-tuning learning rate, cosine annealed')
+parser.add_argument('--momentum', type=float, default=0.9, help='momentum')
+parser.add_argument('--weight_decay', type=float, default=3e-4, help='weight decay')
+parser.add_argument('--grad_clip', type=float, default=5, help='gradient clipping')
+parser.add_argument('--no_inherit', action='store_true', default=False, help='start from random weights, to measure what inheriting buys')
+parser.add_argument('--workers', type=int, default=1, help='ranking processes, spread over the visible gpus')
+parser.add_argument('--seed', type=int, default=0, help='random seed')
+parser.add_argument('--save', type=str, default='ranking.csv', help='results table (.csv)')
+execution.add_device_args(parser)
+
+log_format = '%(asctime)s %(message)s'
+COLUMNS = ['rank', 'genotype', 'top1', 'top5', 'loss', 'inherited_top1', 'inherited_ops', 'total_ops',
+           'params_mb', 'train_s', 'error']
+
+
+def candidate_names(spec):
+    if spec == 'all':
+        return [name for name in dir(genotypes) if isinstance(getattr(genotypes, name), genotypes.Genotype)]
+    return spec.split(',')
+
+
+def split(data, valid_portion):
+    images, labels, norm = data
+    n_train = int(images.size(0) * (1 - valid_portion))
+    # separate shared copies: the pool's initargs cannot carry views into one shared storage
+    parts = [t.clone().share_memory_() for t in (images[:n_train], labels[:n_train], images[n_train:], labels[n_train:])]
+    return (parts[0], parts[1], norm), (parts[2], parts[3], norm)
+
+
+def augment(images, mean, std, generator):
+    """random crop (4 pixel padding) and horizontal flip per image, then normalization"""
+    n, _, h, w = images.shape
+    x = F.pad(images.float().div_(255), (4, 4, 4, 4))
+    dy = torch.randint(0, 9, (n,), generator=generator)
+    dx = torch.randint(0, 9, (n,), generator=generator)
+    rows = (dy[:, None] + torch.arange(h))[:, None, :, None]
+    cols = (dx[:, None] + torch.arange(w))[:, None, None, :]
+    x = x[torch.arange(n)[:, None, None, None], torch.arange(3)[None, :, None, None], rows, cols]
+    flip = torch.rand(n, generator=generator) < 0.5
+    x = torch.where(flip[:, None, None, None], x.flip(3), x)
+    return x.sub_(mean).div_(std)
+
+
+def fine_tune(model, train_set, device, args):
+    images, labels, (mean, std) = train_set
+    mean = torch.tensor(mean).view(1, 3, 1, 1)
+    std = torch.tensor(std).view(1, 3, 1, 1)
+    steps = max(1, int(math.ceil(args.epochs * images.size(0) / args.batch_size)))
+    optimizer = torch.optim.SGD(model.parameters(), args.learning_rate, momentum=args.momentum, weight_decay=args.weight_decay)
+    scheduler = torch.optim.lr_scheduler.CosineAnnealingLR(optimizer, steps)
+    criterion = nn.CrossEntropyLoss()
+    g = torch.Generator().manual_seed(args.seed)
+    model.train()
+    order = torch.randperm(images.size(0), generator=g)
+    pos = 0
+    for _ in range(steps):
+        if pos + args.batch_size > order.numel():
+            order, pos = torch.randperm(images.size(0), generator=g), 0
+        index = order[pos:pos + args.batch_size]
+        pos += args.batch_size
+        input = augment(images[index], mean, std, g).to(device, non_blocking=True)
+        target = labels[index].to(device, non_blocking=True)
+        optimizer.zero_grad()
+        logits, _ = model(input)
+        loss = criterion(logits, target)
+        loss.backward()
+        nn.utils.clip_grad_norm_(model.parameters(), args.grad_clip)
+        optimizer.step()
+        scheduler.step()
+    model.eval()
+
+
+_worker = {}
+
+
+def init_worker(args, train_set, valid_set, num_gpus):
+    identity = mp.current_process()._identity
+    index = identity[0] - 1 if identity else 0
+    device = execution.get_device(args.device, index % max(num_gpus, 1))
+    threads = args.threads or max(1, (os.cpu_count() or 1) // max(args.workers, 1))
+    execution.setup_device(device, args.seed, threads)
+    logging.basicConfig(stream=sys.stdout, level=logging.INFO, format=log_format, datefmt='%m/%d %I:%M:%S %p')
+    supernet = torch.load(args.supernet, map_location='cpu')
+    _worker.update(args=args, train_set=train_set, valid_set=valid_set, device=device, supernet=supernet)
+
+
+def rank_one(name):
+    args, device, supernet = _worker['args'], _worker['device'], _worker['supernet']
+    row = {'genotype': name}
+    try:
+        torch.manual_seed(args.seed)
+        genotype = getattr(genotypes, name)
+        model = Network(supernet._C, supernet._num_classes, supernet._layers, False, genotype)
+        model.drop_path_prob = 0.0
+        row['params_mb'] = pdarts_utils.count_parameters_in_MB(model)
+        if not args.no_inherit:
+            row['inherited_ops'], row['total_ops'] = warmstart.inherit_weights(model, supernet)
+        model = model.to(device).eval()
+        row['inherited_top1'] = evaluate(model, _worker['valid_set'], device, 256)[0]
+        start = time.time()
+        fine_tune(model, _worker['train_set'], device, args)
+        row['train_s'] = time.time() - start
+        row['top1'], row['top5'], row['loss'], _ = evaluate(model, _worker['valid_set'], device, 256)
+        logging.info('%s: top1 %.2f (%.2f before fine-tuning), %s/%s ops inherited', name, row['top1'],
+                     row['inherited_top1'], row.get('inherited_ops', 0), row.get('total_ops', '-'))
+    except Exception as e:
+        logging.warning('%s failed: %r', name, e)
+        row['error'] = repr(e)
+    return row
+
+
+def main():
+    args = parser.parse_args()
+    logging.basicConfig(stream=sys.stdout, level=logging.INFO, format=log_format, datefmt='%m/%d %I:%M:%S %p')
+    logging.info('args = %s', args)
+    names = candidate_names(args.genotypes)
+    supernet = torch.load(args.supernet, map_location='cpu')
+    dataset = 'cifar100' if args.cifar100 else 'cifar10'
+    if supernet._num_classes != (100 if args.cifar100 else 10):
+        parser.error('the supernet has %d classes, not those of %s' % (supernet._num_classes, dataset))
+    logging.info('supernet: %d channels, %d layers; ranking %d genotypes', supernet._C, supernet._layers, len(names))
+    del supernet
+    train_set, valid_set = split(load_test_set(dataset, args.data, train=True), args.valid_portion)
+    num_gpus = torch.cuda.device_count() if execution.get_device(args.device).type == 'cuda' else 0
+
+    start = time.time()
+    if args.workers > 1:
+        with mp.get_context('spawn').Pool(args.workers, initializer=init_worker,
+                                          initargs=(args, train_set, valid_set, num_gpus)) as pool:
+            rows = pool.map(rank_one, names, chunksize=1)
+    else:
+        init_worker(args, train_set, valid_set, num_gpus)
+        rows = [rank_one(name) for name in names]
+    logging.info('ranked %d genotypes in %ds', len(rows), time.time() - start)
+
+    rows.sort(key=lambda r: r.get('top1', -1), reverse=True)
+    for rank, row in enumerate(rows):
+        if 'error' not in row:
+            row['rank'] = rank + 1
+            logging.info('%3d %-22s top1 %6.2f top5 %6.2f loss %.4f | inherited %s/%s ops, %.2f before fine-tuning',
+                         rank + 1, row['genotype'], row['top1'], row['top5'], row['loss'],
+                         row.get('inherited_ops', 0), row.get('total_ops', '-'), row['inherited_top1'])
+    with open(args.save, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=COLUMNS)
+        writer.writeheader()
+        writer.writerows(rows)
+    logging.info('ranking written to %s', args.save)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,321 @@
+"""Serves a trained NetworkCIFAR/NetworkImageNet over HTTP, batching concurrent
+requests dynamically: a batch is run as soon as --max_batch images are queued or the
+oldest has waited --max_wait_ms.
+
+    python serve.py --arch PDARTS --model_path CIFAR10.pt --auxiliary --device cpu --threads 4
+
+POST /predict takes an .npy array of uint8 RGB images, (H, W, 3) or (N, H, W, 3), and
+answers with the --topk classes and probabilities of each. GET /metrics reports
+request, batch and latency statistics, GET /health answers ok. loadgen.py stresses a
+running server.
+"""
+import argparse
+import collections
+import io
+import json
+import logging
+import sys
+import threading
+import time
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+import execution
+import fusion
+import compile_cells
+import genotypes
+import imagenet_shards
+import pdarts_utils
+from timing import latency_stats
+from model import NetworkCIFAR, NetworkImageNet
+
+
+parser = argparse.ArgumentParser("serve")
+parser.add_argument('--arch', type=str, default='PDARTS', help='which architecture to use')
+parser.add_argument('--model_path', type=str, required=True, help='path of the trained model')
+parser.add_argument('--dataset', type=str, default='cifar10', choices=['cifar10', 'cifar100', 'imagenet'], help='dataset the model was trained on')
+parser.add_argument('--init_channels', type=int, default=0, help='num of init channels, 0 for the dataset default')
+parser.add_argument('--layers', type=int, default=0, help='total number of layers, 0 for the dataset default')
+parser.add_argument('--auxiliary', action='store_true', default=False, help='the checkpoint has an auxiliary tower')
+parser.add_argument('--fuse', action='store_true', default=False, help='fold BN into convs and drop training-only branches')
+parser.add_argument('--compile', action='store_true', default=False, help='compile the genotype cells into static graphs')
+parser.add_argument('--host', type=str, default='127.0.0.1', help='address to listen on')
+parser.add_argument('--port', type=int, default=8000, help='port to listen on')
+parser.add_argument('--max_batch', type=int, default=32, help='largest batch run at once')
+parser.add_argument('--max_wait_ms', type=float, default=5., help='longest a request waits for its batch to fill')
+parser.add_argument('--model_workers', type=int, default=1, help='threads running batches concurrently; on cpu --threads is split among them')
+parser.add_argument('--topk', type=int, default=5, help='classes returned per image')
+execution.add_device_args(parser)
+
+log_format = '%(asctime)s %(message)s'
+
+# classes, init channels, layers, network and normalization of every dataset
+_CIFAR_NORM = pdarts_utils._data_transforms_cifar10(argparse.Namespace(cutout=False))[1].transforms[-1]
+_CIFAR100_NORM = pdarts_utils._data_transforms_cifar100(argparse.Namespace(cutout=False))[1].transforms[-1]
+DATASETS = {
+    'cifar10': (10, 36, 20, NetworkCIFAR, _CIFAR_NORM.mean, _CIFAR_NORM.std),
+    'cifar100': (100, 36, 20, NetworkCIFAR, _CIFAR100_NORM.mean, _CIFAR100_NORM.std),
+    'imagenet': (1000, 48, 14, NetworkImageNet, imagenet_shards.IMAGENET_MEAN, imagenet_shards.IMAGENET_STD),
+}
+
+
+def load_model(args, device):
+    classes, init_channels, layers, network, _, _ = DATASETS[args.dataset]
+    genotype = getattr(genotypes, args.arch)
+    model = network(args.init_channels or init_channels, classes, args.layers or layers, args.auxiliary, genotype)
+    if args.dataset == 'imagenet':
+        # train_imagenet.py checkpoints wrap the weights with the epoch and optimizer state, and
+        # save them from the DataParallel/DDP wrapper, with every key under 'module.'
+        state = torch.load(args.model_path, map_location='cpu')
+        state = state.get('state_dict', state)
+        model.load_state_dict(dict((k[len('module.'):] if k.startswith('module.') else k, v) for k, v in state.items()))
+    else:
+        pdarts_utils.load(model, args.model_path)
+    model = model.to(device)
+    model.drop_path_prob = 0.0
+    model.eval()
+    if args.fuse:
+        model = fusion.fuse_network(model)
+    if args.compile:
+        model = compile_cells.compile_network(model)
+    return model
+
+
+class Metrics(object):
+    """counters and a sliding window of per-request timings"""
+
+    def __init__(self, window=10000):
+        self.lock = threading.Lock()
+        self.start = time.time()
+        self.requests = 0
+        self.images = 0
+        self.batches = 0
+        self.batch_images = 0
+        self.errors = 0
+        self.queue_ms = collections.deque(maxlen=window)
+        self.compute_ms = collections.deque(maxlen=window)
+        self.total_ms = collections.deque(maxlen=window)
+        self.done = collections.deque(maxlen=window)
+
+    def batch(self, images, compute_ms):
+        with self.lock:
+            self.batches += 1
+            self.batch_images += images
+            self.compute_ms.append(compute_ms)
+
+    def request(self, images, queue_ms, total_ms):
+        with self.lock:
+            self.requests += 1
+            self.images += images
+            self.queue_ms.append(queue_ms)
+            self.total_ms.append(total_ms)
+            self.done.append((time.time(), images))
+
+    def error(self):
+        with self.lock:
+            self.errors += 1
+
+    def snapshot(self):
+        with self.lock:
+            now = time.time()
+            recent = [n for t, n in self.done if now - t <= 10.]
+            report = {
+                'uptime_s': now - self.start,
+                'requests': self.requests,
+                'images': self.images,
+                'errors': self.errors,
+                'batches': self.batches,
+                'mean_batch': self.batch_images / max(self.batches, 1),
+                'images_per_s': self.images / max(now - self.start, 1e-9),
+                'images_per_s_10s': sum(recent) / 10.,
+            }
+            for name, values in (('queue', self.queue_ms), ('compute', self.compute_ms), ('total', self.total_ms)):
+                if values:
+                    report[name] = latency_stats(list(values))
+        return report
+
+
+class DynamicBatcher(object):
+    """collects submitted image batches into model batches of up to `max_batch`
+    images, waiting at most `max_wait_ms` after the first one arrives. `workers`
+    threads run the batches, each with `intra_op_threads` cpu threads (0 keeps the
+    process setting); a request larger than `max_batch` runs on its own. `close()`
+    runs what is still queued, later submissions fail."""
+
+    def __init__(self, model, device, mean, std, max_batch=32, max_wait_ms=5., workers=1, topk=5, metrics=None,
+                 intra_op_threads=0):
+        self.model = model
+        self.device = device
+        self.mean = torch.tensor(mean, device=device).view(1, 3, 1, 1)
+        self.std = torch.tensor(std, device=device).view(1, 3, 1, 1)
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1e3
+        self.topk = topk
+        self.metrics = metrics or Metrics()
+        self.intra_op_threads = intra_op_threads
+        self.cond = threading.Condition()
+        self.pending = collections.deque()
+        self.closed = False
+        self.threads = [threading.Thread(target=self._run, daemon=True) for _ in range(workers)]
+        for t in self.threads:
+            t.start()
+
+    def submit(self, images):
+        """queues a uint8 (N, H, W, 3) tensor, returns a Future of (probs, classes)"""
+        future = Future()
+        with self.cond:
+            if self.closed:
+                raise RuntimeError('the batcher is closed')
+            self.pending.append((images, future, time.perf_counter()))
+            self.cond.notify()
+        return future
+
+    def _take(self):
+        with self.cond:
+            while not self.pending and not self.closed:
+                self.cond.wait()
+            if not self.pending:
+                return []
+            batch = [self.pending.popleft()]
+            size = batch[0][0].size(0)
+            deadline = batch[0][2] + self.max_wait
+            shape = batch[0][0].shape[1:]
+            while size < self.max_batch:
+                if self.pending:
+                    images = self.pending[0][0]
+                    if images.shape[1:] != shape or size + images.size(0) > self.max_batch:
+                        break
+                    batch.append(self.pending.popleft())
+                    size += images.size(0)
+                    continue
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0 or self.closed:
+                    break
+                self.cond.wait(remaining)
+            return batch
+
+    def _run(self):
+        if self.intra_op_threads > 0:
+            # the OpenMP team size is per calling thread, so each worker gets its own share
+            torch.set_num_threads(self.intra_op_threads)
+        while True:
+            batch = self._take()
+            if not batch:
+                return
+            start = time.perf_counter()
+            try:
+                input = torch.cat([images for images, _, _ in batch]).to(self.device, non_blocking=True)
+                input = input.permute(0, 3, 1, 2).float().div_(255).sub_(self.mean).div_(self.std)
+                with torch.no_grad():
+                    logits, _ = self.model(input)
+                    probs, classes = F.softmax(logits, dim=1).topk(min(self.topk, logits.size(1)), dim=1)
+                probs, classes = probs.cpu(), classes.cpu()
+            except Exception as e:
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+            end = time.perf_counter()
+            self.metrics.batch(input.size(0), (end - start) * 1e3)
+            offset = 0
+            for images, future, arrival in batch:
+                n = images.size(0)
+                future.set_result((probs[offset:offset + n], classes[offset:offset + n]))
+                self.metrics.request(n, (start - arrival) * 1e3, (end - arrival) * 1e3)
+                offset += n
+
+    def close(self):
+        """runs the batches still queued, then stops the workers"""
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+        for t in self.threads:
+            t.join()
+
+
+def decode_images(body):
+    images = np.load(io.BytesIO(body), allow_pickle=False)
+    if images.dtype != np.uint8 or images.ndim not in (3, 4) or images.shape[-1] != 3:
+        raise ValueError('expected uint8 images of shape (H, W, 3) or (N, H, W, 3), got {} {}'.format(images.dtype, images.shape))
+    if images.ndim == 3:
+        images = images[None]
+    return torch.from_numpy(np.ascontiguousarray(images))
+
+
+def make_handler(batcher):
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def _reply(self, code, payload):
+            body = json.dumps(payload).encode()
+            self.send_response(code)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path == '/metrics':
+                self._reply(200, batcher.metrics.snapshot())
+            elif self.path == '/health':
+                self._reply(200, {'status': 'ok'})
+            else:
+                self._reply(404, {'error': 'unknown path ' + self.path})
+
+        def do_POST(self):
+            if self.path != '/predict':
+                self._reply(404, {'error': 'unknown path ' + self.path})
+                return
+            try:
+                images = decode_images(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+            except Exception as e:
+                batcher.metrics.error()
+                self._reply(400, {'error': str(e)})
+                return
+            try:
+                probs, classes = batcher.submit(images).result()
+            except Exception as e:
+                batcher.metrics.error()
+                self._reply(500, {'error': repr(e)})
+                return
+            self._reply(200, {'classes': classes.tolist(), 'probs': probs.tolist()})
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def main():
+    args = parser.parse_args()
+    logging.basicConfig(stream=sys.stdout, level=logging.INFO, format=log_format, datefmt='%m/%d %I:%M:%S %p')
+    device = execution.get_device(args.device)
+    threads = execution.setup_device(device, 0, args.threads)
+    logging.info('args = %s', args)
+    logging.info('device = %s, threads = %d', device, threads)
+    model = load_model(args, device)
+    _, _, _, _, mean, std = DATASETS[args.dataset]
+    # the workers split the cpu threads rather than contend for one pool of them
+    per_worker = max(1, threads // args.model_workers) if device.type == 'cpu' and args.model_workers > 1 else 0
+    if per_worker:
+        logging.info('%d model workers with %d threads each', args.model_workers, per_worker)
+    batcher = DynamicBatcher(model, device, mean, std, args.max_batch, args.max_wait_ms, args.model_workers, args.topk,
+                             intra_op_threads=per_worker)
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(batcher))
+    server.daemon_threads = True
+    logging.info('serving %s on http://%s:%d', args.arch, args.host, args.port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        batcher.close()
+        logging.info('metrics = %s', json.dumps(batcher.metrics.snapshot()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,189 @@
+"""Compares many genotypes by successive halving over train_cifar.py runs. Every arch
+is trained to the first rung (--min_epochs), the best 1/--eta of them by validation
+accuracy are resumed from their checkpoints up to the next rung (min_epochs * eta,
+...), and so on until the survivors reach --epochs. Every run keeps the lr and
+drop-path schedule of a full --epochs run, so a promoted run continues exactly as if
+it had never stopped. Runs that train_cifar.py --lc_store stops early (unlikely to beat
+the incumbent) are not promoted; they are ranked by their accuracy when they stopped.
+
+    python successive_halving.py --archs PDARTS,DARTS_V2,RANDOM_1,RANDOM_2 --min_epochs 20 --eta 3 \\
+        --gpus 0,1,2,3 --save sh-runs -- --tmp_data_dir ../data --auxiliary --cutout
+
+Arguments after -- (and any this script does not know) go to every train_cifar.py run.
+Runs live in <save>/<arch>; restarting the scheduler with the same --save picks up
+the existing checkpoints.
+"""
+import argparse
+import csv
+import logging
+import os
+import subprocess
+import sys
+import time
+import torch
+
+import genotypes
+from rank_genotypes import candidate_names
+
+
+parser = argparse.ArgumentParser("successive_halving")
+parser.add_argument('--archs', type=str, required=True, help="comma separated genotype names from genotypes.py, or 'all'")
+parser.add_argument('--epochs', type=int, default=600, help='epochs of a full run, the last rung')
+parser.add_argument('--min_epochs', type=int, default=20, help='epochs every arch is trained for (the first rung)')
+parser.add_argument('--eta', type=int, default=3, help='keep 1/eta of the archs at each rung, which lasts eta times longer')
+parser.add_argument('--metric', type=str, default='best', choices=['best', 'last'], help='best valid accuracy so far or that of the last epoch')
+parser.add_argument('--gpus', type=str, default='', help='comma separated gpu ids, one run per gpu at a time')
+parser.add_argument('--parallel', type=int, default=0, help='concurrent runs, defaults to the number of --gpus (or 1)')
+parser.add_argument('--save', type=str, default='sh-runs', help='directory of the runs and the results table')
+
+log_format = '%(asctime)s %(message)s'
+
+
+def rung_epochs(min_epochs, epochs, eta):
+    rungs = []
+    r = min_epochs
+    while r < epochs:
+        rungs.append(r)
+        r *= eta
+    return rungs + [epochs]
+
+
+def read_checkpoint(run_dir):
+    path = os.path.join(run_dir, 'checkpoint.pth.tar')
+    if not os.path.exists(path):
+        return None
+    checkpoint = torch.load(path, map_location='cpu')
+    return {'epoch': checkpoint['epoch'], 'best': checkpoint['best_acc_top1'], 'last': checkpoint.get('valid_acc'),
+            'valid_accs': checkpoint.get('valid_accs', []), 'stopped': checkpoint.get('stopped', False)}
+
+
+def metric_at(state, metric, epoch):
+    """`metric` of a run as of `epoch`, which its checkpoint may already be past"""
+    accs = state['valid_accs'][:epoch]
+    if len(accs) < epoch:
+        # checkpoints without the per-epoch accuracies
+        return state[metric]
+    return max(accs) if metric == 'best' else accs[-1]
+
+
+class RunPool(object):
+    """runs train_cifar.py commands, at most one per slot, each slot pinned to a gpu"""
+
+    def __init__(self, slots, gpus, log_dir):
+        self.free = list(range(slots))
+        self.gpus = gpus
+        self.log_dir = log_dir
+        self.running = {}
+
+    def run_all(self, jobs):
+        """runs (name, argv) jobs; returns {name: returncode}"""
+        jobs = list(jobs)
+        codes = {}
+        while jobs or self.running:
+            while jobs and self.free:
+                name, argv = jobs.pop(0)
+                slot = self.free.pop(0)
+                env = dict(os.environ)
+                if self.gpus:
+                    env['CUDA_VISIBLE_DEVICES'] = self.gpus[slot % len(self.gpus)]
+                out = open(os.path.join(self.log_dir, name + '.out'), 'a')
+                proc = subprocess.Popen(argv, env=env, stdout=out, stderr=subprocess.STDOUT)
+                self.running[proc] = (name, slot, out)
+            time.sleep(1)
+            for proc in [p for p in self.running if p.poll() is not None]:
+                name, slot, out = self.running.pop(proc)
+                out.close()
+                self.free.append(slot)
+                codes[name] = proc.returncode
+                if proc.returncode != 0:
+                    logging.warning('%s exited with %d, see %s', name, proc.returncode, out.name)
+        return codes
+
+
+def main():
+    args, train_args = parser.parse_known_args()
+    train_args = [a for a in train_args if a != '--']
+    if not os.path.exists(args.save):
+        os.makedirs(args.save)
+    logging.basicConfig(stream=sys.stdout, level=logging.INFO, format=log_format, datefmt='%m/%d %I:%M:%S %p')
+    fh = logging.FileHandler(os.path.join(args.save, 'log.txt'))
+    fh.setFormatter(logging.Formatter(log_format))
+    logging.getLogger().addHandler(fh)
+    logging.info('args = %s, train_cifar.py args = %s', args, train_args)
+
+    archs = candidate_names(args.archs)
+    for arch in archs:
+        if not isinstance(getattr(genotypes, arch, None), genotypes.Genotype):
+            parser.error('unknown genotype %s' % arch)
+    rungs = rung_epochs(args.min_epochs, args.epochs, args.eta)
+    gpus = args.gpus.split(',') if args.gpus else []
+    pool = RunPool(args.parallel or max(len(gpus), 1), gpus, args.save)
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'train_cifar.py')
+    logging.info('%d archs, rungs at epochs %s', len(archs), rungs)
+
+    results = dict((arch, {}) for arch in archs)
+    alive = list(archs)
+    total_epochs = 0
+    for i, rung in enumerate(rungs):
+        jobs = []
+        for arch in alive:
+            run_dir = os.path.join(args.save, arch)
+            state = read_checkpoint(run_dir)
+            if state is not None and (state['epoch'] >= rung or state['stopped']):
+                continue
+            total_epochs += rung - (state['epoch'] if state else 0)
+            jobs.append((arch, [sys.executable, script, '--arch', arch, '--exp_dir', run_dir, '--resume',
+                                '--epochs', str(args.epochs), '--stop_epoch', str(rung)] + train_args))
+        logging.info('rung %d: training %d of %d archs to epoch %d', i, len(jobs), len(alive), rung)
+        start = time.time()
+        codes = pool.run_all(jobs)
+        logging.info('rung %d done in %ds', i, time.time() - start)
+
+        scored = []
+        for arch in alive:
+            state = read_checkpoint(os.path.join(args.save, arch))
+            if codes.get(arch, 0) == 0 and state is not None and state['stopped'] and state['epoch'] <= rung:
+                results[arch]['stopped'] = (state['epoch'], metric_at(state, args.metric, state['epoch']))
+                logging.info('  %-24s stopped at epoch %d with %.2f', arch, *results[arch]['stopped'])
+                continue
+            if codes.get(arch, 0) != 0 or state is None or state['epoch'] < rung:
+                results[arch]['failed_at'] = rung
+                continue
+            results[arch][rung] = metric_at(state, args.metric, rung)
+            scored.append((results[arch][rung], arch))
+        scored.sort(reverse=True)
+        for acc, arch in scored:
+            logging.info('  %-24s %.2f', arch, acc)
+        keep = len(scored) if i == len(rungs) - 1 else max(1, len(scored) // args.eta)
+        alive = [arch for _, arch in scored[:keep]]
+        if i < len(rungs) - 1:
+            logging.info('promoting %s', ', '.join(alive) or 'none')
+
+    full = len(archs) * args.epochs
+    logging.info('trained %d epochs in this session; training every arch fully takes %d', total_epochs, full)
+    columns = ['rank', 'arch', 'epochs'] + ['acc@%d' % r for r in rungs] + ['stopped_acc', 'failed_at']
+    rows = []
+    for arch in archs:
+        row = {'arch': arch, 'failed_at': results[arch].get('failed_at', '')}
+        reached = [r for r in rungs if r in results[arch]]
+        row['epochs'] = reached[-1] if reached else 0
+        for r in reached:
+            row['acc@%d' % r] = results[arch][r]
+        score = row.get('acc@%d' % row['epochs'], -1)
+        if 'stopped' in results[arch]:
+            row['epochs'], row['stopped_acc'] = results[arch]['stopped']
+            score = row['stopped_acc']
+        rows.append((row['epochs'], score, row))
+    rows = [row for _, _, row in sorted(rows, key=lambda r: r[:2], reverse=True)]
+    for rank, row in enumerate(rows):
+        row['rank'] = rank + 1
+    path = os.path.join(args.save, 'results.csv')
+    with open(path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=columns)
+        writer.writeheader()
+        writer.writerows(rows)
+    logging.info('winner %s; results written to %s', rows[0]['arch'], path)
+
+
+if __name__ == '__main__':
+    main()
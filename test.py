@@ -10,7 +10,10 @@ import torch.nn as nn
 import genotypes
 import torch.utils
 import torchvision.datasets as dset
-import torch.backends.cudnn as cudnn
+import execution
+import fusion
+import compile_cells
+import prefetcher
 
 from model import NetworkCIFAR as Network
 
@@ -18,6 +21,8 @@ from model import NetworkCIFAR as Network
 parser = argparse.ArgumentParser("cifar")
 parser.add_argument('--data', type=str, default='../data', help='location of the data corpus')
 parser.add_argument('--batch_size', type=int, default=128, help='batch size')
+parser.add_argument('--workers', type=int, default=2, help='number of workers to load dataset')
+parser.add_argument('--cifar100', action='store_true', default=False, help='evaluate a cifar100 model')
 parser.add_argument('--report_freq', type=float, default=50, help='report frequency')
 parser.add_argument('--gpu', type=int, default=0, help='gpu device id')
 parser.add_argument('--init_channels', type=int, default=36, help='num of init channels')
@@ -27,27 +32,27 @@ parser.add_argument('--auxiliary', action='store_true', default=False, help='use
 parser.add_argument('--cutout', action='store_true', default=False, help='use cutout')
 parser.add_argument('--cutout_length', type=int, default=16, help='cutout length')
 parser.add_argument('--arch', type=str, default='PDARTS', help='which architecture to use')
+parser.add_argument('--fuse', action='store_true', default=False, help='fold BN into convs and drop training-only branches before evaluation')
+parser.add_argument('--compile', action='store_true', default=False, help='compile the genotype cells into static graphs before evaluation')
+execution.add_device_args(parser)
 args = parser.parse_args()
 
 log_format = '%(asctime)s %(message)s'
 logging.basicConfig(stream=sys.stdout, level=logging.INFO,
     format=log_format, datefmt='%m/%d %I:%M:%S %p')
 
-CIFAR_CLASSES = 10
+CIFAR_CLASSES = 100 if args.cifar100 else 10
 
 
 def main():
-  if not torch.cuda.is_available():
-    logging.info('no gpu device available')
-    sys.exit(1)
-
-  torch.cuda.set_device(args.gpu)
-  cudnn.enabled=True
+  device = execution.get_device(args.device, args.gpu)
+  threads = execution.setup_device(device, 0, args.threads)
   logging.info("args = %s", args)
+  logging.info("device = %s, threads = %d", device, threads)
 
   genotype = eval("genotypes.%s" % args.arch)
   model = Network(args.init_channels, CIFAR_CLASSES, args.layers, args.auxiliary, genotype)
-  model = model.cuda()
+  model = model.to(device)
   try:
     pdarts_utils.load(model, args.model_path)
   except:
@@ -57,37 +62,46 @@ def main():
   logging.info("param size = %fMB", pdarts_utils.count_parameters_in_MB(model))
 
   criterion = nn.CrossEntropyLoss()
-  criterion = criterion.cuda()
+  criterion = criterion.to(device)
 
-  _, test_transform = pdarts_utils._data_transforms_cifar10(args)
-  test_data = dset.CIFAR10(root=args.data, train=False, download=True, transform=test_transform)
+  if args.cifar100:
+    _, test_transform = pdarts_utils._data_transforms_cifar100(args)
+    test_data = dset.CIFAR100(root=args.data, train=False, download=True, transform=test_transform)
+  else:
+    _, test_transform = pdarts_utils._data_transforms_cifar10(args)
+    test_data = dset.CIFAR10(root=args.data, train=False, download=True, transform=test_transform)
 
   test_queue = torch.utils.data.DataLoader(
-      test_data, batch_size=args.batch_size, shuffle=False, pin_memory=False, num_workers=2)
+      test_data, batch_size=args.batch_size, shuffle=False, **execution.loader_kwargs(device, args.workers))
 
   model.drop_path_prob = 0.0
-  test_acc, test_obj = infer(test_queue, model, criterion)
+  if args.fuse:
+    fused = fusion.fuse_network(model)
+    diff = fusion.check_equivalence(model, fused, torch.randn(2, 3, 32, 32, device=device))
+    logging.info('fused model, max |logit diff| = %e', diff)
+    model = fused
+  if args.compile:
+    model = compile_cells.compile_network(model)
+  test_acc, test_obj = infer(test_queue, model, criterion, device)
   logging.info('Test_acc %f', test_acc)
 
 
-def infer(test_queue, model, criterion):
+def infer(test_queue, model, criterion, device):
   objs = pdarts_utils.AvgrageMeter()
   top1 = pdarts_utils.AvgrageMeter()
   top5 = pdarts_utils.AvgrageMeter()
   model.eval()
 
-  for step, (input, target) in enumerate(test_queue):
-    input = input.cuda()
-    target = target.cuda()
+  for step, (input, target) in enumerate(prefetcher.DataPrefetcher(test_queue, device)):
     with torch.no_grad():
         logits, _ = model(input)
         loss = criterion(logits, target)
 
     prec1, prec5 = pdarts_utils.accuracy(logits, target, topk=(1, 5))
     n = input.size(0)
-    objs.update(loss.data.item(), n)
-    top1.update(prec1.data.item(), n)
-    top5.update(prec5.data.item(), n)
+    objs.update(loss, n)
+    top1.update(prec1, n)
+    top5.update(prec5, n)
 
     if step % args.report_freq == 0:
       logging.info('test %03d %e %f %f', step, objs.avg, top1.avg, top5.avg)
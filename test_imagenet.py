@@ -12,13 +12,18 @@ import genotypes
 import torch.utils
 import torchvision.datasets as dset
 import torchvision.transforms as transforms
-import torch.backends.cudnn as cudnn
+import execution
+import fusion
+import compile_cells
+import prefetcher
+import imagenet_shards
 
 from model import NetworkImageNet as Network
 
 
 parser = argparse.ArgumentParser("imagenet")
 parser.add_argument('--data', type=str, default='../data/imagenet/', help='location of the data corpus')
+parser.add_argument('--data_format', type=str, default='folder', choices=['folder', 'shards'], help='JPEG folders under --data, or shards written by pack_imagenet.py in --data')
 parser.add_argument('--batch_size', type=int, default=128, help='batch size')
 parser.add_argument('--report_freq', type=float, default=100, help='report frequency')
 parser.add_argument('--init_channels', type=int, default=48, help='num of init channels')
@@ -26,6 +31,9 @@ parser.add_argument('--layers', type=int, default=14, help='total number of laye
 parser.add_argument('--model_path', type=str, default='../models/imagenet.pth.tar', help='path of pretrained model')
 parser.add_argument('--auxiliary', action='store_true', default=False, help='use auxiliary tower')
 parser.add_argument('--arch', type=str, default='PDARTS', help='which architecture to use')
+parser.add_argument('--fuse', action='store_true', default=False, help='fold BN into convs and drop training-only branches before evaluation')
+parser.add_argument('--compile', action='store_true', default=False, help='compile the genotype cells into static graphs before evaluation')
+execution.add_device_args(parser)
 args = parser.parse_args()
 
 log_format = '%(asctime)s %(message)s'
@@ -36,61 +44,72 @@ CLASSES = 1000
 
 
 def main():
-  if not torch.cuda.is_available():
-    logging.info('no gpu device available')
-    sys.exit(1)
-  cudnn.enabled=True
+  device = execution.get_device(args.device)
+  threads = execution.setup_device(device, 0, args.threads)
   logging.info("args = %s", args)
+  logging.info("device = %s, threads = %d", device, threads)
 
   genotype = eval("genotypes.%s" % args.arch)
   model = Network(args.init_channels, CLASSES, args.layers, args.auxiliary, genotype)
   model = nn.DataParallel(model)
-  model = model.cuda()
-  model.load_state_dict(torch.load(args.model_path)['state_dict'])
+  model = model.to(device)
+  model.load_state_dict(torch.load(args.model_path, map_location='cpu')['state_dict'])
 
   logging.info("param size = %fMB", pdarts_utils.count_parameters_in_MB(model))
 
   criterion = nn.CrossEntropyLoss()
-  criterion = criterion.cuda()
-
-  validdir = os.path.join(args.data, 'val')
-  normalize = transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])
-  valid_data = dset.ImageFolder(
-    validdir,
-    transforms.Compose([
-      transforms.Resize(256),
-      transforms.CenterCrop(224),
-      transforms.ToTensor(),
-      normalize,
-    ]))
-
-  valid_queue = torch.utils.data.DataLoader(
-    valid_data, batch_size=args.batch_size, shuffle=False, pin_memory=False, num_workers=4)
+  criterion = criterion.to(device)
+
+  if args.data_format == 'shards':
+    valid_data = imagenet_shards.ShardedImageNet(args.data, 'val', train=False)
+    valid_queue = torch.utils.data.DataLoader(
+      valid_data, batch_size=args.batch_size, **execution.loader_kwargs(device, 4))
+    batch_transform = imagenet_shards.BatchAugment(train=False)
+  else:
+    validdir = os.path.join(args.data, 'val')
+    normalize = transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])
+    valid_data = dset.ImageFolder(
+      validdir,
+      transforms.Compose([
+        transforms.Resize(256),
+        transforms.CenterCrop(224),
+        transforms.ToTensor(),
+        normalize,
+      ]))
+
+    valid_queue = torch.utils.data.DataLoader(
+      valid_data, batch_size=args.batch_size, shuffle=False, **execution.loader_kwargs(device, 4))
+    batch_transform = None
 
   model.module.drop_path_prob = 0.0
-  valid_acc_top1, valid_acc_top5, valid_obj = infer(valid_queue, model, criterion)
+  if args.fuse:
+    fused = fusion.fuse_network(model)
+    diff = fusion.check_equivalence(model, fused, torch.randn(2, 3, 224, 224, device=device))
+    logging.info('fused model, max |logit diff| = %e', diff)
+    model = fused
+  if args.compile:
+    model = compile_cells.compile_network(model)
+  valid_acc_top1, valid_acc_top5, valid_obj = infer(valid_queue, model, criterion, device, batch_transform)
   logging.info('Valid_acc_top1 %f', valid_acc_top1)
   logging.info('Valid_acc_top5 %f', valid_acc_top5)
 
 
-def infer(valid_queue, model, criterion):
+def infer(valid_queue, model, criterion, device, batch_transform=None):
   objs = pdarts_utils.AvgrageMeter()
   top1 = pdarts_utils.AvgrageMeter()
   top5 = pdarts_utils.AvgrageMeter()
   model.eval()
 
-  for step, (input, target) in enumerate(valid_queue):
-    input = input.cuda()
-    target = target.cuda()
+  for step, (input, target) in enumerate(prefetcher.DataPrefetcher(valid_queue, device, batch_transform=batch_transform)):
     with torch.no_grad():
       logits, _ = model(input)
       loss = criterion(logits, target)
 
     prec1, prec5 = pdarts_utils.accuracy(logits, target, topk=(1, 5))
     n = input.size(0)
-    objs.update(loss.data.item(), n)
-    top1.update(prec1.data.item(), n)
-    top5.update(prec5.data.item(), n)
+    objs.update(loss, n)
+    top1.update(prec1, n)
+    top5.update(prec5, n)
 
     if step % args.report_freq == 0:
       logging.info('Valid %03d %e %f %f', step, objs.avg, top1.avg, top5.avg)
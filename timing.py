@@ -0,0 +1,34 @@
+"""Latency measurement shared by evaluate.py, serve.py, loadgen.py, quantize.py and
+the benchmarks."""
+import time
+import numpy as np
+import torch
+
+
+def synchronize(device):
+    if device.type == 'cuda':
+        torch.cuda.synchronize(device)
+
+
+def time_fn(fn, device, warmup=2, iters=10):
+    """per-call latencies of fn in milliseconds"""
+    for _ in range(warmup):
+        fn()
+    synchronize(device)
+    times = []
+    for _ in range(iters):
+        start = time.perf_counter()
+        fn()
+        synchronize(device)
+        times.append((time.perf_counter() - start) * 1e3)
+    return times
+
+
+def latency_stats(times):
+    times = np.asarray(times)
+    return {
+        'mean_ms': float(times.mean()),
+        'p50_ms': float(np.percentile(times, 50)),
+        'p90_ms': float(np.percentile(times, 90)),
+        'p99_ms': float(np.percentile(times, 99)),
+    }
@@ -11,7 +11,13 @@ import torch.nn as nn
 import genotypes
 import torch.utils
 import torchvision.datasets as dset
-import torch.backends.cudnn as cudnn
+import execution
+import distributed
+import instrumentation
+import prefetcher
+import profiling
+import learning_curves
+import events
 
 from torch.autograd import Variable
 from model import NetworkCIFAR as Network
@@ -19,7 +25,7 @@ from model import NetworkCIFAR as Network
 
 parser = argparse.ArgumentParser("cifar")
 parser.add_argument('--workers', type=int, default=4, help='number of workers')
-parser.add_argument('--batch_size', type=int, default=128, help='batch size')
+parser.add_argument('--batch_size', type=int, default=128, help='batch size, split across processes when distributed')
 parser.add_argument('--learning_rate', type=float, default=0.025, help='init learning rate')
 parser.add_argument('--momentum', type=float, default=0.9, help='momentum')
 parser.add_argument('--weight_decay', type=float, default=3e-4, help='weight decay')
@@ -39,18 +45,38 @@ parser.add_argument('--grad_clip', type=float, default=5, help='gradient clippin
 parser.add_argument('--tmp_data_dir', type=str, default='/tmp/cache/', help='temp data dir')
 parser.add_argument('--note', type=str, default='try', help='note for this run')
 parser.add_argument('--cifar100', action='store_true', default=False, help='if use cifar100')
+parser.add_argument('--exp_dir', type=str, default='', help='use this experiment directory instead of a new timestamped one')
+parser.add_argument('--resume', action='store_true', default=False, help='continue from checkpoint.pth.tar in --exp_dir if there is one')
+parser.add_argument('--stop_epoch', type=int, default=0, help='stop after this many epochs, keeping the --epochs schedule (0 runs all)')
+execution.add_device_args(parser)
+execution.add_execution_args(parser)
+instrumentation.add_timing_args(parser)
+profiling.add_profiling_args(parser)
+distributed.add_distributed_args(parser)
+learning_curves.add_lc_args(parser)
+events.add_event_args(parser)
 
 args, unparsed = parser.parse_known_args()
+distributed.init_distributed(args.dist_backend)
 
-args.save = '{}eval-{}-{}'.format(args.save, args.note, time.strftime("%Y%m%d-%H%M%S"))
-pdarts_utils.create_exp_dir(args.save, scripts_to_save=glob.glob('*.py'))
+if args.exp_dir:
+    args.save = args.exp_dir
+else:
+    args.save = distributed.broadcast_object('{}eval-{}-{}'.format(args.save, args.note, time.strftime("%Y%m%d-%H%M%S")))
+if distributed.is_main_process():
+    # a resumed run keeps the scripts it started with
+    resumed = os.path.exists(os.path.join(args.save, 'scripts'))
+    pdarts_utils.create_exp_dir(args.save, scripts_to_save=None if resumed else glob.glob('*.py'))
 
 log_format = '%(asctime)s %(message)s'
 logging.basicConfig(stream=sys.stdout, level=logging.INFO,
     format=log_format, datefmt='%m/%d %I:%M:%S %p')
-fh = logging.FileHandler(os.path.join(args.save, 'log.txt'))
-fh.setFormatter(logging.Formatter(log_format))
-logging.getLogger().addHandler(fh)
+if distributed.is_main_process():
+    fh = logging.FileHandler(os.path.join(args.save, 'log.txt'))
+    fh.setFormatter(logging.Formatter(log_format))
+    logging.getLogger().addHandler(fh)
+else:
+    logging.getLogger().setLevel(logging.WARNING)
 
 if args.cifar100:
     CIFAR_CLASSES = 100
@@ -60,29 +86,36 @@ else:
     data_folder = 'cifar-10-batches-py'
 
 def main():
-    if not torch.cuda.is_available():
-        logging.info('No GPU device available')
-        sys.exit(1)
+    device = execution.get_device(args.device, distributed.get_local_rank())
     np.random.seed(args.seed)
-    cudnn.benchmark = True
-    torch.manual_seed(args.seed)
-    cudnn.enabled=True
-    torch.cuda.manual_seed(args.seed)
+    threads = execution.setup_device(device, args.seed, args.threads)
     logging.info("args = %s", args)
+    logging.info("device = %s, threads = %d", device, threads)
     logging.info("unparsed args = %s", unparsed)
-    num_gpus = torch.cuda.device_count()
+    num_gpus = torch.cuda.device_count() if device.type == 'cuda' else 0
     
     genotype = eval("genotypes.%s" % args.arch)
-    print('---------Genotype---------')
+    logging.info('---------Genotype---------')
     logging.info(genotype)
-    print('--------------------------')
+    logging.info('--------------------------')
     model = Network(args.init_channels, CIFAR_CLASSES, args.layers, args.auxiliary, genotype)
-    model = torch.nn.DataParallel(model)
-    model = model.cuda()
+    policy = execution.ExecutionPolicy.from_args(args, device)
+    logging.info(policy)
+    if distributed.is_distributed():
+        model = distributed.wrap_model(policy.prepare_model(model.to(device)), device)
+    elif device.type == 'cuda':
+        model = torch.nn.DataParallel(model)
+        model = policy.prepare_model(model.to(device))
+    else:
+        model = policy.prepare_model(model.to(device))
     logging.info("param size = %fMB", pdarts_utils.count_parameters_in_MB(model))
+    event_log = events.EventLog.from_args(args, distributed.is_main_process())
+    event_log.emit('run_start', script='train_cifar', args=args, genotype=genotype,
+                   params_mb=pdarts_utils.count_parameters_in_MB(model))
+    run_start = time.time()
 
     criterion = nn.CrossEntropyLoss()
-    criterion = criterion.cuda()
+    criterion = criterion.to(device)
     optimizer = torch.optim.SGD(
         model.parameters(),
         args.learning_rate,
@@ -101,81 +134,150 @@ def main():
         train_data = dset.CIFAR10(root=args.tmp_data_dir, train=True, download=True, transform=train_transform)
         valid_data = dset.CIFAR10(root=args.tmp_data_dir, train=False, download=True, transform=valid_transform)
 
+    batch_size = distributed.per_process_batch_size(args.batch_size)
+    train_sampler = distributed.dataset_sampler(train_data, shuffle=True, seed=args.seed)
+    valid_sampler = distributed.eval_sampler(valid_data)
     train_queue = torch.utils.data.DataLoader(
-        train_data, batch_size=args.batch_size, shuffle=True, pin_memory=True, num_workers=args.workers)
+        train_data, batch_size=batch_size, shuffle=train_sampler is None, sampler=train_sampler, **execution.loader_kwargs(device, args.workers))
 
     valid_queue = torch.utils.data.DataLoader(
-        valid_data, batch_size=args.batch_size, shuffle=False, pin_memory=True, num_workers=args.workers)
+        valid_data, batch_size=batch_size, shuffle=False, sampler=valid_sampler, **execution.loader_kwargs(device, args.workers))
     scheduler = torch.optim.lr_scheduler.CosineAnnealingLR(optimizer, float(args.epochs))
     best_acc = 0.0
-    for epoch in range(args.epochs):
-        logging.info('Epoch: %d lr %e', epoch, scheduler.get_last_lr()[0])
-        model.module.drop_path_prob = args.drop_path_prob * epoch / args.epochs
+    start_epoch = 0
+    valid_accs = []
+    checkpoint_path = os.path.join(args.save, 'checkpoint.pth.tar')
+    if args.resume and os.path.exists(checkpoint_path):
+        checkpoint = torch.load(checkpoint_path, map_location='cpu')
+        distributed.unwrap(model).load_state_dict(checkpoint['state_dict'])
+        optimizer.load_state_dict(checkpoint['optimizer'])
+        scheduler.load_state_dict(checkpoint['scheduler'])
+        if policy.scaler is not None and checkpoint.get('scaler') is not None:
+            policy.scaler.load_state_dict(checkpoint['scaler'])
+        start_epoch, best_acc = checkpoint['epoch'], checkpoint['best_acc_top1']
+        valid_accs = checkpoint.get('valid_accs', [])
+        logging.info('resumed from %s at epoch %d, best valid acc %f', checkpoint_path, start_epoch, best_acc)
+    stop_epoch = min(args.stop_epoch or args.epochs, args.epochs)
+    predictor = learning_curves.CurvePredictor.from_args(args) if distributed.is_main_process() else None
+    profiler = profiling.StepProfiler.from_args(args, model, 'eval', device)
+    for epoch in range(start_epoch, stop_epoch):
+        lr = scheduler.get_last_lr()[0]
+        logging.info('Epoch: %d lr %e', epoch, lr)
+        distributed.unwrap(model).drop_path_prob = args.drop_path_prob * epoch / args.epochs
         model.drop_path_prob = args.drop_path_prob * epoch / args.epochs
+        distributed.set_sampler_epoch(train_queue, epoch)
         start_time = time.time()
-        train_acc, train_obj = train(train_queue, model, criterion, optimizer)
+        train_acc, train_obj = train(train_queue, model, criterion, optimizer, policy, profiler)
         scheduler.step()
         logging.info('Train_acc: %f', train_acc)
 
-        valid_acc, valid_obj = infer(valid_queue, model, criterion)
-        if valid_acc > best_acc:
+        valid_acc, valid_obj = infer(valid_queue, model, criterion, policy)
+        is_best = valid_acc > best_acc
+        if is_best:
             best_acc = valid_acc
+        valid_accs.append(float(valid_acc))
         logging.info('Valid_acc: %f, Best_valid_acc: %f', valid_acc, best_acc)      # log best accuracy seen so far
         end_time = time.time()
         duration = end_time - start_time
-        print('Epoch time: %ds.' % duration )
-        pdarts_utils.save(model.module, os.path.join(args.save, 'weights.pt'))
+        event_log.emit('epoch', epoch=epoch, lr=lr, train_acc=train_acc, train_loss=train_obj, valid_acc=valid_acc,
+                       valid_loss=valid_obj, best_acc=best_acc, epoch_time=duration)
+        # decided before the checkpoint is written, which records whether the run stopped
+        stop = False
+        if predictor is not None and epoch + 1 >= args.lc_min_epochs and epoch + 1 < args.epochs:
+            stop, mean, std, p = predictor.decide(valid_accs, args.epochs, args.lc_incumbent, args.lc_threshold)
+            logging.info('Predicted final valid_acc: %f +- %f, P(beats incumbent) = %f', mean, std, p)
+            if stop:
+                event_log.emit('early_stop', epoch=epoch, predicted_acc=mean, predicted_std=std, p_beat=p)
+        if distributed.is_main_process():
+            logging.info('Epoch time: %ds.', duration)
+            pdarts_utils.save(distributed.unwrap(model), os.path.join(args.save, 'weights.pt'))
+            pdarts_utils.save_checkpoint({
+                'epoch': epoch + 1,
+                'state_dict': distributed.unwrap(model).state_dict(),
+                'best_acc_top1': float(best_acc),
+                'valid_acc': float(valid_acc),
+                'valid_accs': valid_accs,
+                'stopped': stop,
+                'optimizer': optimizer.state_dict(),
+                'scheduler': scheduler.state_dict(),
+                'scaler': policy.scaler.state_dict() if policy.scaler is not None else None,
+                }, is_best, args.save)
+        if distributed.broadcast_object(stop):
+            logging.info('Stopping at epoch %d: unlikely to beat the incumbent', epoch + 1)
+            break
+    if profiler is not None:
+        profiler.close()
+    event_log.emit('run_end', best_acc=best_acc, epochs=len(valid_accs), total_time=time.time() - run_start)
+    event_log.close()
 
-def train(train_queue, model, criterion, optimizer):
+def train(train_queue, model, criterion, optimizer, policy, profiler=None):
     objs = pdarts_utils.AvgrageMeter()
     top1 = pdarts_utils.AvgrageMeter()
     model.train()
 
-    for step, (input, target) in enumerate(train_queue):
-        input = input.cuda(non_blocking=True)
-        target = target.cuda(non_blocking=True)
+    timer = instrumentation.StepTimer('train', policy.device, args.report_freq,
+                                      trace=args.timing_trace if distributed.is_main_process() else None)
+    for step, (input, target) in enumerate(prefetcher.for_policy(train_queue, policy)):
+        timer.mark('data')
 
         optimizer.zero_grad()
-        logits, logits_aux = model(input)
-        loss = criterion(logits, target)
-        if args.auxiliary:
-            loss_aux = criterion(logits_aux, target)
-            loss += args.auxiliary_weight*loss_aux
-        loss.backward()
-        nn.utils.clip_grad_norm_(model.parameters(), args.grad_clip)
-        optimizer.step()
+        with policy.autocast():
+            logits, logits_aux = model(input)
+            loss = criterion(logits, target)
+            if args.auxiliary:
+                loss_aux = criterion(logits_aux, target)
+                loss += args.auxiliary_weight*loss_aux
+        timer.mark('forward')
+        policy.backward(loss)
+        timer.mark('backward')
+        policy.step(optimizer, model.parameters(), args.grad_clip)
+        timer.mark('optimizer')
 
         prec1, _ = pdarts_utils.accuracy(logits, target, topk=(1,5))
         n = input.size(0)
-        objs.update(loss.data.item(), n)
-        top1.update(prec1.data.item(), n)
+        objs.update(loss, n)
+        top1.update(prec1, n)
 
         if step % args.report_freq == 0:
             logging.info('Train Step: %03d Objs: %e Acc: %f', step, objs.avg, top1.avg)
+        timer.mark('logging')
+        timer.step(n)
+        if profiler is not None:
+            profiler.step()
 
+    timer.summary()
+    distributed.reduce_meter(objs, target.device)
+    distributed.reduce_meter(top1, target.device)
     return top1.avg, objs.avg
 
 
-def infer(valid_queue, model, criterion):
+def infer(valid_queue, model, criterion, policy):
     objs = pdarts_utils.AvgrageMeter()
     top1 = pdarts_utils.AvgrageMeter()
     model.eval()
 
-    for step, (input, target) in enumerate(valid_queue):
-        input = input.cuda(non_blocking=True)
-        target = target.cuda(non_blocking=True)
-        with torch.no_grad():
+    timer = instrumentation.StepTimer('valid', policy.device, args.report_freq,
+                                      trace=args.timing_trace if distributed.is_main_process() else None)
+    for step, (input, target) in enumerate(prefetcher.for_policy(valid_queue, policy)):
+        timer.mark('data')
+        with torch.no_grad(), policy.autocast():
             logits, _ = model(input)
             loss = criterion(logits, target)
+        timer.mark('forward')
 
         prec1, _ = pdarts_utils.accuracy(logits, target, topk=(1,5))
         n = input.size(0)
-        objs.update(loss.data.item(), n)
-        top1.update(prec1.data.item(), n)
+        objs.update(loss, n)
+        top1.update(prec1, n)
 
         if step % args.report_freq == 0:
             logging.info('Valid Step: %03d Objs: %e Acc: %f', step, objs.avg, top1.avg)
+        timer.mark('logging')
+        timer.step(n)
 
+    timer.summary()
+    distributed.reduce_meter(objs, target.device)
+    distributed.reduce_meter(top1, target.device)
     return top1.avg, objs.avg
 
 
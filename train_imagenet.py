@@ -1,3 +1,4 @@
+import contextlib
 import os
 import sys
 import numpy as np
@@ -13,7 +14,14 @@ import genotypes
 import torch.utils
 import torchvision.datasets as dset
 import torchvision.transforms as transforms
-import torch.backends.cudnn as cudnn
+import execution
+import distributed
+import instrumentation
+import prefetcher
+import imagenet_shards
+import progressive
+import optimizers
+import events
 
 from torch.autograd import Variable
 from model import NetworkImageNet as Network
@@ -21,7 +29,7 @@ from model import NetworkImageNet as Network
 
 parser = argparse.ArgumentParser("training imagenet")
 parser.add_argument('--workers', type=int, default=32, help='number of workers to load dataset')
-parser.add_argument('--batch_size', type=int, default=256, help='batch size')
+parser.add_argument('--batch_size', type=int, default=256, help='batch size, split across processes when distributed')
 parser.add_argument('--learning_rate', type=float, default=0.1, help='init learning rate')
 parser.add_argument('--momentum', type=float, default=0.9, help='momentum')
 parser.add_argument('--weight_decay', type=float, default=3e-5, help='weight decay')
@@ -38,21 +46,34 @@ parser.add_argument('--arch', type=str, default='PDARTS', help='which architectu
 parser.add_argument('--grad_clip', type=float, default=5., help='gradient clipping')
 parser.add_argument('--label_smooth', type=float, default=0.1, help='label smoothing')
 parser.add_argument('--lr_scheduler', type=str, default='linear', help='lr scheduler, linear or cosine')
+parser.add_argument('--data_format', type=str, default='folder', choices=['folder', 'shards'], help='JPEG folders, or shards written by pack_imagenet.py under <tmp_data_dir>/imagenet_shards')
 parser.add_argument('--tmp_data_dir', type=str, default='/tmp/cache/', help='temp data dir')
 parser.add_argument('--note', type=str, default='try', help='note for this run')
+execution.add_device_args(parser)
+execution.add_execution_args(parser)
+instrumentation.add_timing_args(parser)
+progressive.add_resize_args(parser)
+optimizers.add_optimizer_args(parser)
+distributed.add_distributed_args(parser)
+events.add_event_args(parser)
 
 
 args, unparsed = parser.parse_known_args()
+distributed.init_distributed(args.dist_backend)
 
-args.save = '{}eval-{}-{}'.format(args.save, args.note, time.strftime("%Y%m%d-%H%M%S"))
-pdarts_utils.create_exp_dir(args.save, scripts_to_save=glob.glob('*.py'))
+args.save = distributed.broadcast_object('{}eval-{}-{}'.format(args.save, args.note, time.strftime("%Y%m%d-%H%M%S")))
+if distributed.is_main_process():
+    pdarts_utils.create_exp_dir(args.save, scripts_to_save=glob.glob('*.py'))
 
 log_format = '%(asctime)s %(message)s'
 logging.basicConfig(stream=sys.stdout, level=logging.INFO,
     format=log_format, datefmt='%m/%d %I:%M:%S %p')
-fh = logging.FileHandler(os.path.join(args.save, 'log.txt'))
-fh.setFormatter(logging.Formatter(log_format))
-logging.getLogger().addHandler(fh)
+if distributed.is_main_process():
+    fh = logging.FileHandler(os.path.join(args.save, 'log.txt'))
+    fh.setFormatter(logging.Formatter(log_format))
+    logging.getLogger().addHandler(fh)
+else:
+    logging.getLogger().setLevel(logging.WARNING)
 
 CLASSES = 1000
 
@@ -72,99 +93,133 @@ class CrossEntropyLabelSmooth(nn.Module):
         return loss
 
 def main():
-    if not torch.cuda.is_available():
-        logging.info('No GPU device available')
-        sys.exit(1)
+    device = execution.get_device(args.device, distributed.get_local_rank())
     np.random.seed(args.seed)
-    cudnn.benchmark = True
-    torch.manual_seed(args.seed)
-    cudnn.enabled=True
-    torch.cuda.manual_seed(args.seed)
+    threads = execution.setup_device(device, args.seed, args.threads)
     logging.info("args = %s", args)
+    logging.info("device = %s, threads = %d", device, threads)
     logging.info("unparsed_args = %s", unparsed)
-    num_gpus = torch.cuda.device_count()   
+    num_gpus = torch.cuda.device_count() if device.type == 'cuda' else 0
     genotype = eval("genotypes.%s" % args.arch)
     print('---------Genotype---------')
     logging.info(genotype)
     print('--------------------------') 
     model = Network(args.init_channels, CLASSES, args.layers, args.auxiliary, genotype)
-    if num_gpus > 1:
+    policy = execution.ExecutionPolicy.from_args(args, device)
+    logging.info(policy)
+    if distributed.is_distributed():
+        model = distributed.wrap_model(policy.prepare_model(model.to(device)), device)
+    elif num_gpus > 1:
         model = nn.DataParallel(model)
-        model = model.cuda()
+        model = policy.prepare_model(model.to(device))
     else:
-        model = model.cuda()
+        model = policy.prepare_model(model.to(device))
     logging.info("param size = %fMB", pdarts_utils.count_parameters_in_MB(model))
+    event_log = events.EventLog.from_args(args, distributed.is_main_process())
+    event_log.emit('run_start', script='train_imagenet', args=args, genotype=genotype,
+                   params_mb=pdarts_utils.count_parameters_in_MB(model))
+    run_start = time.time()
 
     criterion = nn.CrossEntropyLoss()
-    criterion = criterion.cuda()
+    criterion = criterion.to(device)
     criterion_smooth = CrossEntropyLabelSmooth(CLASSES, args.label_smooth)
-    criterion_smooth = criterion_smooth.cuda()
+    criterion_smooth = criterion_smooth.to(device)
 
-    optimizer = torch.optim.SGD(
-        model.parameters(),
-        args.learning_rate,
-        momentum=args.momentum,
-        weight_decay=args.weight_decay
-        )
-    data_dir = os.path.join(args.tmp_data_dir, 'imagenet')
-    traindir = os.path.join(data_dir, 'train')
-    validdir = os.path.join(data_dir, 'val')
-    normalize = transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])
-    train_data = dset.ImageFolder(
-        traindir,
-        transforms.Compose([
-            transforms.RandomResizedCrop(224),
-            transforms.RandomHorizontalFlip(),
-            transforms.ColorJitter(
-                brightness=0.4,
-                contrast=0.4,
-                saturation=0.4,
-                hue=0.2),
-            transforms.ToTensor(),
-            normalize,
-        ]))
-    valid_data = dset.ImageFolder(
-        validdir,
-        transforms.Compose([
-            transforms.Resize(256),
-            transforms.CenterCrop(224),
-            transforms.ToTensor(),
-            normalize,
-        ]))
+    optimizer = optimizers.build_optimizer(args, model)
+    resize = progressive.ResizeSchedule.from_args(args, multiple=8 * distributed.get_world_size() * args.accum_steps)
+    if resize.enabled:
+        logging.info(resize)
+    warmup_epochs = args.warmup_epochs
+    if warmup_epochs < 0:
+        warmup_epochs = 5 if resize(0)[1] > 256 else 0
+    schedule = optimizers.LRSchedule(args.learning_rate, args.epochs, args.lr_scheduler, warmup_epochs)
+    logging.info(schedule)
+    batch_size = distributed.per_process_batch_size(args.batch_size)
+    if args.data_format == 'shards':
+        # shards are split across processes by the dataset itself, and crops come
+        # out as uint8; flip, jitter and normalization run batched on the device
+        data_dir = os.path.join(args.tmp_data_dir, 'imagenet_shards')
+        train_data = imagenet_shards.ShardedImageNet(data_dir, 'train', train=True, seed=args.seed)
+        valid_data = imagenet_shards.ShardedImageNet(data_dir, 'val', train=False)
+        train_sampler = None
+        valid_queue = torch.utils.data.DataLoader(
+            valid_data, batch_size=batch_size, **execution.loader_kwargs(device, args.workers))
+        train_transform = imagenet_shards.BatchAugment(train=True)
+        valid_transform = imagenet_shards.BatchAugment(train=False)
+    else:
+        data_dir = os.path.join(args.tmp_data_dir, 'imagenet')
+        traindir = os.path.join(data_dir, 'train')
+        validdir = os.path.join(data_dir, 'val')
+        normalize = transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])
+        train_crop = transforms.RandomResizedCrop(224)
+        train_data = dset.ImageFolder(
+            traindir,
+            transforms.Compose([
+                train_crop,
+                transforms.RandomHorizontalFlip(),
+                transforms.ColorJitter(
+                    brightness=0.4,
+                    contrast=0.4,
+                    saturation=0.4,
+                    hue=0.2),
+                transforms.ToTensor(),
+                normalize,
+            ]))
+        valid_data = dset.ImageFolder(
+            validdir,
+            transforms.Compose([
+                transforms.Resize(256),
+                transforms.CenterCrop(224),
+                transforms.ToTensor(),
+                normalize,
+            ]))
 
-    train_queue = torch.utils.data.DataLoader(
-        train_data, batch_size=args.batch_size, shuffle=True, pin_memory=True, num_workers=args.workers)
+        train_sampler = distributed.dataset_sampler(train_data, shuffle=True, seed=args.seed)
+        valid_sampler = distributed.eval_sampler(valid_data)
+        valid_queue = torch.utils.data.DataLoader(
+            valid_data, batch_size=batch_size, shuffle=False, sampler=valid_sampler, **execution.loader_kwargs(device, args.workers))
+        train_transform = valid_transform = None
 
-    valid_queue = torch.utils.data.DataLoader(
-        valid_data, batch_size=args.batch_size, shuffle=False, pin_memory=True, num_workers=args.workers)
+    def make_train_queue(res, batch):
+        # a fresh loader per phase of the resize schedule, so persistent workers pick up the new crop size
+        if args.data_format == 'shards':
+            train_data.size = res
+        else:
+            train_crop.size = (res, res)
+        batch = distributed.per_process_batch_size(batch)
+        if batch % args.accum_steps != 0:
+            raise ValueError('batch size {} is not divisible by {} accumulation steps'.format(batch, args.accum_steps))
+        if args.data_format == 'shards':
+            # whole batches per loader worker, so len() of the loader is the number of steps
+            train_data.set_batching(batch // args.accum_steps, args.workers)
+        return torch.utils.data.DataLoader(
+            train_data, batch_size=batch // args.accum_steps,
+            shuffle=args.data_format == 'folder' and train_sampler is None, sampler=train_sampler,
+            **execution.loader_kwargs(device, args.workers))
 
-#    scheduler = torch.optim.lr_scheduler.StepLR(optimizer, args.decay_period, gamma=args.gamma)
-    scheduler = torch.optim.lr_scheduler.CosineAnnealingLR(optimizer, float(args.epochs))
     best_acc_top1 = 0
     best_acc_top5 = 0
+    train_phase = None
     for epoch in range(args.epochs):
-        if args.lr_scheduler == 'cosine':
-            scheduler.step()
-            current_lr = scheduler.get_lr()[0]
-        elif args.lr_scheduler == 'linear':
-            current_lr = adjust_lr(optimizer, epoch)
-        else:
-            print('Wrong lr type, exit')
-            sys.exit(1)
-        logging.info('Epoch: %d lr %e', epoch, current_lr)
-        if epoch < 5 and args.batch_size > 256:
-            for param_group in optimizer.param_groups:
-                param_group['lr'] = current_lr * (epoch + 1) / 5.0
-            logging.info('Warming-up Epoch: %d, LR: %e', epoch, current_lr * (epoch + 1) / 5.0)
-        if num_gpus > 1:
-            model.module.drop_path_prob = args.drop_path_prob * epoch / args.epochs
-        else:
-            model.drop_path_prob = args.drop_path_prob * epoch / args.epochs
+        res, phase_batch = resize(epoch)
+        if (res, phase_batch) != train_phase:
+            train_phase = (res, phase_batch)
+            train_queue = make_train_queue(res, phase_batch)
+            if resize.enabled:
+                logging.info('Epoch: %d resolution %d batch size %d', epoch, res, phase_batch)
+        # linear scaling with the batch size of the current phase
+        schedule.scale = phase_batch / float(args.batch_size)
+        lr = schedule(epoch)
+        logging.info('Epoch: %d lr %e', epoch, lr)
+        distributed.unwrap(model).drop_path_prob = args.drop_path_prob * epoch / args.epochs
+        distributed.set_sampler_epoch(train_queue, epoch)
+        if args.data_format == 'shards':
+            train_data.set_epoch(epoch)
         epoch_start = time.time()
-        train_acc, train_obj = train(train_queue, model, criterion_smooth, optimizer)
+        train_acc, train_obj = train(train_queue, model, criterion_smooth, optimizer, policy, schedule, epoch, train_transform)
         logging.info('Train_acc: %f', train_acc)
 
-        valid_acc_top1, valid_acc_top5, valid_obj = infer(valid_queue, model, criterion)
+        valid_acc_top1, valid_acc_top5, valid_obj = infer(valid_queue, model, criterion, policy, valid_transform)
         logging.info('Valid_acc_top1: %f', valid_acc_top1)
         logging.info('Valid_acc_top5: %f', valid_acc_top5)
         epoch_duration = time.time() - epoch_start
@@ -175,50 +230,59 @@ def main():
         if valid_acc_top1 > best_acc_top1:
             best_acc_top1 = valid_acc_top1
             is_best = True
-        pdarts_utils.save_checkpoint({
-            'epoch': epoch + 1,
-            'state_dict': model.state_dict(),
-            'best_acc_top1': best_acc_top1,
-            'optimizer' : optimizer.state_dict(),
-            }, is_best, args.save)        
+        event_log.emit('epoch', epoch=epoch, lr=lr, resolution=res, batch_size=phase_batch, train_acc=train_acc,
+                       train_loss=train_obj, valid_acc=valid_acc_top1, valid_acc_top5=valid_acc_top5,
+                       valid_loss=valid_obj, best_acc=best_acc_top1, epoch_time=epoch_duration)
+        if distributed.is_main_process():
+            pdarts_utils.save_checkpoint({
+                'epoch': epoch + 1,
+                'state_dict': model.state_dict(),
+                'best_acc_top1': best_acc_top1,
+                'optimizer' : optimizer.state_dict(),
+                }, is_best, args.save)
+    event_log.emit('run_end', best_acc=best_acc_top1, best_acc_top5=best_acc_top5, total_time=time.time() - run_start)
+    event_log.close()
         
-def adjust_lr(optimizer, epoch):
-    # Smaller slope for the last 5 epochs because lr * 1/250 is relatively large
-    if args.epochs -  epoch > 5:
-        lr = args.learning_rate * (args.epochs - 5 - epoch) / (args.epochs - 5)
-    else:
-        lr = args.learning_rate * (args.epochs - epoch) / ((args.epochs - 5) * 5)
-    for param_group in optimizer.param_groups:
-        param_group['lr'] = lr
-    return lr        
-
-def train(train_queue, model, criterion, optimizer):
+def train(train_queue, model, criterion, optimizer, policy, schedule, epoch, batch_transform=None):
     objs = pdarts_utils.AvgrageMeter()
     top1 = pdarts_utils.AvgrageMeter()
     top5 = pdarts_utils.AvgrageMeter()
     batch_time = pdarts_utils.AvgrageMeter()
     model.train()
 
-    for step, (input, target) in enumerate(train_queue):
-        target = target.cuda(non_blocking=True)
-        input = input.cuda(non_blocking=True)
+    timer = instrumentation.StepTimer('train', policy.device, args.report_freq,
+                                      trace=args.timing_trace if distributed.is_main_process() else None)
+    steps = len(train_queue)
+    for step, (input, target) in enumerate(prefetcher.for_policy(train_queue, policy, batch_transform)):
+        timer.mark('data')
         b_start = time.time()
-        optimizer.zero_grad()
-        logits, logits_aux = model(input)
-        loss = criterion(logits, target)
-        if args.auxiliary:
-            loss_aux = criterion(logits_aux, target)
-            loss += args.auxiliary_weight*loss_aux
+        # every optimizer step accumulates the gradients of accum_steps micro-batches,
+        # and DDP only all-reduces them on the last one
+        if step % args.accum_steps == 0:
+            optimizer.zero_grad()
+        last = (step + 1) % args.accum_steps == 0 or step + 1 == steps
+        no_sync = model.no_sync() if not last and hasattr(model, 'no_sync') else contextlib.nullcontext()
+        with no_sync:
+            with policy.autocast():
+                logits, logits_aux = model(input)
+                loss = criterion(logits, target)
+                if args.auxiliary:
+                    loss_aux = criterion(logits_aux, target)
+                    loss += args.auxiliary_weight*loss_aux
+            timer.mark('forward')
 
-        loss.backward()
-        nn.utils.clip_grad_norm_(model.parameters(), args.grad_clip)
-        optimizer.step()
+            policy.backward(loss / args.accum_steps if args.accum_steps > 1 else loss)
+        timer.mark('backward')
+        if last:
+            schedule.step(optimizer, epoch + (step + 1) / float(steps))
+            policy.step(optimizer, model.parameters(), args.grad_clip)
+        timer.mark('optimizer')
         batch_time.update(time.time() - b_start)
         prec1, prec5 = pdarts_utils.accuracy(logits, target, topk=(1, 5))
         n = input.size(0)
-        objs.update(loss.data.item(), n)
-        top1.update(prec1.data.item(), n)
-        top5.update(prec5.data.item(), n)
+        objs.update(loss, n)
+        top1.update(prec1, n)
+        top5.update(prec5, n)
 
         if step % args.report_freq == 0:
             end_time = time.time()
@@ -230,28 +294,35 @@ def train(train_queue, model, criterion, optimizer):
                 start_time = time.time()
             logging.info('TRAIN Step: %03d Objs: %e R1: %f R5: %f Duration: %ds BTime: %.3fs', 
                                     step, objs.avg, top1.avg, top5.avg, duration, batch_time.avg)
+        timer.mark('logging')
+        timer.step(n)
 
+    timer.summary()
+    distributed.reduce_meter(objs, target.device)
+    distributed.reduce_meter(top1, target.device)
     return top1.avg, objs.avg
 
 
-def infer(valid_queue, model, criterion):
+def infer(valid_queue, model, criterion, policy, batch_transform=None):
     objs = pdarts_utils.AvgrageMeter()
     top1 = pdarts_utils.AvgrageMeter()
     top5 = pdarts_utils.AvgrageMeter()
     model.eval()
 
-    for step, (input, target) in enumerate(valid_queue):
-        input = input.cuda()
-        target = target.cuda(non_blocking=True)
-        with torch.no_grad():
+    timer = instrumentation.StepTimer('valid', policy.device, args.report_freq,
+                                      trace=args.timing_trace if distributed.is_main_process() else None)
+    for step, (input, target) in enumerate(prefetcher.for_policy(valid_queue, policy, batch_transform)):
+        timer.mark('data')
+        with torch.no_grad(), policy.autocast():
             logits, _ = model(input)
             loss = criterion(logits, target)
+        timer.mark('forward')
 
         prec1, prec5 = pdarts_utils.accuracy(logits, target, topk=(1, 5))
         n = input.size(0)
-        objs.update(loss.data.item(), n)
-        top1.update(prec1.data.item(), n)
-        top5.update(prec5.data.item(), n)
+        objs.update(loss, n)
+        top1.update(prec1, n)
+        top5.update(prec5, n)
 
         if step % args.report_freq == 0:
             end_time = time.time()
@@ -262,7 +333,13 @@ def infer(valid_queue, model, criterion):
                 duration = end_time - start_time
                 start_time = time.time()
             logging.info('VALID Step: %03d Objs: %e R1: %f R5: %f Duration: %ds', step, objs.avg, top1.avg, top5.avg, duration)
+        timer.mark('logging')
+        timer.step(n)
 
+    timer.summary()
+    distributed.reduce_meter(objs, target.device)
+    distributed.reduce_meter(top1, target.device)
+    distributed.reduce_meter(top5, target.device)
     return top1.avg, top5.avg, objs.avg
 
 
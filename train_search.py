@@ -12,11 +12,18 @@ import torch.utils
 import torch.nn.functional as F
 import torchvision.datasets as dset
 import torchvision.transforms as transforms
-import torch.backends.cudnn as cudnn
 import copy
+import execution
+import distributed
+import instrumentation
+import prefetcher
+import profiling
+import events
+import alpha_recorder
 from model_search import Network
 from genotypes import PRIMITIVES
 from genotypes import Genotype
+from derivation import parse_network, get_min_k, get_min_k_no_zero, logging_switches, check_sk_number, delete_min_sk_prob, keep_1_on, keep_2_branches
 
 sys.path.append("../poisons/")
 from poisons import LabelFlippingPoisoningDataset, CleanLabelPoisoningDataset
@@ -24,7 +31,7 @@ from poisons_utils import imshow
 
 parser = argparse.ArgumentParser("cifar")
 parser.add_argument('--workers', type=int, default=2, help='number of workers to load dataset')
-parser.add_argument('--batch_size', type=int, default=96, help='batch size')
+parser.add_argument('--batch_size', type=int, default=96, help='batch size, split across processes when distributed')
 parser.add_argument('--learning_rate', type=float, default=0.025, help='init learning rate')
 parser.add_argument('--learning_rate_min', type=float, default=0.0, help='min learning rate')
 parser.add_argument('--momentum', type=float, default=0.9, help='momentum')
@@ -51,6 +58,13 @@ parser.add_argument('--dset', type=str, default='cifar10', choices=['cifar10', '
 parser.add_argument('--save_full_model', action='store_true', default=False, help='save the entire supernet (used for crafting poisons)')
 parser.add_argument('--anti_search', action='store_true', default=False, help='negate searching objective for arch. params')
 parser.add_argument('--track_grads', action='store_true', default=False, help='track gradients of arch. and network params')
+execution.add_device_args(parser)
+execution.add_execution_args(parser)
+instrumentation.add_timing_args(parser)
+profiling.add_profiling_args(parser)
+distributed.add_distributed_args(parser)
+events.add_event_args(parser)
+alpha_recorder.add_alpha_args(parser)
 
 ### new attack args
 parser.add_argument('--poisons_type', type=str, choices=['label_flip', 'clean_label', 'none', 'diffusion_denoise'], default='none')
@@ -74,15 +88,11 @@ else:
     full_param_grad_history = None
 
 def main():
-    if not torch.cuda.is_available():
-        print('No GPU device available')
-        sys.exit(1)
+    distributed.init_distributed(args.dist_backend)
+    device = execution.get_device(args.device, distributed.get_local_rank())
     
     np.random.seed(args.seed)
-    cudnn.benchmark = True
-    torch.manual_seed(args.seed)
-    cudnn.enabled=True
-    torch.cuda.manual_seed(args.seed)
+    threads = execution.setup_device(device, args.seed, args.threads)
     
     if args.dset == 'cifar100':
         train_transform, _ = pdarts_utils._data_transforms_cifar100(args)
@@ -153,33 +163,45 @@ def main():
     else:
         args.save = '{}search-{}-{}'.format(args.save, args.note, 
                                             time.strftime("%Y%m%d-%H%M%S"))
-    pdarts_utils.create_exp_dir(args.save)
+    args.save = distributed.broadcast_object(args.save)
+    if distributed.is_main_process():
+        pdarts_utils.create_exp_dir(args.save)
 
     log_format = '%(asctime)s %(message)s'
     logging.basicConfig(stream=sys.stdout, level=logging.INFO,
         format=log_format, datefmt='%m/%d %I:%M:%S %p')
-    fh = logging.FileHandler(os.path.join(args.save, 'log.txt'))
-    fh.setFormatter(logging.Formatter(log_format))
-    logging.getLogger().addHandler(fh)
+    if distributed.is_main_process():
+        fh = logging.FileHandler(os.path.join(args.save, 'log.txt'))
+        fh.setFormatter(logging.Formatter(log_format))
+        logging.getLogger().addHandler(fh)
+    else:
+        logging.getLogger().setLevel(logging.WARNING)
     logging.info("args = %s", args)
+    logging.info("device = %s, threads = %d", device, threads)
+    event_log = events.EventLog.from_args(args, distributed.is_main_process())
+    event_log.emit('run_start', script='train_search', args=args, n_poisons=n_poisons)
+    run_start = time.time()
+    policy = execution.ExecutionPolicy.from_args(args, device)
+    logging.info(policy)
 
     num_train = len(train_data)
     indices = list(range(num_train))
     split = int(np.floor(args.train_portion * num_train))
 
+    batch_size = distributed.per_process_batch_size(args.batch_size)
     train_queue = torch.utils.data.DataLoader(
-        train_data, batch_size=args.batch_size,
-        sampler=torch.utils.data.sampler.SubsetRandomSampler(indices[:split]),
-        pin_memory=True, num_workers=args.workers)
+        train_data, batch_size=batch_size,
+        sampler=distributed.subset_sampler(indices[:split], seed=args.seed),
+        **execution.loader_kwargs(device, args.workers))
 
     valid_queue = torch.utils.data.DataLoader(
-        train_data, batch_size=args.batch_size,
-        sampler=torch.utils.data.sampler.SubsetRandomSampler(indices[split:num_train]),
-        pin_memory=True, num_workers=args.workers)
+        train_data, batch_size=batch_size,
+        sampler=distributed.subset_sampler(indices[split:num_train], seed=args.seed + 1),
+        **execution.loader_kwargs(device, args.workers))
 
     # build Network
     criterion = nn.CrossEntropyLoss()
-    criterion = criterion.cuda()
+    criterion = criterion.to(device)
     switches = []
     for i in range(14):
         switches.append([True for j in range(len(PRIMITIVES))])
@@ -203,9 +225,19 @@ def main():
     eps_no_archs = [10, 10, 10]
     for sp in range(len(num_to_keep)):
         model = Network(args.init_channels + int(add_width[sp]), TASK_CLASSES, args.layers + int(add_layers[sp]), criterion, switches_normal=switches_normal, switches_reduce=switches_reduce, p=float(drop_rate[sp]))
-        model = nn.DataParallel(model)
-        model = model.cuda()
+        if distributed.is_distributed():
+            # gradients of the network weights and of alphas_normal/alphas_reduce are
+            # all-reduced by every backward, so the arch steps agree across processes
+            model = distributed.wrap_model(policy.prepare_model(model.to(device)), device)
+        elif device.type == 'cuda':
+            model = nn.DataParallel(model)
+            model = policy.prepare_model(model.to(device))
+        else:
+            model = policy.prepare_model(model.to(device))
         logging.info("param size = %fMB", pdarts_utils.count_parameters_in_MB(model))
+        event_log.emit('stage', stage=sp, channels=args.init_channels + int(add_width[sp]),
+                       layers=args.layers + int(add_layers[sp]), drop_rate=float(drop_rate[sp]),
+                       params_mb=pdarts_utils.count_parameters_in_MB(model))
         network_params = []
         for k, v in model.named_parameters():
             if not (k.endswith('alphas_normal') or k.endswith('alphas_reduce')):
@@ -215,49 +247,67 @@ def main():
                 args.learning_rate,
                 momentum=args.momentum,
                 weight_decay=args.weight_decay)
-        optimizer_a = torch.optim.Adam(model.module.arch_parameters(),
+        optimizer_a = torch.optim.Adam(distributed.unwrap(model).arch_parameters(),
                     lr=args.arch_learning_rate, betas=(0.5, 0.999), weight_decay=args.arch_weight_decay)
         scheduler = torch.optim.lr_scheduler.CosineAnnealingLR(
                 optimizer, float(args.epochs), eta_min=args.learning_rate_min)
         sm_dim = -1
         epochs = args.epochs
         eps_no_arch = eps_no_archs[sp]
+        profiler = profiling.StepProfiler.from_args(args, model, 'stage%d' % sp, device)
+        recorder = alpha_recorder.AlphaRecorder.from_args(args, sp, distributed.unwrap(model), switches_normal, switches_reduce,
+                                                          distributed.is_main_process())
         scale_factor = 0.2
         for epoch in range(epochs):
             lr = scheduler.get_last_lr()[0]
             logging.info('Epoch: %d lr: %e', epoch, lr)
             epoch_start = time.time()
+            distributed.set_sampler_epoch(train_queue, sp * epochs + epoch)
+            distributed.set_sampler_epoch(valid_queue, sp * epochs + epoch)
             # training
             if epoch < eps_no_arch:
-                model.module.p = float(drop_rate[sp]) * (epochs - epoch - 1) / epochs
-                model.module.update_p()
-                train_acc, train_obj = train(train_queue, valid_queue, model, network_params, criterion, optimizer, optimizer_a, lr, train_arch=False, anti_search=args.anti_search)
+                distributed.unwrap(model).p = float(drop_rate[sp]) * (epochs - epoch - 1) / epochs
+                distributed.unwrap(model).update_p()
+                train_acc, train_obj = train(train_queue, valid_queue, model, network_params, criterion, optimizer, optimizer_a, lr, policy, train_arch=False, anti_search=args.anti_search, profiler=profiler)
             else:
-                model.module.p = float(drop_rate[sp]) * np.exp(-(epoch - eps_no_arch) * scale_factor) 
-                model.module.update_p()                
-                train_acc, train_obj = train(train_queue, valid_queue, model, network_params, criterion, optimizer, optimizer_a, lr, train_arch=True, anti_search=args.anti_search)
+                distributed.unwrap(model).p = float(drop_rate[sp]) * np.exp(-(epoch - eps_no_arch) * scale_factor) 
+                distributed.unwrap(model).update_p()                
+                train_acc, train_obj = train(train_queue, valid_queue, model, network_params, criterion, optimizer, optimizer_a, lr, policy, train_arch=True, anti_search=args.anti_search, profiler=profiler, recorder=recorder)
             scheduler.step()
+            if recorder is not None:
+                recorder.flush(epoch)
             
             logging.info('Train_acc %f', train_acc)
             epoch_duration = time.time() - epoch_start
             logging.info('Epoch time: %ds', epoch_duration)
             # validation
+            record = {}
             if epochs - epoch < 5:
-                valid_acc, valid_obj = infer(valid_queue, model, criterion)
+                valid_acc, valid_obj = infer(valid_queue, model, criterion, policy)
                 logging.info('Valid_acc %f', valid_acc)
-        pdarts_utils.save(model, os.path.join(args.save, 'weights.pt'))
-
-        if args.save_full_model:
-            model_to_save = model.module if isinstance(model, torch.nn.DataParallel) else model
+                record = {'valid_acc': valid_acc, 'valid_loss': valid_obj}
+            event_log.emit('epoch', stage=sp, epoch=epoch, lr=lr, train_arch=epoch >= eps_no_arch, train_acc=train_acc,
+                           train_loss=train_obj, epoch_time=epoch_duration, **record)
+            if epoch >= eps_no_arch:
+                arch_param = distributed.unwrap(model).arch_parameters()
+                event_log.emit('alphas', stage=sp, epoch=epoch, normal=F.softmax(arch_param[0], dim=sm_dim),
+                               reduce=F.softmax(arch_param[1], dim=sm_dim))
+        if profiler is not None:
+            profiler.close()
+        if distributed.is_main_process():
+            pdarts_utils.save(model, os.path.join(args.save, 'weights.pt'))
+
+        if args.save_full_model and distributed.is_main_process():
+            model_to_save = distributed.unwrap(model)
             torch.save(model_to_save, os.path.join(args.save, f'model-{sp}.pt'))
 
-        print('------Dropping %d paths------' % num_to_drop[sp])
+        logging.info('------Dropping %d paths------', num_to_drop[sp])
         # Save switches info for s-c refinement. 
         if sp == len(num_to_keep) - 1:
             switches_normal_2 = copy.deepcopy(switches_normal)
             switches_reduce_2 = copy.deepcopy(switches_reduce)
         # drop operations with low architecture weights
-        arch_param = model.module.arch_parameters()
+        arch_param = distributed.unwrap(model).arch_parameters()
         normal_prob = F.softmax(arch_param[0], dim=sm_dim).data.cpu().numpy()        
         for i in range(14):
             idxs = []
@@ -287,9 +337,10 @@ def main():
         logging_switches(switches_normal)
         logging.info('switches_reduce = %s', switches_reduce)
         logging_switches(switches_reduce)
+        event_log.emit('switches', stage=sp, normal=switches_normal, reduce=switches_reduce)
         
         if sp == len(num_to_keep) - 1:
-            arch_param = model.module.arch_parameters()
+            arch_param = distributed.unwrap(model).arch_parameters()
             normal_prob = F.softmax(arch_param[0], dim=sm_dim).data.cpu().numpy()
             reduce_prob = F.softmax(arch_param[1], dim=sm_dim).data.cpu().numpy()
             normal_final = [0 for idx in range(14)]
@@ -330,6 +381,7 @@ def main():
             # translate switches into genotype
             genotype = parse_network(switches_normal, switches_reduce)
             logging.info(genotype)
+            event_log.emit('genotype', genotype=genotype, text=str(genotype))
             ## restrict skipconnect (normal cell only)
             logging.info('Restricting skipconnect...')
             # generating genotypes with different numbers of skip-connect operations
@@ -346,8 +398,11 @@ def main():
                 logging.info('Number of skip-connect: %d', max_sk)
                 genotype = parse_network(switches_normal, switches_reduce)
                 logging.info(genotype)              
+                event_log.emit('genotype', genotype=genotype, text=str(genotype), max_skip=max_sk)
+    event_log.emit('run_end', total_time=time.time() - run_start)
+    event_log.close()
 
-def train(train_queue, valid_queue, model, network_params, criterion, optimizer, optimizer_a, lr, train_arch=True, anti_search=False):
+def train(train_queue, valid_queue, model, network_params, criterion, optimizer, optimizer_a, lr, policy, train_arch=True, anti_search=False, profiler=None, recorder=None):
     objs = pdarts_utils.AvgrageMeter()
     top1 = pdarts_utils.AvgrageMeter()
     top5 = pdarts_utils.AvgrageMeter()
@@ -356,50 +411,58 @@ def train(train_queue, valid_queue, model, network_params, criterion, optimizer,
         arch_grad_history = []
         param_grad_history = []
 
-        for param in model.module.arch_parameters():
+        for param in distributed.unwrap(model).arch_parameters():
             arch_grad_history.append(torch.zeros_like(param.data, device='cpu', requires_grad=False))
         
         for param in network_params:
             param_grad_history.append(torch.zeros_like(param.data, device='cpu', requires_grad=False))
 
-    for step, (input, target) in enumerate(train_queue):
+    timer = instrumentation.StepTimer('train', policy.device, args.report_freq,
+                                      trace=args.timing_trace if distributed.is_main_process() else None)
+    # batches arrive on the device already, the copies overlap the previous step
+    search_queue = prefetcher.for_policy(valid_queue, policy)
+    for step, (input, target) in enumerate(prefetcher.for_policy(train_queue, policy)):
+        timer.mark('data')
         model.train()
         n = input.size(0)
-        input = input.cuda()
-        target = target.cuda(non_blocking=True)
         if train_arch:
             # In the original implementation of DARTS, it is input_search, target_search = next(iter(valid_queue), which slows down
             # the training when using PyTorch 0.4 and above. 
             try:
                 input_search, target_search = next(valid_queue_iter)
             except:
-                valid_queue_iter = iter(valid_queue)
+                valid_queue_iter = iter(search_queue)
                 input_search, target_search = next(valid_queue_iter)
-            input_search = input_search.cuda()
-            target_search = target_search.cuda(non_blocking=True)
+            timer.mark('data')
             optimizer_a.zero_grad()
-            logits = model(input_search)
-            loss_a = criterion(logits, target_search)
+            with policy.autocast():
+                logits = model(input_search)
+                loss_a = criterion(logits, target_search)
 
             if anti_search:
                 loss_a *= -1
 
-            loss_a.backward()
-            nn.utils.clip_grad_norm_(model.module.arch_parameters(), args.grad_clip)
-            optimizer_a.step()
+            policy.backward(loss_a)
+            policy.step(optimizer_a, distributed.unwrap(model).arch_parameters(), args.grad_clip)
+            if recorder is not None:
+                recorder.step()
 
             # add arch grads to history
             if args.track_grads:
-                for i, param in enumerate(model.module.arch_parameters()):
+                for i, param in enumerate(distributed.unwrap(model).arch_parameters()):
                     arch_grad_history[i] += param.grad.data.detach().clone().cpu()
+            timer.mark('arch')
 
         optimizer.zero_grad()
-        logits = model(input)
-        loss = criterion(logits, target)
+        with policy.autocast():
+            logits = model(input)
+            loss = criterion(logits, target)
+        timer.mark('forward')
 
-        loss.backward()
-        nn.utils.clip_grad_norm_(network_params, args.grad_clip)
-        optimizer.step()
+        policy.backward(loss)
+        timer.mark('backward')
+        policy.step(optimizer, network_params, args.grad_clip)
+        timer.mark('optimizer')
 
         # add param grads to history
         if args.track_grads:
@@ -407,15 +470,26 @@ def train(train_queue, valid_queue, model, network_params, criterion, optimizer,
                 param_grad_history[i] += param.grad.data.detach().clone().cpu()
 
         prec1, prec5 = pdarts_utils.accuracy(logits, target, topk=(1, 5))
-        objs.update(loss.data.item(), n)
-        top1.update(prec1.data.item(), n)
-        top5.update(prec5.data.item(), n)
+        objs.update(loss, n)
+        top1.update(prec1, n)
+        top5.update(prec5, n)
 
         if step % args.report_freq == 0:
             logging.info('TRAIN Step: %03d Objs: %e R1: %f R5: %f', step, objs.avg, top1.avg, top5.avg)
+        timer.mark('logging')
+        timer.step(n)
+        if profiler is not None:
+            profiler.step()
+
+    if train_arch:
+        # the search pass stops mid-epoch; its thread must leave the loader before infer() reuses it
+        valid_queue_iter.close()
+    timer.summary()
+    distributed.reduce_meter(objs, target.device)
+    distributed.reduce_meter(top1, target.device)
 
     # average arch params and save
-    if args.track_grads:
+    if args.track_grads and distributed.is_main_process():
         for i in range(len(arch_grad_history)):
             arch_grad_history[i] /= len(train_queue)
         full_arch_grad_history.append(arch_grad_history)
@@ -429,159 +503,38 @@ def train(train_queue, valid_queue, model, network_params, criterion, optimizer,
     return top1.avg, objs.avg
 
 
-def infer(valid_queue, model, criterion):
+def infer(valid_queue, model, criterion, policy):
     objs = pdarts_utils.AvgrageMeter()
     top1 = pdarts_utils.AvgrageMeter()
     top5 = pdarts_utils.AvgrageMeter()
     model.eval()
 
-    for step, (input, target) in enumerate(valid_queue):
-        input = input.cuda()
-        target = target.cuda(non_blocking=True)
-        with torch.no_grad():
+    timer = instrumentation.StepTimer('valid', policy.device, args.report_freq,
+                                      trace=args.timing_trace if distributed.is_main_process() else None)
+    for step, (input, target) in enumerate(prefetcher.for_policy(valid_queue, policy)):
+        timer.mark('data')
+        with torch.no_grad(), policy.autocast():
             logits = model(input)
             loss = criterion(logits, target)
+        timer.mark('forward')
 
         prec1, prec5 = pdarts_utils.accuracy(logits, target, topk=(1, 5))
         n = input.size(0)
-        objs.update(loss.data.item(), n)
-        top1.update(prec1.data.item(), n)
-        top5.update(prec5.data.item(), n)
+        objs.update(loss, n)
+        top1.update(prec1, n)
+        top5.update(prec5, n)
 
         if step % args.report_freq == 0:
             logging.info('valid %03d %e %f %f', step, objs.avg, top1.avg, top5.avg)
+        timer.mark('logging')
+        timer.step(n)
 
+    timer.summary()
+    distributed.reduce_meter(objs, target.device)
+    distributed.reduce_meter(top1, target.device)
     return top1.avg, objs.avg
 
 
-def parse_network(switches_normal, switches_reduce):
-
-    def _parse_switches(switches):
-        n = 2
-        start = 0
-        gene = []
-        step = 4
-        for i in range(step):
-            end = start + n
-            for j in range(start, end):
-                for k in range(len(switches[j])):
-                    if switches[j][k]:
-                        gene.append((PRIMITIVES[k], j - start))
-            start = end
-            n = n + 1
-        return gene
-    gene_normal = _parse_switches(switches_normal)
-    gene_reduce = _parse_switches(switches_reduce)
-    
-    concat = range(2, 6)
-    
-    genotype = Genotype(
-        normal=gene_normal, normal_concat=concat, 
-        reduce=gene_reduce, reduce_concat=concat
-    )
-    
-    return genotype
-
-def get_min_k(input_in, k):
-    input = copy.deepcopy(input_in)
-    index = []
-    for i in range(k):
-        idx = np.argmin(input)
-        index.append(idx)
-        input[idx] = 1
-    
-    return index
-def get_min_k_no_zero(w_in, idxs, k):
-    w = copy.deepcopy(w_in)
-    index = []
-    if 0 in idxs:
-        zf = True 
-    else:
-        zf = False
-    if zf:
-        w = w[1:]
-        index.append(0)
-        k = k - 1
-    for i in range(k):
-        idx = np.argmin(w)
-        w[idx] = 1
-        if zf:
-            idx = idx + 1
-        index.append(idx)
-    return index
-        
-def logging_switches(switches):
-    for i in range(len(switches)):
-        ops = []
-        for j in range(len(switches[i])):
-            if switches[i][j]:
-                ops.append(PRIMITIVES[j])
-        logging.info(ops)
-        
-def check_sk_number(switches):
-    count = 0
-    for i in range(len(switches)):
-        if switches[i][3]:
-            count = count + 1
-    
-    return count
-
-def delete_min_sk_prob(switches_in, switches_bk, probs_in):
-    def _get_sk_idx(switches_in, switches_bk, k):
-        if not switches_in[k][3]:
-            idx = -1
-        else:
-            idx = 0
-            for i in range(3):
-                if switches_bk[k][i]:
-                    idx = idx + 1
-        return idx
-    probs_out = copy.deepcopy(probs_in)
-    sk_prob = [1.0 for i in range(len(switches_bk))]
-    for i in range(len(switches_in)):
-        idx = _get_sk_idx(switches_in, switches_bk, i)
-        if not idx == -1:
-            sk_prob[i] = probs_out[i][idx]
-    d_idx = np.argmin(sk_prob)
-    idx = _get_sk_idx(switches_in, switches_bk, d_idx)
-    probs_out[d_idx][idx] = 0.0
-    
-    return probs_out
-
-def keep_1_on(switches_in, probs):
-    switches = copy.deepcopy(switches_in)
-    for i in range(len(switches)):
-        idxs = []
-        for j in range(len(PRIMITIVES)):
-            if switches[i][j]:
-                idxs.append(j)
-        drop = get_min_k_no_zero(probs[i, :], idxs, 2)
-        for idx in drop:
-            switches[i][idxs[idx]] = False            
-    return switches
-
-def keep_2_branches(switches_in, probs):
-    switches = copy.deepcopy(switches_in)
-    final_prob = [0.0 for i in range(len(switches))]
-    for i in range(len(switches)):
-        final_prob[i] = max(probs[i])
-    keep = [0, 1]
-    n = 3
-    start = 2
-    for i in range(3):
-        end = start + n
-        tb = final_prob[start:end]
-        edge = sorted(range(n), key=lambda x: tb[x])
-        keep.append(edge[-1] + start)
-        keep.append(edge[-2] + start)
-        start = end
-        n = n + 1
-    for i in range(len(switches)):
-        if not i in keep:
-            for j in range(len(PRIMITIVES)):
-                switches[i][j] = False  
-    return switches  
-
 if __name__ == '__main__':
     start_time = time.time()
     main() 
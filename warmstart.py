@@ -0,0 +1,77 @@
+import torch
+import torch.nn as nn
+
+from genotypes import PRIMITIVES
+from operations import DilConv, FactorizedReduce, Identity, SepConv, Zero
+
+
+def op_primitive(op):
+    """the PRIMITIVES name of a search op, read from its type (pools wrapped with their
+    BatchNorm and identities with their Dropout are unwrapped)"""
+    if isinstance(op, nn.Sequential):
+        op = op[0]
+    if isinstance(op, Zero):
+        return 'none'
+    if isinstance(op, nn.MaxPool2d):
+        return 'max_pool_3x3'
+    if isinstance(op, nn.AvgPool2d):
+        return 'avg_pool_3x3'
+    if isinstance(op, (Identity, FactorizedReduce)):
+        return 'skip_connect'
+    if isinstance(op, (SepConv, DilConv)):
+        k = op.op[1].kernel_size[0]
+        name = '%s_conv_%dx%d' % ('sep' if isinstance(op, SepConv) else 'dil', k, k)
+        if name in PRIMITIVES:
+            return name
+    raise ValueError('cannot tell the primitive of search op {}'.format(type(op).__name__))
+
+
+def edge_primitives(cell, edge):
+    """the primitives still switched on at `edge` of a search Cell, in m_ops order"""
+    op = cell.cell_ops[edge]
+    if hasattr(op, 'primitives'):
+        return op.primitives
+    # supernets pickled before MixedOp recorded its primitives (nor the Network its
+    # switches): the ops themselves tell what they are
+    return [op_primitive(m) for m in op.m_ops]
+
+
+def copy_matching(dst, src):
+    """copies every tensor of src's state into the entry of dst with the same name
+    and shape; returns the number copied. Search ops have affine-free BatchNorms, so
+    the discrete op keeps its initial (identity) affine parameters."""
+    src_state = src.state_dict()
+    copied = 0
+    with torch.no_grad():
+        for name, tensor in dst.state_dict().items():
+            if name in src_state and src_state[name].shape == tensor.shape:
+                tensor.copy_(src_state[name])
+                copied += 1
+    return copied
+
+
+def inherit_weights(net, supernet):
+    """initializes a NetworkCIFAR from a search Network of the same width and depth
+    (the model-<stage>.pt written by train_search.py --save_full_model): stem,
+    preprocessing, classifier, and every op of the genotype from the same
+    primitive on the same edge of the supernet. Returns (inherited, total) op counts;
+    ops whose primitive was already dropped keep their random initialization."""
+    if len(net.cells) != len(supernet.cells):
+        raise ValueError('network has {} cells, the supernet {}'.format(len(net.cells), len(supernet.cells)))
+    copy_matching(net.stem, supernet.stem)
+    copy_matching(net.classifier, supernet.classifier)
+    inherited = total = 0
+    for cell, search_cell in zip(net.cells, supernet.cells):
+        if cell.reduction != search_cell.reduction:
+            raise ValueError('the network and the supernet reduce at different cells')
+        copy_matching(cell.preprocess0, search_cell.preprocess0)
+        copy_matching(cell.preprocess1, search_cell.preprocess1)
+        for k, (name, index) in enumerate(zip(cell._op_names, cell._indices)):
+            node = k // 2
+            edge = sum(2 + i for i in range(node)) + index
+            primitives = edge_primitives(search_cell, edge)
+            total += 1
+            if name in primitives:
+                copy_matching(cell._ops[k], search_cell.cell_ops[edge].m_ops[primitives.index(name)])
+                inherited += 1
+    return inherited, total
@@ -0,0 +1,317 @@
+"""Training-free ranking of genotypes. Every candidate is built as a small NetworkCIFAR
+(--init_channels/--layers) from the same seed and scored with zero-cost proxies on a
+few training batches:
+
+    grad_norm  sum of the gradient norms of all conv/linear weights
+    snip       sum of |w * dL/dw| (connection sensitivity)
+    synflow    sum of |w * dR/dw| for R the summed output of the all-positive network
+               on an all-ones input (data-free, in float64)
+    jacob_cov  score of the correlation of the input Jacobians of a batch
+
+    python zero_cost.py --data ../data --workers 8 --accuracies runs/*/log.txt eval_results.csv
+    python zero_cost.py --search_logs search-poison-*/log.txt --genotypes none
+
+Candidates are the genotypes of genotypes.py (--genotypes) and every Genotype(...) line
+of the given search logs. The proxies are correlated (Spearman, Kendall) against
+trained accuracies read from train_cifar.py logs and evaluate.py/rank_genotypes.py tables.
+"""
+import argparse
+import ast
+import csv
+import glob
+import logging
+import os
+import re
+import sys
+import time
+import numpy as np
+import torch
+import torch.multiprocessing as mp
+import torch.nn as nn
+
+import execution
+import genotypes
+import pdarts_utils
+from evaluate import load_test_set
+from genotypes import Genotype
+from model import NetworkCIFAR as Network
+from rank_genotypes import candidate_names
+
+
+PROXIES = ['grad_norm', 'snip', 'synflow', 'jacob_cov']
+
+parser = argparse.ArgumentParser("zero_cost")
+parser.add_argument('--genotypes', type=str, default='all', help="comma separated genotype names from genotypes.py, 'all' or 'none'")
+parser.add_argument('--search_logs', type=str, nargs='*', default=[], help='search logs whose Genotype(...) lines are scored too')
+parser.add_argument('--accuracies', type=str, nargs='*', default=[], help='train_cifar.py logs (or their directories) and results tables with trained accuracies')
+parser.add_argument('--data', type=str, default='../data', help='location of the data corpus')
+parser.add_argument('--cifar100', action='store_true', default=False, help='score for cifar100')
+parser.add_argument('--init_channels', type=int, default=16, help='num of init channels of the scored networks')
+parser.add_argument('--layers', type=int, default=8, help='total number of layers of the scored networks')
+parser.add_argument('--batch_size', type=int, default=64, help='batch size')
+parser.add_argument('--batches', type=int, default=2, help='training batches the data-dependent proxies are averaged over')
+parser.add_argument('--proxies', type=str, default=','.join(PROXIES), help='comma separated proxies to compute')
+parser.add_argument('--rank_by', type=str, default='synflow', help='proxy the table is sorted by')
+parser.add_argument('--workers', type=int, default=1, help='scoring processes, spread over the visible gpus')
+parser.add_argument('--seed', type=int, default=0, help='seed of the initialization and the batches')
+parser.add_argument('--save', type=str, default='zero_cost.csv', help='results table (.csv)')
+execution.add_device_args(parser)
+
+log_format = '%(asctime)s %(message)s'
+
+
+def _weights(model):
+    return [p for p in model.parameters() if p.dim() > 1]
+
+
+def grad_scores(model, batches, criterion):
+    """grad_norm and snip, averaged over the batches"""
+    model.train()
+    grad_norm = snip = 0.
+    for input, target in batches:
+        model.zero_grad()
+        logits, _ = model(input)
+        criterion(logits, target).backward()
+        weights = _weights(model)
+        grad_norm += sum(w.grad.norm() for w in weights).item()
+        snip += sum((w * w.grad).abs().sum() for w in weights).item()
+    return grad_norm / len(batches), snip / len(batches)
+
+
+def jacob_cov(model, input):
+    """the correlation score of Mellor et al.: higher when the input Jacobians of
+    different images are less correlated"""
+    model.train()
+    model.zero_grad()
+    input = input.clone().requires_grad_(True)
+    logits, _ = model(input)
+    logits.sum().backward()
+    jacobs = input.grad.reshape(input.size(0), -1).double().cpu().numpy()
+    v = np.linalg.eigvalsh(np.corrcoef(jacobs))
+    k = 1e-5
+    return float(-np.sum(np.log(v + k) + 1. / (v + k)))
+
+
+def synflow(model, input_shape):
+    """modifies the model: weights are made positive and cast to float64"""
+    model.double().eval()
+    with torch.no_grad():
+        for tensor in model.state_dict().values():
+            if tensor.is_floating_point():
+                tensor.abs_()
+    model.zero_grad()
+    device = next(model.parameters()).device
+    logits, _ = model(torch.ones((1,) + tuple(input_shape), dtype=torch.float64, device=device))
+    logits.sum().backward()
+    return sum((w * w.grad).abs().sum() for w in _weights(model)).item()
+
+
+def score_genotype(genotype, num_classes, batches, device, args, proxies):
+    torch.manual_seed(args.seed)
+    model = Network(args.init_channels, num_classes, args.layers, False, genotype).to(device)
+    model.drop_path_prob = 0.0
+    scores = {'params_mb': pdarts_utils.count_parameters_in_MB(model)}
+    if 'grad_norm' in proxies or 'snip' in proxies:
+        scores['grad_norm'], scores['snip'] = grad_scores(model, batches, nn.CrossEntropyLoss())
+    if 'jacob_cov' in proxies:
+        scores['jacob_cov'] = float(np.mean([jacob_cov(model, input) for input, _ in batches]))
+    if 'synflow' in proxies:
+        scores['synflow'] = synflow(model, batches[0][0].shape[1:])
+    return dict((k, v) for k, v in scores.items() if k in proxies or k == 'params_mb')
+
+
+def _literal(node):
+    # range(...) calls of the concat fields, everything else a plain literal
+    if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id == 'range' and not node.keywords:
+        return range(*[ast.literal_eval(arg) for arg in node.args])
+    return ast.literal_eval(node)
+
+
+def parse_genotype(text):
+    """the Genotype of its logged repr, without evaluating the text"""
+    call = ast.parse(text, mode='eval').body
+    if not (isinstance(call, ast.Call) and isinstance(call.func, ast.Name) and call.func.id == 'Genotype') or call.args:
+        raise ValueError('not a logged Genotype: %s' % text)
+    fields = dict((kw.arg, _literal(kw.value)) for kw in call.keywords)
+    if set(fields) != set(Genotype._fields):
+        raise ValueError('not a logged Genotype: %s' % text)
+    return Genotype(**fields)
+
+
+def search_log_genotypes(paths):
+    """(name, genotype) for every Genotype(...) logged by train_search.py, named
+    <log directory>#<index>; the last one of a log is the searched cell"""
+    pattern = re.compile(r'Genotype\(.*\)')
+    found = []
+    for path in paths:
+        with open(path) as f:
+            matches = [pattern.search(line) for line in f]
+        logged = [parse_genotype(m.group(0)) for m in matches if m]
+        name = os.path.basename(os.path.dirname(os.path.abspath(path)))
+        found.extend(('%s#%d' % (name, i), genotype) for i, genotype in enumerate(logged))
+    return found
+
+
+def read_accuracies(paths):
+    """the best trained top-1 per arch name: 'Best_valid_acc' of train_cifar.py logs
+    (the arch is taken from the logged args) and 'top1' of results tables"""
+    arch_re = re.compile(r"arch='([^']+)'")
+    acc_re = re.compile(r'Best_valid_acc: ([0-9.]+)')
+    accuracies = {}
+
+    def record(arch, acc):
+        accuracies[arch] = max(acc, accuracies.get(arch, acc))
+
+    for path in paths:
+        if os.path.isdir(path):
+            path = os.path.join(path, 'log.txt')
+        if path.endswith('.csv'):
+            with open(path, newline='') as f:
+                for row in csv.DictReader(f):
+                    arch = row.get('arch') or row.get('genotype')
+                    if arch and row.get('top1'):
+                        record(arch, float(row['top1']))
+            continue
+        arch = acc = None
+        with open(path) as f:
+            for line in f:
+                m = arch_re.search(line) if arch is None else None
+                if m:
+                    arch = m.group(1)
+                m = acc_re.search(line)
+                if m:
+                    acc = float(m.group(1))
+        if arch is not None and acc is not None:
+            record(arch, acc)
+    return accuracies
+
+
+def _ranks(x):
+    """ranks with ties averaged"""
+    x = np.asarray(x, dtype=np.float64)
+    order = np.argsort(x, kind='mergesort')
+    ranks = np.empty(len(x))
+    ranks[order] = np.arange(len(x))
+    for value in np.unique(x):
+        tied = x == value
+        ranks[tied] = ranks[tied].mean()
+    return ranks
+
+
+def spearman(x, y):
+    return float(np.corrcoef(_ranks(x), _ranks(y))[0, 1])
+
+
+def kendall(x, y):
+    x, y = np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64)
+    dx = np.sign(x[:, None] - x[None, :])
+    dy = np.sign(y[:, None] - y[None, :])
+    iu = np.triu_indices(len(x), 1)
+    concordance = (dx * dy)[iu].sum()
+    norm = np.sqrt((dx[iu] != 0).sum() * (dy[iu] != 0).sum())
+    return float(concordance / norm) if norm else float('nan')
+
+
+_worker = {}
+
+
+def init_worker(args, batches, num_gpus):
+    identity = mp.current_process()._identity
+    index = identity[0] - 1 if identity else 0
+    device = execution.get_device(args.device, index % max(num_gpus, 1))
+    threads = args.threads or max(1, (os.cpu_count() or 1) // max(args.workers, 1))
+    execution.setup_device(device, args.seed, threads)
+    logging.basicConfig(stream=sys.stdout, level=logging.INFO, format=log_format, datefmt='%m/%d %I:%M:%S %p')
+    _worker.update(args=args, device=device,
+                   batches=[(x.to(device), y.to(device)) for x, y in batches])
+
+
+def run_candidate(candidate):
+    name, genotype = candidate
+    args, device = _worker['args'], _worker['device']
+    row = {'genotype': name}
+    start = time.time()
+    try:
+        row.update(score_genotype(genotype, 100 if args.cifar100 else 10, _worker['batches'], device, args,
+                                  args.proxies.split(',')))
+    except Exception as e:
+        logging.warning('%s failed: %r', name, e)
+        row['error'] = repr(e)
+    row['seconds'] = time.time() - start
+    return row
+
+
+def sample_batches(train_set, num_batches, batch_size, seed):
+    images, labels, (mean, std) = train_set
+    g = torch.Generator().manual_seed(seed)
+    index = torch.randperm(images.size(0), generator=g)[:num_batches * batch_size]
+    mean = torch.tensor(mean).view(1, 3, 1, 1)
+    std = torch.tensor(std).view(1, 3, 1, 1)
+    return [(images[i].float().div_(255).sub_(mean).div_(std), labels[i]) for i in index.split(batch_size)]
+
+
+def main():
+    args = parser.parse_args()
+    logging.basicConfig(stream=sys.stdout, level=logging.INFO, format=log_format, datefmt='%m/%d %I:%M:%S %p')
+    logging.info('args = %s', args)
+    proxies = args.proxies.split(',')
+    for proxy in proxies:
+        if proxy not in PROXIES:
+            parser.error('unknown proxy %s, choose from %s' % (proxy, ', '.join(PROXIES)))
+    if args.rank_by not in proxies:
+        parser.error('--rank_by %s is not among --proxies' % args.rank_by)
+
+    names = [] if args.genotypes == 'none' else candidate_names(args.genotypes)
+    unknown = [name for name in names if not isinstance(getattr(genotypes, name, None), Genotype)]
+    if unknown:
+        parser.error('unknown genotypes: %s' % ', '.join(unknown))
+    candidates = [(name, getattr(genotypes, name)) for name in names]
+    candidates += search_log_genotypes([p for pattern in args.search_logs for p in sorted(glob.glob(pattern)) or [pattern]])
+    if not candidates:
+        parser.error('no genotypes to score')
+    accuracies = read_accuracies(args.accuracies)
+    logging.info('%d genotypes to score, trained accuracies of %d archs', len(candidates), len(accuracies))
+
+    dataset = 'cifar100' if args.cifar100 else 'cifar10'
+    batches = sample_batches(load_test_set(dataset, args.data, train=True), args.batches, args.batch_size, args.seed)
+    num_gpus = torch.cuda.device_count() if execution.get_device(args.device).type == 'cuda' else 0
+
+    start = time.time()
+    if args.workers > 1:
+        with mp.get_context('spawn').Pool(args.workers, initializer=init_worker, initargs=(args, batches, num_gpus)) as pool:
+            rows = pool.map(run_candidate, candidates, chunksize=1)
+    else:
+        init_worker(args, batches, num_gpus)
+        rows = [run_candidate(candidate) for candidate in candidates]
+    logging.info('scored %d genotypes in %ds', len(rows), time.time() - start)
+
+    rows.sort(key=lambda r: r.get(args.rank_by, -float('inf')), reverse=True)
+    for rank, row in enumerate(rows):
+        if 'error' not in row:
+            row['rank'] = rank + 1
+        if row['genotype'] in accuracies:
+            row['trained_top1'] = accuracies[row['genotype']]
+    columns = ['rank', 'genotype', 'params_mb'] + proxies + ['trained_top1', 'seconds', 'error']
+    with open(args.save, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=columns)
+        writer.writeheader()
+        writer.writerows(rows)
+    for row in rows[:20]:
+        if 'error' not in row:
+            logging.info('%4d %-24s %s%s', row['rank'], row['genotype'],
+                         ' '.join('%s %.4g' % (p, row[p]) for p in proxies),
+                         ' | trained %.2f' % row['trained_top1'] if 'trained_top1' in row else '')
+    logging.info('ranking written to %s', args.save)
+
+    known = [row for row in rows if 'trained_top1' in row and 'error' not in row]
+    if len(known) < 3:
+        logging.info('%d scored genotypes have a trained accuracy, no correlation reported', len(known))
+        return
+    accuracy = [row['trained_top1'] for row in known]
+    for key in proxies + ['params_mb']:
+        logging.info('%-10s vs trained top1 over %d genotypes: spearman %.3f, kendall %.3f', key, len(known),
+                     spearman([row[key] for row in known], accuracy), kendall([row[key] for row in known], accuracy))
+
+
+if __name__ == '__main__':
+    main()